@@ -18,50 +18,23 @@
 #  $Author: ubuntu $:
 #  $Date: 2013-01-13 11:49:04 +0100 (Sun, 13 Jan 2013) $:
 #
-# An example of how to add a new case to the tool.
+# An example of how to add a new case to the tool.  With --batch, reads many cases
+# from a file or stdin and sends them over one connection.
 # Stores a cache of the details so it can be updated again later
 
 import os
 import urllib2
+import urlparse
+import httplib
 import json
 import sys
-try:
-	server=sys.argv[1]
-	caseName=sys.argv[2]
-	caseDir=sys.argv[3]
-	caseOwner=sys.argv[4]
-	jobId=sys.argv[5]
-except IndexError:
-	print "Usage: addMonitor <url> <caseName> <caseDir> <caseOwner> <jobId>"
-	sys.exit(1)
 
-# case ID is stored in this file so it can be loaded later
-cacheFile=os.path.join(caseDir,".monitorsCache")
-# Try to open the cache file
-try:
-	cache=open(cacheFile, 'r')
-	data=json.load(cache)
-	cache.close()
-	# Cache file has been loaded, this means the case exists
-	# So just add the LSF job ID to the case, this avoids
-	# having lots of cases with the same name.
-	case=data['id']
-	data={
-			'name':'jobId',
-			'value':jobId,
-		}
-	# Add the LSF Job ID to the case
-	url="%s/%s/feature/LSF/option/add" % (server, case)
-	jdata=json.dumps(data)
-	urllib2.urlopen(url, jdata)
-except urllib2.HTTPError, e:
-	# Talking to the Server failed, so just dump the error message and give up
-	print e.read()
-except IOError :
-	# Couldn't open the cache file, so create a new case
-	url="%s/create" % server
-	print ("No cache found, creating new case.")
-	data={
+## Number of cases sent in each request in batch mode.
+BATCH_SIZE=200
+
+## Returns the data to send to the server to create a case.
+def caseSpec(caseName, caseDir, caseOwner, jobId):
+	return {
 		# Required name of the case, freeform text field,
 		'name':  caseName,
 		# Required username - nldir1/nlpveh/etc.
@@ -97,6 +70,153 @@ except IOError :
 		'options':[
 			{'name':'caseDir', 'value':caseDir},
 		]}
+
+## Returns the data to send to the server to add a job to an existing case.
+def jobSpec(jobId):
+	return {
+			'name':'jobId',
+			'value':jobId,
+		}
+
+## Returns the path of the file the case ID is stored in, so it can be loaded later.
+def cacheFilePath(caseDir):
+	return os.path.join(caseDir,".monitorsCache")
+
+## Returns the ID of the case in caseDir from its cache file, or None if there is none.
+def cachedCase(caseDir):
+	try:
+		cache=open(cacheFilePath(caseDir), 'r')
+		try:
+			return json.load(cache)['id']
+		finally:
+			cache.close()
+	except (IOError, ValueError, KeyError):
+		return None
+
+## A single connection to the server, kept open for every request sent in batch mode.
+class Connection(object):
+	def __init__(self, server):
+		url=urlparse.urlsplit(server)
+		if url.scheme == 'https':
+			self.connection=httplib.HTTPSConnection(url.netloc)
+		else:
+			self.connection=httplib.HTTPConnection(url.netloc)
+		self.path=url.path.rstrip("/")
+
+	## Posts data as JSON to path below the server URL and returns the body of the response.
+	#  Raises IOError if the server does not reply with 200 OK.
+	def post(self, path, data):
+		self.connection.request('POST', self.path+path, json.dumps(data), {'Content-Type':'application/json'})
+		response=self.connection.getresponse()
+		body=response.read()
+		if response.status != 200:
+			raise IOError("%s %s: %s" % (response.status, response.reason, body))
+		return body
+
+	def close(self):
+		self.connection.close()
+
+## Adds the job jobId to the existing case with the given ID over connection, printing
+#  any error.
+def addJob(connection, case, jobId):
+	try:
+		connection.post("/%s/feature/LSF/option/add" % case, jobSpec(jobId))
+	except IOError, e:
+		print e
+
+## Adds or updates the cases listed in the file f, one case per line given as
+#  <caseName> <caseDir> <caseOwner> <jobId>.  Jobs of cases that already exist are added
+#  one request at a time, new cases are created BATCH_SIZE at a time, all over a single
+#  connection.  Lines that share a caseDir, such as several jobs of one case, create the
+#  case once, the other jobs are added to it once it has been created.
+def batch(server, f):
+	connection=Connection(server)
+	try:
+		new=[]
+		# The jobs of each new case after the one it is created with.
+		jobs={}
+		for line in f:
+			fields=line.split()
+			if not fields or fields[0].startswith("#"):
+				continue
+			if len(fields) != 4:
+				print "Ignoring line: %s" % line.strip()
+				continue
+			(caseName, caseDir, caseOwner, jobId)=fields
+			case=cachedCase(caseDir)
+			if case is not None:
+				addJob(connection, case, jobId)
+			elif caseDir in jobs:
+				jobs[caseDir].append(jobId)
+			else:
+				new.append((caseDir, caseSpec(caseName, caseDir, caseOwner, jobId)))
+				jobs[caseDir]=[]
+		print ("%d new cases to create." % len(new))
+		for start in range(0, len(new), BATCH_SIZE):
+			chunk=new[start:start+BATCH_SIZE]
+			try:
+				created=json.loads(connection.post("/create/batch", [spec for (caseDir, spec) in chunk]))
+			except IOError, e:
+				print e
+				continue
+			for ((caseDir, spec), data) in zip(chunk, created):
+				cache=open(cacheFilePath(caseDir), 'w')
+				cache.write(json.dumps(data))
+				cache.close()
+				for jobId in jobs[caseDir]:
+					addJob(connection, data['id'], jobId)
+	finally:
+		connection.close()
+
+if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+	# Batch mode, cases are read from a file or stdin.
+	try:
+		server=sys.argv[2]
+	except IndexError:
+		print "Usage: addMonitor --batch <url> [<file>]"
+		sys.exit(1)
+	if len(sys.argv) > 3:
+		f=open(sys.argv[3], 'r')
+	else:
+		f=sys.stdin
+	batch(server, f)
+	sys.exit(0)
+
+try:
+	server=sys.argv[1]
+	caseName=sys.argv[2]
+	caseDir=sys.argv[3]
+	caseOwner=sys.argv[4]
+	jobId=sys.argv[5]
+except IndexError:
+	print "Usage: addMonitor <url> <caseName> <caseDir> <caseOwner> <jobId>"
+	print "       addMonitor --batch <url> [<file>]"
+	sys.exit(1)
+
+# case ID is stored in this file so it can be loaded later
+cacheFile=cacheFilePath(caseDir)
+# Try to open the cache file
+try:
+	cache=open(cacheFile, 'r')
+	data=json.load(cache)
+	cache.close()
+	# Cache file has been loaded, this means the case exists
+	# So just add the LSF job ID to the case, this avoids
+	# having lots of cases with the same name.
+	case=data['id']
+	data=jobSpec(jobId)
+	# Add the LSF Job ID to the case
+	url="%s/%s/feature/LSF/option/add" % (server, case)
+	jdata=json.dumps(data)
+	urllib2.urlopen(url, jdata)
+except urllib2.HTTPError, e:
+	# Talking to the Server failed, so just dump the error message and give up
+	print e.read()
+except IOError :
+	# Couldn't open the cache file, so create a new case
+	url="%s/create" % server
+	print ("No cache found, creating new case.")
+	data=caseSpec(caseName, caseDir, caseOwner, jobId)
 	jdata=json.dumps(data)
 	try:
 		# Try to create a new case
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+#  Copyright 2011 David Irvine
+#
+#  This file is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This file is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with This file.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Writes synthetic OpenFOAM logs and case trees for the benchmarks.  A log is
+# written as pimpleFoam would, with a banner, several outer iterations per time
+# step, a mix of linear solvers, continuity errors and a forceCoeffs block.  A
+# run with restarts is split into segments, each restarting from a time step a
+# little before the end of the one before, as a run restarted from its last
+# write time would.  For example, to write a 1 GB log split by two restarts and
+# a case tree with 40 galleries of 100 images:
+#
+#   python percyval/benchmarks/generate.py --size 1024 --restarts 2 --galleries 40 --images 100 /tmp/case
+
+import os
+import gzip
+import random
+from optparse import OptionParser
+
+BANNER="""/*---------------------------------------------------------------------------*\\
+| =========                 |                                                 |
+| \\\\      /  F ield         | OpenFOAM: The Open Source CFD Toolbox           |
+|  \\\\    /   O peration     | Version:  2.1.1                                 |
+|   \\\\  /    A nd           | Web:      www.OpenFOAM.org                      |
+|    \\\\/     M anipulation  |                                                 |
+\\*---------------------------------------------------------------------------*/
+Build  : 2.1.1-221db2718bbb
+Exec   : pimpleFoam -parallel
+Date   : Jan 13 2013
+Time   : 11:49:04
+nProcs : 16
+
+Create time
+
+Create mesh for time = %(time)s
+
+Reading field p
+
+Reading field U
+
+Starting time loop
+
+"""
+
+STEP_START="""Courant Number mean: %(mean).6g max: %(max).6g
+deltaT = 0.001
+Time = %(time)s
+
+"""
+
+OUTER="""PIMPLE: iteration %(iteration)d
+%(uSolver)s:  Solving for Ux, Initial residual = %(ux).6g, Final residual = %(uxf).6g, No Iterations %(n1)d
+%(uSolver)s:  Solving for Uy, Initial residual = %(uy).6g, Final residual = %(uyf).6g, No Iterations %(n1)d
+%(uSolver)s:  Solving for Uz, Initial residual = %(uz).6g, Final residual = %(uzf).6g, No Iterations %(n1)d
+GAMG:  Solving for p, Initial residual = %(p).6g, Final residual = %(pf).6g, No Iterations %(n2)d
+time step continuity errors : sum local = %(local).6g, global = %(global).6g, cumulative = %(cumulative).6g
+DICPCG:  Solving for p, Initial residual = %(p2).6g, Final residual = %(p2f).6g, No Iterations %(n3)d
+time step continuity errors : sum local = %(local).6g, global = %(global).6g, cumulative = %(cumulative).6g
+"""
+
+STEP_END="""smoothSolver:  Solving for k, Initial residual = %(k).6g, Final residual = %(kf).6g, No Iterations %(n1)d
+smoothSolver:  Solving for omega, Initial residual = %(omega).6g, Final residual = %(omegaf).6g, No Iterations %(n1)d
+ExecutionTime = %(execution).2f s  ClockTime = %(clock)d s
+
+forceCoeffs forces output:
+    Cm    = %(cm).6g
+    Cd    = %(cd).6g
+    Cl    = %(cl).6g
+    Cl(f) = %(clf).6g
+    Cl(r) = %(clr).6g
+
+"""
+
+## A minimal PNG image, the galleries are only listed so the contents do not matter.
+PNG=("89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+		"1f15c4890000000d49444154789c6300010000050001"
+		"0d0a2db40000000049454e44ae426082").decode("hex")
+
+## Returns the text of the time step step, for a run seeded with rnd.
+def timeStep(rnd, step):
+	decay=1.0/(1+step*0.01)
+	values={
+			'time':"%g" % (step*0.001),
+			'mean':0.05+rnd.random()*0.01,
+			'max':0.5+rnd.random()*0.2,
+			'uSolver':'smoothSolver' if step % 2 else 'DILUPBiCG',
+			'n1':rnd.randint(1, 4),
+			'n2':rnd.randint(5, 20),
+			'n3':rnd.randint(10, 40),
+			'local':rnd.random()*1e-8,
+			'global':(rnd.random()-0.5)*1e-18,
+			'cumulative':(rnd.random()-0.5)*1e-16,
+			'execution':step*0.41,
+			'clock':int(step*0.42),
+			'cm':0.01*rnd.random(),
+			'cd':1.2+0.1*rnd.random(),
+			'cl':0.3+0.05*rnd.random(),
+			'clf':0.15+0.02*rnd.random(),
+			'clr':0.15+0.02*rnd.random(),
+			}
+	for name in ['ux', 'uy', 'uz', 'p', 'p2', 'k', 'omega']:
+		values[name]=decay*(0.5+rnd.random())
+		values[name+"f"]=values[name]*1e-3
+	parts=[STEP_START % values]
+	for iteration in range(1, rnd.randint(1, 3)+1):
+		values['iteration']=iteration
+		parts.append(OUTER % values)
+	parts.append(STEP_END % values)
+	return "".join(parts)
+
+## Writes a log of at least size bytes to the file f, starting at time step first, and
+#  returns the next time step.
+def writeSteps(f, size, first, seed):
+	rnd=random.Random(seed)
+	step=first
+	written=0
+	f.write(BANNER % {'time':"%g" % (first*0.001)})
+	while written < size:
+		steps=[]
+		for i in range(1000):
+			step+=1
+			steps.append(timeStep(rnd, step))
+		text="".join(steps)
+		f.write(text)
+		written+=len(text)
+	return step+1
+
+## Writes a log of at least size bytes to path.
+def writeLog(path, size, seed=0):
+	f=open(path, 'w')
+	try:
+		writeSteps(f, size, 0, seed)
+	finally:
+		f.close()
+
+## Writes a run with restarts to directory dir, as the segments name.1, name.2 and so on
+#  with the live segment last, named name.  Each segment restarts a few hundred steps before
+#  the end of the one before, and all but the live segment are compressed with gzip if
+#  compress is set.  Returns the paths of the segments, oldest first.
+def writeRun(dir, name, size, restarts, compress=False, seed=0):
+	paths=[]
+	step=0
+	segmentSize=size//(restarts+1)
+	for segment in range(restarts+1):
+		if segment == restarts:
+			path=os.path.join(dir, name)
+			f=open(path, 'w')
+		elif compress:
+			path=os.path.join(dir, "%s.%d.gz" % (name, segment+1))
+			f=gzip.open(path, 'wb', 1)
+		else:
+			path=os.path.join(dir, "%s.%d" % (name, segment+1))
+			f=open(path, 'w')
+		try:
+			step=writeSteps(f, segmentSize, max(step-300, 0), seed+segment)
+		finally:
+			f.close()
+		# Segments are read in the order they were modified.
+		os.utime(path, (1000000000+segment, 1000000000+segment))
+		paths.append(path)
+	return paths
+
+## Writes a case tree to base with galleries directories of images images each, and movies
+#  webm files spread across the galleries.
+def writeCaseTree(base, galleries, images, movies=0):
+	for gallery in range(galleries):
+		dir=os.path.join(base, "gallery%04d" % gallery)
+		os.makedirs(dir)
+		for image in range(images):
+			f=open(os.path.join(dir, "frame%05d.png" % image), 'wb')
+			f.write(PNG)
+			f.close()
+	for movie in range(movies):
+		open(os.path.join(base, "gallery%04d" % (movie % max(galleries, 1)), "movie%04d.webm" % movie), 'wb').close()
+
+if __name__ == '__main__':
+	options=OptionParser(usage="%prog [options] <case directory>")
+	options.add_option('--size', type='int', default=10, help="Size of the log in MB.")
+	options.add_option('--restarts', type='int', default=0, help="Number of times the run is restarted.")
+	options.add_option('--compress', action='store_true', default=False, help="Compress the segments before the live one.")
+	options.add_option('--galleries', type='int', default=0, help="Number of image galleries.")
+	options.add_option('--images', type='int', default=0, help="Number of images in each gallery.")
+	options.add_option('--movies', type='int', default=0, help="Number of movies.")
+	options.add_option('--seed', type='int', default=0, help="Seed for the values in the log.")
+	(opts, args)=options.parse_args()
+	if len(args) != 1:
+		options.error("The case directory must be given.")
+	base=args[0]
+	if not os.path.isdir(base):
+		os.makedirs(base)
+	for path in writeRun(base, "log.pimpleFoam", opts.size*1024*1024, opts.restarts, opts.compress, opts.seed):
+		print "Wrote %s" % path
+	writeCaseTree(base, opts.galleries, opts.images, opts.movies)
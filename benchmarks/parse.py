@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#  Copyright 2011 David Irvine
+#
+#  This file is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This file is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with This file.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Times a cold parse of a synthetic OpenFOAM log in a single process and in
+# parallel with increasing numbers of worker processes.  Run it from the
+# directory that holds the percyval package:
+#
+#   python percyval/benchmarks/parse.py --size 512 --workers 1,2,4,8
+#
+# Run it on a machine with at least as many cores as the largest number of
+# workers, the speedup cannot exceed the number of cores.  This is the parsing
+# done by the ingestlogs command, views never parse in parallel.
+
+import os
+import sys
+import time
+import tempfile
+import multiprocessing
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from percyval.foamlog import FOAMLogParser
+from percyval.series import refreshStores
+from generate import writeLog
+
+## Returns the seconds taken to parse the log at path from the start and the seconds of
+#  that spent refreshing the series, in pool if one is given, as FOAMLogParser.update does.
+def timeParse(path, pool):
+	parser=FOAMLogParser(path)
+	start=time.time()
+	f=open(path, 'rb')
+	try:
+		if pool is None:
+			parser.parseTo(f)
+		else:
+			parser.parseParallel(f, os.fstat(f.fileno()).st_size, pool)
+	finally:
+		f.close()
+	parsed=time.time()
+	if pool is None:
+		for store in parser.stores().values():
+			store.refresh()
+	else:
+		refreshStores(parser.stores().values(), pool)
+	end=time.time()
+	return (end-start, end-parsed)
+
+if __name__ == '__main__':
+	options=OptionParser()
+	options.add_option('--size', type='int', default=256, help="Size of the log in MB.")
+	options.add_option('--workers', default="1,2,4,8", help="Comma separated numbers of worker processes.")
+	options.add_option('--log', help="Parse this log instead of writing a synthetic one.")
+	(opts, args)=options.parse_args()
+	path=opts.log
+	if path is None:
+		(fd, path)=tempfile.mkstemp(suffix=".log")
+		os.close(fd)
+		print "Writing %d MB log to %s" % (opts.size, path)
+		writeLog(path, opts.size*1024*1024)
+	try:
+		size=os.path.getsize(path)
+		print "%d cores, speedups beyond that are not expected" % multiprocessing.cpu_count()
+		(serial, refresh)=timeParse(path, None)
+		print "%-10s %8.2fs %8.1f MB/s  refresh %6.2fs" % ("serial", serial, size/serial/1024/1024, refresh)
+		for workers in [int(w) for w in opts.workers.split(",")]:
+			pool=multiprocessing.Pool(workers)
+			try:
+				(elapsed, refresh)=timeParse(path, pool)
+			finally:
+				pool.close()
+				pool.join()
+			print "%-10s %8.2fs %8.1f MB/s  refresh %6.2fs %6.2fx" % ("%d workers" % workers, elapsed, size/elapsed/1024/1024, refresh, serial/elapsed)
+	finally:
+		if opts.log is None:
+			os.remove(path)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+#  Copyright 2011 David Irvine
+#
+#  This file is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This file is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with This file.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Runs the benchmarks against synthetic logs and case trees written by
+# generate.py, and compares the results with the baselines stored by an earlier
+# run.  Each benchmark runs in a process of its own, so the peak memory
+# reported is its own.  Run it from the directory that holds the percyval
+# package, first storing the baselines on the machine the benchmarks will be
+# run on:
+#
+#   python percyval/benchmarks/run.py --size 100 --save
+#   python percyval/benchmarks/run.py --size 100
+#
+# The second run exits with status 1 if the throughput of any benchmark has
+# dropped, or its peak memory grown, by more than --tolerance.  The plot-data
+# benchmark sets up django itself, with an in-memory database, and times
+# requests through the plotData view.
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import resource
+import tempfile
+import multiprocessing
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from percyval.foamlog import FOAMLogParser
+from percyval.series import SeriesChain
+from percyval.fsindex import CaseIndex
+from generate import writeLog, writeRun, writeCaseTree, writeSteps
+
+MB=1024.0*1024.0
+
+## Default file the baselines are stored in.
+BASELINES=os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+## Returns the seconds taken to parse the log at path from the start, and the bytes parsed.
+def coldParse(dir, opts):
+	path=os.path.join(dir, "log.cold")
+	parser=FOAMLogParser(path)
+	start=time.time()
+	parser.update()
+	return (time.time()-start, os.path.getsize(path))
+
+## Returns the seconds taken to parse the steps appended to a log, a MB at a time, once the
+#  rest of it has been parsed, and the bytes parsed.
+def incrementalParse(dir, opts):
+	path=os.path.join(dir, "log.incremental")
+	shutil.copyfile(os.path.join(dir, "log.cold"), path)
+	parser=FOAMLogParser(path)
+	parser.update()
+	step=int(parser.time*1000)+1
+	elapsed=0
+	size=0
+	for i in range(opts.appends):
+		f=open(path, 'a')
+		step=writeSteps(f, MB, step, i)
+		f.close()
+		start=time.time()
+		parser.update()
+		elapsed+=time.time()-start
+		size+=MB
+	return (elapsed, size)
+
+## Returns the seconds taken to parse the segments of a run with restarts and join them, and
+#  the bytes of log text parsed, most of which is compressed.
+def restartChain(dir, opts):
+	paths=[os.path.join(dir, "run", name) for name in sorted(os.listdir(os.path.join(dir, "run")))]
+	paths.sort(key=os.path.getmtime)
+	start=time.time()
+	parsers=[]
+	for path in paths:
+		parser=FOAMLogParser(path)
+		parser.update()
+		parsers.append(parser)
+	for name in FOAMLogParser.STORES:
+		SeriesChain().update([getattr(parser, name) for parser in parsers])
+	return (time.time()-start, opts.size*MB)
+
+## Returns the seconds taken by random range queries on the residuals, as made by plotData,
+#  and the number of queries.
+def rangeQuery(dir, opts):
+	parser=FOAMLogParser(os.path.join(dir, "log.cold"))
+	parser.update()
+	store=parser.residuals
+	rnd=random.Random(0)
+	(first, last)=(store[store.names()[0]].getMinTime(), store[store.names()[0]].getMaxTime())
+	points=15000//max(len(store), 1)
+	start=time.time()
+	for i in range(opts.queries):
+		(a, b)=sorted([rnd.uniform(first, last), rnd.uniform(first, last)])
+		for series in store.sortedSeries():
+			series.query(a, b, points, 'lttb')
+	return (time.time()-start, opts.queries)
+
+# Sets up django in this process with an in-memory database holding a case whose residuals
+# plot reads the log written to dir, and returns the plot feature.
+def _plotFeature(dir):
+	from django.conf import settings
+	settings.configure(
+			DATABASES={'default':{'ENGINE':'django.db.backends.sqlite3', 'NAME':':memory:'}},
+			INSTALLED_APPS=['django.contrib.auth', 'django.contrib.contenttypes', 'percyval'],
+			MEDIA_ROOT=dir,
+			)
+	from django.core.management import call_command
+	from django.contrib.auth.models import User
+	from percyval.models import Case
+	call_command('syncdb', interactive=False, verbosity=0)
+	case=Case.objects.create(name="benchmark", owner=User.objects.create(username="benchmark"))
+	case.options.create(name="caseDir", value=".")
+	feature=case.features.create(name="FOAMResiduals")
+	feature.options.create(name="logFile", value="log.cold")
+	return feature
+
+## Returns the seconds taken by plotData requests for random ranges of the residuals, each
+#  read, downsampled, encoded and compressed by the view as for a browser, and the number of
+#  requests.
+def plotDataRequests(dir, opts):
+	feature=_plotFeature(dir)
+	from django.test.client import RequestFactory
+	from percyval.views import plotData
+	factory=RequestFactory()
+	(first, last)=(feature.getMinTime(), feature.getMaxTime())
+	rnd=random.Random(0)
+	start=time.time()
+	for i in range(opts.queries):
+		(a, b)=sorted([rnd.uniform(first, last), rnd.uniform(first, last)])
+		request=factory.get('/', {'points':1000, 'format':'columns'}, HTTP_ACCEPT_ENCODING='gzip')
+		response=plotData(request, str(feature.case.id), str(feature.id), repr(a), repr(b))
+		if response.status_code != 200:
+			raise RuntimeError("plotData returned %d: %s" % (response.status_code, response.content))
+	return (time.time()-start, opts.queries)
+
+# Lists every image in the case tree at base through index, as ImageGallery.getImages does.
+def _listImages(index):
+	count=0
+	for dir in index.subDirs():
+		for file in index.listDir(dir.path):
+			if (file.name.endswith(".jpg") or file.name.endswith(".png")) and file.isFile:
+				count+=1
+	return count
+
+## Returns the seconds taken to list the images of a case tree that has not been read
+#  before, and the number of images.
+def galleryCold(dir, opts):
+	start=time.time()
+	count=_listImages(CaseIndex(os.path.join(dir, "tree")))
+	return (time.time()-start, count)
+
+## Returns the seconds taken to list the images of a case tree again once it has been read,
+#  and the number of images.
+def galleryWarm(dir, opts):
+	index=CaseIndex(os.path.join(dir, "tree"))
+	_listImages(index)
+	start=time.time()
+	count=0
+	for i in range(10):
+		count+=_listImages(index)
+	return (time.time()-start, count)
+
+## The benchmarks, as (name, function, unit of the amount returned, divisor of the amount).
+BENCHMARKS=[
+		('cold-parse', coldParse, 'MB/s', MB),
+		('incremental-parse', incrementalParse, 'MB/s', MB),
+		('restart-chain', restartChain, 'MB/s', MB),
+		('range-query', rangeQuery, 'queries/s', 1),
+		('plot-data', plotDataRequests, 'requests/s', 1),
+		('gallery-cold', galleryCold, 'images/s', 1),
+		('gallery-warm', galleryWarm, 'images/s', 1),
+		]
+
+# Runs the benchmark called name in this process and returns (rate, peak memory in MB).
+def _run(name, dir, opts):
+	function=dict([(b[0], b[1]) for b in BENCHMARKS])[name]
+	divisor=dict([(b[0], b[3]) for b in BENCHMARKS])[name]
+	(elapsed, amount)=function(dir, opts)
+	# ru_maxrss is in kB on Linux.
+	peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+	return (amount/divisor/max(elapsed, 1e-9), peak)
+
+## Runs the benchmark called name repeat times, each in a new process, and returns the best
+#  rate and the largest peak memory.
+def runBenchmark(name, dir, opts):
+	results=[]
+	for i in range(opts.repeat):
+		pool=multiprocessing.Pool(1)
+		try:
+			results.append(pool.apply(_run, (name, dir, opts)))
+		finally:
+			pool.close()
+			pool.join()
+	return (max([rate for (rate, peak) in results]), max([peak for (rate, peak) in results]))
+
+## Writes the logs and case tree used by the benchmarks to dir.
+def prepare(dir, opts):
+	writeLog(os.path.join(dir, "log.cold"), opts.size*MB)
+	os.mkdir(os.path.join(dir, "run"))
+	writeRun(os.path.join(dir, "run"), "log.pimpleFoam", opts.size*MB, 2, True)
+	writeCaseTree(os.path.join(dir, "tree"), opts.galleries, opts.images)
+
+## Returns the options that change the results, stored with the baselines so results are
+#  only compared with baselines from the same setup.
+def setup(opts):
+	return {'size':opts.size, 'appends':opts.appends, 'queries':opts.queries, 'galleries':opts.galleries, 'images':opts.images}
+
+if __name__ == '__main__':
+	options=OptionParser()
+	options.add_option('--size', type='int', default=10, help="Size of the logs in MB.")
+	options.add_option('--appends', type='int', default=10, help="MB appended to the log, a MB at a time, for the incremental parse.")
+	options.add_option('--queries', type='int', default=200, help="Number of range queries.")
+	options.add_option('--galleries', type='int', default=20, help="Number of image galleries.")
+	options.add_option('--images', type='int', default=250, help="Number of images in each gallery.")
+	options.add_option('--repeat', type='int', default=3, help="Times each benchmark is run, the best is kept.")
+	options.add_option('--only', help="Comma separated names of the benchmarks to run.")
+	options.add_option('--baselines', default=BASELINES, help="File the baselines are stored in.")
+	options.add_option('--save', action='store_true', default=False, help="Store the results as the baselines.")
+	options.add_option('--tolerance', type='float', default=0.2, help="Fraction results may drop by before a run fails.")
+	options.add_option('--dir', help="Directory to write the synthetic data to, a temporary directory by default.")
+	(opts, args)=options.parse_args()
+	names=[b[0] for b in BENCHMARKS]
+	if opts.only:
+		names=[name for name in names if name in opts.only.split(",")]
+	baselines=None
+	if not opts.save:
+		try:
+			f=open(opts.baselines, 'r')
+			baselines=json.load(f)
+			f.close()
+		except IOError:
+			print "No baselines in %s, run with --save to store them." % opts.baselines
+		if baselines is not None and baselines['setup'] != setup(opts):
+			print "The baselines in %s are for %s, not comparing." % (opts.baselines, baselines['setup'])
+			baselines=None
+	dir=opts.dir or tempfile.mkdtemp()
+	try:
+		if not os.path.exists(os.path.join(dir, "log.cold")):
+			print "Writing synthetic data to %s" % dir
+			prepare(dir, opts)
+		units=dict([(b[0], b[2]) for b in BENCHMARKS])
+		results={}
+		failed=False
+		for name in names:
+			(rate, peak)=runBenchmark(name, dir, opts)
+			results[name]={'rate':rate, 'peak':peak}
+			line="%-18s %12.1f %-10s peak %8.1f MB" % (name, rate, units[name], peak)
+			baseline=baselines and baselines['results'].get(name)
+			if baseline:
+				line+="   baseline %12.1f, peak %8.1f MB" % (baseline['rate'], baseline['peak'])
+				if rate < baseline['rate']*(1-opts.tolerance) or peak > baseline['peak']*(1+opts.tolerance):
+					line+="   REGRESSION"
+					failed=True
+			print line
+	finally:
+		if opts.dir is None:
+			shutil.rmtree(dir)
+	if opts.save:
+		f=open(opts.baselines, 'w')
+		json.dump({'setup':setup(opts), 'results':results}, f, indent=1, sort_keys=True)
+		f.close()
+		print "Stored the baselines in %s" % opts.baselines
+	if failed:
+		sys.exit(1)
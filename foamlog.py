@@ -0,0 +1,413 @@
+#  Copyright 2011 David Irvine
+#
+#  This file is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This file is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with This file.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import bz2
+import gzip
+import logging
+import subprocess
+from percyval.series import SeriesStore, refreshStores
+
+log = logging.getLogger(__name__)
+
+try:
+	import lzma
+except ImportError:
+	try:
+		from backports import lzma
+	except ImportError:
+		lzma=None
+
+## Reads the output of xz -dc, used to read .xz files when the lzma module is not available.
+class XZPipe(object):
+	def __init__(self, path):
+		self.process=subprocess.Popen(["xz", "-dc", path], stdout=subprocess.PIPE)
+
+	def read(self, size):
+		return self.process.stdout.read(size)
+
+	def close(self):
+		self.process.stdout.close()
+		if self.process.wait() not in [0, -13]:
+			raise IOError("xz failed to read the log")
+
+## Opens the xz compressed file at path.
+def openXZ(path):
+	if lzma is not None:
+		return lzma.LZMAFile(path)
+	return XZPipe(path)
+
+## Functions that open a compressed log for reading, keyed by file extension.  Compressed logs
+#  are rotated segments of a run that has moved on, they are read in one pass and never again
+#  unless they change.
+DECOMPRESSORS={
+		'.gz':gzip.open,
+		'.bz2':bz2.BZ2File,
+		'.xz':openXZ,
+		}
+
+## Line matchers, keyed by the first word of the lines they read.  Each is called
+#  with the parser and the line.
+MATCHERS={}
+
+## Registers the decorated function as the matcher for lines starting with any
+#  of the given words.
+def matcher(*words):
+	def register(function):
+		for word in words:
+			MATCHERS[word]=function
+		return function
+	return register
+
+@matcher("Time")
+def matchTime(parser, line):
+	if not line.startswith("Time = "):
+		return
+	if parser.outerIterations:
+		parser.pimple.append("Outer iterations", parser.time, parser.outerIterations)
+		parser.outerIterations=0
+	parser.completeTime=parser.time
+	parser.time=float(line[7:])
+
+## Linear solver output, for example
+#  DILUPBiCG:  Solving for Ux, Initial residual = 1, Final residual = 2e-06, No Iterations 1
+@matcher("DILUPBiCG:", "DILUPBiCGStab:", "DICPCG:", "GAMG:", "PBiCG:", "PBiCGStab:",
+		"PCG:", "PPCG:", "smoothSolver:", "diagonal:")
+def matchSolver(parser, line):
+	words=line.split()
+	try:
+		fname=words[3].rstrip(",")
+		fvalue=float(words[7].rstrip(","))
+	except (IndexError, ValueError):
+		return
+	parser.residuals.append(fname, parser.time, fvalue)
+
+## Courant Number mean: 0.01 max: 0.2
+@matcher("Courant")
+def matchCourant(parser, line):
+	words=line.split()
+	try:
+		parser.courant.append("mean", parser.time, float(words[3]))
+		parser.courant.append("max", parser.time, float(words[5]))
+	except (IndexError, ValueError):
+		pass
+
+## time step continuity errors : sum local = 1e-08, global = 1e-19, cumulative = 1e-18
+@matcher("time")
+def matchContinuity(parser, line):
+	if not line.startswith("time step continuity errors"):
+		return
+	for part in line.partition(":")[2].split(","):
+		(name, equals, value)=part.partition("=")
+		try:
+			parser.continuity.append(name.strip(), parser.time, float(value))
+		except ValueError:
+			pass
+
+## ExecutionTime = 1.5 s  ClockTime = 2 s
+@matcher("ExecutionTime")
+def matchExecutionTime(parser, line):
+	words=line.split()
+	try:
+		parser.executionTime.append("ExecutionTime", parser.time, float(words[2]))
+		parser.executionTime.append("ClockTime", parser.time, float(words[6]))
+	except (IndexError, ValueError):
+		pass
+
+## PIMPLE: iteration 2.  The number of outer iterations in a time step is stored
+#  when the next time step starts.
+@matcher("PIMPLE:")
+def matchPimple(parser, line):
+	words=line.split()
+	if len(words) >= 3 and words[1].lower() == "iteration":
+		try:
+			parser.outerIterations=int(words[2])
+		except ValueError:
+			pass
+
+## forceCoeffs output: or forceCoeffs <name> output:, the coefficients follow on
+#  indented lines.
+@matcher("forceCoeffs")
+def matchForceCoeffs(parser, line):
+	if line.rstrip().endswith(":"):
+		parser.searchCoeffs=True
+
+## Incremental parser for OpenFOAM log files.  The parser remembers how far
+#  through the file it has read, along with the state needed to carry on
+#  (current time step, whether it is inside a forceCoeffs block and any
+#  partial last line), so each call to update only reads the bytes that have
+#  been appended since the previous call.  Every metric is read in the same
+#  pass, each line is handed to the matcher registered for its first word.
+#  The parser is picklable so it can be kept in the django cache between
+#  requests.
+class FOAMLogParser(object):
+	## Number of bytes read from the disk at a time.
+	CHUNK_SIZE=4*1024*1024
+	## Number of bytes of the log handed to each process when parsing in parallel.
+	PARALLEL_CHUNK_SIZE=32*1024*1024
+	## Logs smaller than this are always parsed in a single process.
+	PARALLEL_MIN_SIZE=64*1024*1024
+	## Number of bytes from the start of the file that are remembered, used to
+	#  spot a log that has been replaced by a new run.
+	HEAD_SIZE=4096
+	## Increase this whenever a change to the parser changes what is read from a
+	#  log, so data saved by an older parser is not used.
+	VERSION=2
+	## Attributes that, along with the series, are needed to carry on parsing.
+	STATE=['offset', 'inode', 'head', 'time', 'completeTime', 'searchCoeffs', 'outerIterations', 'partial']
+	## Names of the series stores, one for each metric read from the log.
+	STORES=['residuals', 'forces', 'courant', 'continuity', 'executionTime', 'pimple']
+	## Bytes and lines read by the parser since it was created, including any read before
+	#  it was reset, used for the metrics.
+	bytesRead=0
+	linesRead=0
+
+	def __init__(self, path):
+		self.path=path
+		self.reset()
+
+	## Throws away everything parsed so far, the next update starts from the
+	#  beginning of the file.
+	def reset(self):
+		self.version=self.VERSION
+		self.offset=0
+		self.inode=None
+		self.head=""
+		self.time=0
+		## The time step before the current one, every line for it has been read.
+		self.completeTime=None
+		self.searchCoeffs=False
+		## PIMPLE outer iterations seen in the current time step.
+		self.outerIterations=0
+		self.partial=""
+		for name in self.STORES:
+			setattr(self, name, SeriesStore())
+
+	## Returns the state needed to carry on parsing, other than the series.
+	def getState(self):
+		return dict([(name, getattr(self, name)) for name in self.STATE])
+
+	## Restores state returned by getState.
+	def setState(self, state):
+		for name in self.STATE:
+			setattr(self, name, state[name])
+
+	## Returns the series stores, keyed by name.
+	def stores(self):
+		return dict([(name, getattr(self, name)) for name in self.STORES])
+
+	## Returns the series stores keyed by name, along with the last time step
+	#  known to be complete.
+	def data(self):
+		data=self.stores()
+		data['completeTime']=self.completeTime
+		return data
+
+	## Checks the file is still the one that was parsed, if it has shrunk or
+	#  been replaced the parser is reset.  Returns True when the parser was reset.
+	def checkFile(self, f, st):
+		if self.inode is None:
+			return False
+		replaced=False
+		if st.st_ino != self.inode:
+			replaced=True
+		elif st.st_size < self.offset:
+			replaced=True
+		else:
+			f.seek(0)
+			if f.read(len(self.head)) != self.head:
+				replaced=True
+		if replaced:
+			log.debug("FOAMLogParser: %s has been replaced, parsing from the start" % self.path)
+			self.reset()
+		return replaced
+
+	## Reads any bytes appended to the log since the last update.  Returns True if any new
+	#  data was read.  If a multiprocessing pool is given and the whole of a large log has to
+	#  be read, it is parsed and its series refreshed in parallel.
+	def update(self, pool=None):
+		if self.compressed():
+			return self.updateCompressed()
+		f=open(self.path, 'rb')
+		try:
+			st=os.fstat(f.fileno())
+			self.checkFile(f, st)
+			if st.st_size == self.offset:
+				return False
+			if self.offset < self.HEAD_SIZE:
+				f.seek(0)
+				self.head=f.read(self.HEAD_SIZE)
+			self.inode=st.st_ino
+			parallel=pool is not None and self.offset == 0 and st.st_size >= self.PARALLEL_MIN_SIZE
+			if parallel:
+				self.parseParallel(f, st.st_size, pool)
+			else:
+				self.parseTo(f)
+		finally:
+			f.close()
+		if parallel:
+			refreshStores(self.stores().values(), pool)
+		else:
+			for store in self.stores().values():
+				store.refresh()
+		return True
+
+	## Parses the file f from the offset up to end, or to the end of the file if end is None.
+	def parseTo(self, f, end=None):
+		f.seek(self.offset)
+		while end is None or self.offset < end:
+			if end is None:
+				chunk=f.read(self.CHUNK_SIZE)
+			else:
+				chunk=f.read(min(self.CHUNK_SIZE, end-self.offset))
+			if not chunk:
+				break
+			self.offset+=len(chunk)
+			self.parseData(chunk)
+
+	## Parses a block of data read from the log, the last line is kept until the rest of it
+	#  has been read.
+	def parseData(self, data):
+		lines=(self.partial+data).split("\n")
+		self.partial=lines.pop()
+		self.bytesRead+=len(data)
+		self.linesRead+=len(lines)
+		for line in lines:
+			self.parseLine(line)
+
+	## Returns True if the log is compressed.
+	def compressed(self):
+		return os.path.splitext(self.path)[1] in DECOMPRESSORS
+
+	## Reads a compressed log as it is decompressed, if it has changed since it was last
+	#  read.  The log is a closed segment, so once it has been read the last time step is
+	#  complete.  The offset is the compressed size.  Returns True if the log was read.
+	def updateCompressed(self):
+		st=os.stat(self.path)
+		if self.inode == st.st_ino and self.offset == st.st_size:
+			return False
+		self.reset()
+		f=DECOMPRESSORS[os.path.splitext(self.path)[1]](self.path)
+		try:
+			while True:
+				chunk=f.read(self.CHUNK_SIZE)
+				if not chunk:
+					break
+				self.parseData(chunk)
+		finally:
+			f.close()
+		self.parseData("\n")
+		if self.outerIterations:
+			self.pimple.append("Outer iterations", self.time, self.outerIterations)
+			self.outerIterations=0
+		self.completeTime=self.time
+		self.offset=st.st_size
+		self.inode=st.st_ino
+		for store in self.stores().values():
+			store.refresh()
+		return True
+
+	## Returns the offset of the first time step starting at or after offset in the file f,
+	#  or end if there is none before it.
+	def findTimeStep(self, f, offset, end):
+		marker="\nTime = "
+		# Starts a byte early so a time step starting exactly at offset is found.
+		base=offset-1
+		f.seek(base)
+		data=""
+		while base < end:
+			block=f.read(1024*1024)
+			if not block:
+				break
+			data+=block
+			found=data.find(marker)
+			if found >= 0:
+				return min(base+found+1, end)
+			# Keeps enough of the block to find a marker split across reads.
+			keep=len(marker)-1
+			base+=len(data)-keep
+			data=data[-keep:]
+		return end
+
+	## Parses the whole of the file f, which is size bytes long, in parallel.  The file is
+	#  split into chunks that start at a time step, so each chunk can be parsed from a fresh
+	#  state, the chunks are parsed in pool and the series are joined in the order they were
+	#  written.
+	def parseParallel(self, f, size, pool):
+		bounds=[0]
+		for i in range(1, size//self.PARALLEL_CHUNK_SIZE):
+			bound=self.findTimeStep(f, i*self.PARALLEL_CHUNK_SIZE, size)
+			if bounds[-1] < bound < size:
+				bounds.append(bound)
+		bounds.append(size)
+		jobs=[(self.path, bounds[i], bounds[i+1], i == len(bounds)-2) for i in range(len(bounds)-1)]
+		log.debug("FOAMLogParser: parsing %s in %d chunks" % (self.path, len(jobs)))
+		chunks=pool.map(parseChunk, jobs)
+		for chunk in chunks:
+			for name in self.STORES:
+				getattr(self, name).extend(getattr(chunk, name))
+			self.bytesRead+=chunk.bytesRead
+			self.linesRead+=chunk.linesRead
+		last=chunks[-1]
+		for name in self.STATE:
+			if name not in ['head', 'inode']:
+				setattr(self, name, getattr(last, name))
+		if self.completeTime is None and len(chunks) > 1:
+			# The last chunk holds a single time step, the one before ended the chunk before.
+			self.completeTime=chunks[-2].time
+
+	## Parses a single line, updating the state of the parser.
+	def parseLine(self, line):
+		if self.searchCoeffs:
+			if line.startswith(" "):
+				(name, equals, value)=line.partition("=")
+				if not equals:
+					(name, equals, value)=line.partition(":")
+				try:
+					self.forces.append(name.strip(), self.time, float(value))
+				except ValueError:
+					pass
+				return
+			self.searchCoeffs=False
+		space=line.find(" ")
+		if space < 0:
+			word=line
+		else:
+			word=line[:space]
+		try:
+			match=MATCHERS[word]
+		except KeyError:
+			return
+		match(self, line)
+
+## Parses the part of the log at path from start up to end, used by parseParallel.  start
+#  is the beginning of the file or of a time step.  If the chunk is not the last the time step
+#  it ends with is complete.  Returns the parser, its series have not been refreshed.
+def parseChunk(args):
+	(path, start, end, last)=args
+	parser=FOAMLogParser(path)
+	parser.offset=start
+	if start > 0:
+		# Set by the first line of the chunk, the time before it is not known.
+		parser.time=None
+	f=open(path, 'rb')
+	try:
+		parser.parseTo(f, end)
+	finally:
+		f.close()
+	if not last and parser.outerIterations:
+		parser.pimple.append("Outer iterations", parser.time, parser.outerIterations)
+		parser.outerIterations=0
+	return parser
@@ -0,0 +1,140 @@
+#  Copyright 2011 David Irvine
+#
+#  This file is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This file is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with This file.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import stat
+import time
+import logging
+import threading
+from percyval import metrics
+
+log = logging.getLogger(__name__)
+
+LOOKUPS=metrics.counter('percyval_index_lookups_total', "Directory listings asked of case indexes, a hit when the directory had not changed and a scan when it was read.", ['result'])
+SCAN_SECONDS=metrics.histogram('percyval_index_scan_seconds', "Time taken to read a directory of a case.")
+SCAN_ENTRIES=metrics.histogram('percyval_index_scan_entries', "Files and directories stat'd each time a directory of a case is read.", buckets=metrics.AMOUNTS)
+
+try:
+	from os import scandir
+except ImportError:
+	try:
+		from scandir import scandir
+	except ImportError:
+		scandir=None
+
+## A file or directory found in a case directory.  Symbolic links are followed.
+class Entry(object):
+	__slots__=['name', 'path', 'isDir', 'isFile', 'mtime', 'size']
+
+	def __init__(self, name, path, st):
+		self.name=name
+		self.path=path
+		self.isDir=stat.S_ISDIR(st.st_mode)
+		self.isFile=stat.S_ISREG(st.st_mode)
+		self.mtime=st.st_mtime
+		self.size=st.st_size
+
+# The entries of a directory, along with its mtime when they were read.
+class _Listing(object):
+	def __init__(self, mtime, entries):
+		self.mtime=mtime
+		self.entries=entries
+
+## Returns the entries in the directory at path, sorted by name, with a single stat for each.
+#  Entries that vanish while the directory is read are left out.
+def scanDir(path):
+	entries=[]
+	if scandir is not None:
+		for dirEntry in scandir(path):
+			try:
+				entries.append(Entry(dirEntry.name, dirEntry.path, dirEntry.stat()))
+			except OSError:
+				pass
+	else:
+		for name in os.listdir(path):
+			entryPath=os.path.join(path, name)
+			try:
+				entries.append(Entry(name, entryPath, os.stat(entryPath)))
+			except OSError:
+				pass
+	entries.sort(key=lambda entry: entry.name)
+	return entries
+
+## Index of the files in a case directory, shared by every feature of the case in this
+#  process.  The entries of each directory are kept along with the mtime of the directory,
+#  and a directory is only read again once its mtime changes, so listing a directory that
+#  has not changed costs a single stat.  The mtime of a directory changes when files are
+#  added, removed or renamed in it, but not when a file is written in place, so the mtime
+#  of such a file is not seen until something else in the directory changes.
+class CaseIndex(object):
+	## Directories modified less than this many seconds before they were read are read
+	#  again next time, as a change in the same second would not change the mtime.
+	RACY_WINDOW=2
+
+	def __init__(self, base):
+		self.base=base
+		self.lock=threading.Lock()
+		self.listings={}
+
+	## Returns the entries in the directory at path, which defaults to the case directory,
+	#  sorted by name.  Returns an empty list if the directory does not exist.
+	def listDir(self, path=None):
+		if path is None:
+			path=self.base
+		try:
+			st=os.stat(path)
+		except OSError:
+			return []
+		if not stat.S_ISDIR(st.st_mode):
+			return []
+		with self.lock:
+			listing=self.listings.get(path)
+		if listing is not None and listing.mtime == st.st_mtime:
+			LOOKUPS.inc(result='hit')
+			return listing.entries
+		LOOKUPS.inc(result='scan')
+		log.debug("CaseIndex: reading %s" % path)
+		started=time.time()
+		try:
+			with metrics.timed(SCAN_SECONDS, 'index'):
+				entries=scanDir(path)
+		except OSError:
+			return []
+		SCAN_ENTRIES.observe(len(entries))
+		mtime=st.st_mtime
+		if started-mtime < self.RACY_WINDOW:
+			mtime=None
+		with self.lock:
+			self.listings[path]=_Listing(mtime, entries)
+		return entries
+
+	## Returns the directories in the directory at path, which defaults to the case
+	#  directory, sorted by name.
+	def subDirs(self, path=None):
+		return [entry for entry in self.listDir(path) if entry.isDir]
+
+_indexes={}
+_indexesLock=threading.Lock()
+
+## Returns the index for the case directory at base, creating it if needed.
+def getIndex(base):
+	base=os.path.normpath(base)
+	with _indexesLock:
+		try:
+			return _indexes[base]
+		except KeyError:
+			index=CaseIndex(base)
+			_indexes[base]=index
+			return index
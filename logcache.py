@@ -0,0 +1,293 @@
+#  Copyright 2011 David Irvine
+#
+#  This file is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This file is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with This file.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from django.core.cache import cache
+from django.conf import settings
+from percyval.foamlog import FOAMLogParser
+from percyval.series import SeriesChain
+from percyval import sidecar
+from percyval import metrics
+
+log = logging.getLogger(__name__)
+
+LOOKUPS=metrics.counter('percyval_log_cache_total', "Lookups of parsed logs in the process wide cache, a hit when the log has not changed, stale when it has and a miss when the log is not held.", ['result'])
+CACHE_GET_SECONDS=metrics.histogram('percyval_log_cache_get_seconds', "Time taken to fetch and unpickle a parser from the django cache.")
+PARSE_SECONDS=metrics.histogram('percyval_log_parse_seconds', "Time taken to bring the parser for a log up to date.")
+PARSE_BYTES=metrics.histogram('percyval_log_parse_bytes', "Bytes of a log read each time its parser is brought up to date.", buckets=metrics.AMOUNTS)
+PARSE_LINES=metrics.histogram('percyval_log_parse_lines', "Lines of a log parsed each time its parser is brought up to date.", buckets=metrics.AMOUNTS)
+
+## A log file held in the LogCache.  The lock is held while the parser is brought up
+#  to date and while its series are read, so readers never see a half updated series.
+class LogEntry(object):
+	def __init__(self, path):
+		self.path=path
+		self.parser=None
+		## (size, mtime, inode) of the log when the parser was last brought up to date.
+		self.stat=None
+		self.nbytes=0
+		self.lock=threading.RLock()
+
+## Several segments of a log, such as the rotated and compressed logs of a long run, read
+#  as one log.  Held in the LogCache in place of a parser, and provides the same data.
+class LogChain(object):
+	def __init__(self, paths):
+		self.paths=paths
+		self.chains=dict([(name, SeriesChain()) for name in FOAMLogParser.STORES])
+		self.completeTime=None
+
+	## Joins the data from the parsers of the segments, oldest first.
+	def update(self, parsers):
+		for (name, chain) in self.chains.items():
+			chain.update([getattr(parser, name) for parser in parsers])
+		self.completeTime=parsers[-1].completeTime
+		if self.completeTime is None and len(parsers) > 1:
+			# Nothing in the live segment is complete yet, the segment before is closed.
+			self.completeTime=parsers[-2].time
+
+	## Returns the joined series stores, keyed by name.
+	def stores(self):
+		return dict([(name, chain.store) for (name, chain) in self.chains.items()])
+
+	## Returns the joined series stores keyed by name, along with the last time step known
+	#  to be complete.
+	def data(self):
+		data=self.stores()
+		data['completeTime']=self.completeTime
+		return data
+
+## Process wide cache of parsed log files, shared by every feature reading the same
+#  log.  An entry is used as long as the (size, mtime, inode) of the log is unchanged,
+#  so a hit costs a stat and never unpickles anything.  Once the parsed data held goes
+#  over maxBytes the least recently used logs are dropped.
+class LogCache(object):
+	def __init__(self, maxBytes):
+		self.maxBytes=maxBytes
+		self.lock=threading.Lock()
+		self.entries=OrderedDict()
+		self.nbytes=0
+
+	## Returns the entry for the log file at path, creating it if needed, and marks it
+	#  as the most recently used.
+	def entry(self, path):
+		with self.lock:
+			try:
+				entry=self.entries.pop(path)
+			except KeyError:
+				entry=LogEntry(path)
+			self.entries[path]=entry
+			return entry
+
+	## Records the size of an entry after its parser has changed, dropping the least
+	#  recently used entries if the cache is over its limit.  The entry itself is kept
+	#  even if it is bigger than the limit on its own.
+	def resize(self, entry, nbytes):
+		with self.lock:
+			if self.entries.get(entry.path) is not entry:
+				return
+			self.nbytes+=nbytes-entry.nbytes
+			entry.nbytes=nbytes
+			while self.nbytes > self.maxBytes and len(self.entries) > 1:
+				(path, oldest)=self.entries.popitem(last=False)
+				if oldest is entry:
+					self.entries[path]=entry
+					break
+				log.debug("LogCache: dropping %s" % path)
+				self.nbytes-=oldest.nbytes
+
+	## Drops the entry for the log file at path, if there is one.
+	def discard(self, path):
+		with self.lock:
+			try:
+				entry=self.entries.pop(path)
+			except KeyError:
+				return
+			self.nbytes-=entry.nbytes
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+			self.nbytes=0
+
+logCache=LogCache(getattr(settings, 'PERCYVAL_LOG_CACHE_BYTES', 256*1024*1024))
+
+## Returns the key the parser for the log file at path is cached under.
+def logCacheKey(path):
+	return "FOAMLOG_"+path
+
+## Returns the path of the sidecar file for the log file at path, or None if sidecar files are
+# turned off.  PERCYVAL_SIDECAR may be True to keep the sidecar next to the log, or the path of a
+# directory to keep them in.
+def logSidecarPath(path):
+	option=getattr(settings, 'PERCYVAL_SIDECAR', None)
+	if not option:
+		return None
+	if option is True:
+		return sidecar.sidecarPath(path)
+	return sidecar.sidecarPath(path, option)
+
+## Stores the parser in the django cache for other processes to pick up, unless it was stored
+# less than interval seconds ago.  Returns True if it was stored.
+def publishIfDue(parser, interval):
+	if time.time()-getattr(parser, 'cachePublished', 0) < interval:
+		return False
+	parser.cachePublished=time.time()
+	cache.set(logCacheKey(parser.path), parser, getattr(settings, 'PERCYVAL_LOG_CACHE_TIMEOUT', 3600))
+	return True
+
+## Returns the parser for the log file at path held in the django cache, or None if there is
+# none or it was stored by another version of the parser.
+def cachedParser(path):
+	with metrics.timed(CACHE_GET_SECONDS, 'cache'):
+		parser=cache.get(logCacheKey(path))
+	if parser is None or parser.path != path or getattr(parser, 'version', None) != FOAMLogParser.VERSION:
+		return None
+	return parser
+
+## Returns the entry for the log file at path in the process wide cache, with its parser
+# brought up to date.  If the log has not changed since the entry was last used the parser is
+# returned as it is.  Otherwise only the part of the log written since the parser was last
+# updated is parsed.  Parsers are shared between processes through sidecar files if they are
+# used, or the django cache otherwise, see _updateParser, before falling back to parsing the
+# whole log, in parallel using pool if one is given.  If parse is not
+# set the parser is read from the sidecar file kept up to date by the ingestlogs command, and
+# used as it is until the sidecar is written again.  The log is only parsed here when there is
+# no sidecar yet.
+def getLogEntry(path, parse=True, pool=None):
+	entry=logCache.entry(path)
+	with entry.lock:
+		st=os.stat(path)
+		stat=(st.st_size, st.st_mtime, st.st_ino)
+		if entry.parser is not None and entry.stat == stat:
+			LOOKUPS.inc(result='hit')
+			return entry
+		LOOKUPS.inc(result='miss' if entry.parser is None else 'stale')
+		parser=None
+		if not parse:
+			parser=_ingestedParser(path, entry.parser)
+		if parser is None:
+			with metrics.timed(PARSE_SECONDS, 'parse'):
+				parser=_updateParser(path, entry.parser, pool)
+		entry.parser=parser
+		if parser.offset == st.st_size and parser.inode == st.st_ino:
+			entry.stat=stat
+		else:
+			# The parser is behind the log, check again next time.
+			entry.stat=None
+		nbytes=sum([store.nbytes() for store in parser.stores().values()])
+	logCache.resize(entry, nbytes)
+	return entry
+
+## Returns the entry in the process wide cache for the log split into segments at paths,
+# oldest first, with a LogChain in place of the parser.  Each segment is read with
+# getLogEntry, so segments that have not changed, such as compressed segments of a run that
+# has moved on, are not read again.
+def getLogChain(paths, parse=True):
+	segments=[getLogEntry(path, parse) for path in paths]
+	entry=logCache.entry("\n".join(paths))
+	with entry.lock:
+		if entry.parser is None:
+			entry.parser=LogChain(paths)
+		for segment in segments:
+			segment.lock.acquire()
+		try:
+			entry.parser.update([segment.parser for segment in segments])
+		finally:
+			for segment in segments:
+				segment.lock.release()
+		nbytes=sum([store.nbytes() for store in entry.parser.stores().values()])
+	logCache.resize(entry, nbytes)
+	return entry
+
+## Brings the parser for the log file at path up to date and returns it.
+def updateLog(path, parse=True, pool=None):
+	return getLogEntry(path, parse, pool).parser
+
+## Brings the sidecar file of the log file at path up to date with the log, parsing only what
+# has been written since the sidecar was last written, in parallel using pool if one is given
+# and the whole log has to be parsed.  The parser is not kept in this process.  Used by the
+# ingestlogs command to hand parsed logs to the views, see getLogEntry.  Returns True if the
+# sidecar was written.
+def ingestLog(path, pool=None):
+	sidecarPath=logSidecarPath(path)
+	parser=sidecar.load(path, sidecarPath)
+	if parser is None:
+		parser=FOAMLogParser(path)
+	(bytesRead, linesRead)=(parser.bytesRead, parser.linesRead)
+	with metrics.timed(PARSE_SECONDS, 'parse'):
+		if not parser.update(pool) and os.path.exists(sidecarPath):
+			return False
+	PARSE_BYTES.observe(parser.bytesRead-bytesRead)
+	PARSE_LINES.observe(parser.linesRead-linesRead)
+	sidecar.save(parser, sidecarPath)
+	return True
+
+# Returns the parser read from the sidecar file of the log at path, or current if the sidecar
+# has not been written since current was read from it.  Returns None if there is no sidecar.
+def _ingestedParser(path, current):
+	sidecarPath=logSidecarPath(path)
+	if not sidecarPath:
+		return None
+	try:
+		st=os.stat(sidecarPath)
+	except OSError:
+		return None
+	stat=(st.st_size, st.st_mtime, st.st_ino)
+	if current is not None and getattr(current, 'sidecarStat', None) == stat:
+		return current
+	parser=sidecar.load(path, sidecarPath)
+	if parser is not None:
+		parser.sidecarStat=stat
+	return parser
+
+# Brings parser up to date with the log at path, finding a parser in the sidecar file or the
+# django cache if it is None.  When sidecar files are used they are how parsers are shared
+# between processes, as a sidecar is written without pickling and read without copying.
+# Otherwise a parser created in this process is stored in the django cache at once, and stored
+# again at most every PERCYVAL_LOG_CACHE_INTERVAL seconds as the log grows, as pickling the
+# whole parser costs as much as parsing the whole log.
+def _updateParser(path, parser, pool):
+	sidecarPath=logSidecarPath(path)
+	created=False
+	if parser is None:
+		if sidecarPath:
+			parser=sidecar.load(path, sidecarPath)
+		else:
+			parser=cachedParser(path)
+	if parser is None:
+		parser=FOAMLogParser(path)
+		created=True
+	(bytesRead, linesRead)=(parser.bytesRead, parser.linesRead)
+	if parser.update(pool):
+		PARSE_BYTES.observe(parser.bytesRead-bytesRead)
+		PARSE_LINES.observe(parser.linesRead-linesRead)
+		if sidecarPath:
+			# A compressed segment will not change again, so it is kept at once.
+			if parser.compressed():
+				interval=0
+			else:
+				interval=getattr(settings, 'PERCYVAL_SIDECAR_INTERVAL', 60)
+			sidecar.saveIfDue(parser, sidecarPath, interval)
+	if not sidecarPath:
+		if created:
+			interval=0
+		else:
+			interval=getattr(settings, 'PERCYVAL_LOG_CACHE_INTERVAL', getattr(settings, 'PERCYVAL_SIDECAR_INTERVAL', 60))
+		publishIfDue(parser, interval)
+	return parser
@@ -0,0 +1,216 @@
+#  Copyright 2011 David Irvine
+#
+#  This file is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This file is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with This file.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from optparse import make_option
+from django.conf import settings
+from django.core.management.base import NoArgsCommand, CommandError
+from percyval.models import *
+from percyval import logcache
+
+log = logging.getLogger(__name__)
+
+try:
+	import pyinotify
+except ImportError:
+	pyinotify=None
+
+## Parses any new data in the log file at path and writes its sidecar file, run in the
+#  worker pool.  Nothing is kept in the worker once the sidecar is written.
+def ingestLog(path, pool=None):
+	try:
+		logcache.ingestLog(path, pool)
+	except Exception:
+		log.exception("ingestlogs: failed to parse %s" % path)
+
+## Returns the names of the plot features that read a FOAM log file.
+def logFeatureNames():
+	return [c.__name__ for c in Plot.__subclasses__() if issubclass(c, FOAMLog)]
+
+## Keeps the sidecar files of every log file in use by a case up to date.  Log files are
+#  handed to pool, a pool of worker processes, as they change.  A file is never parsed by two
+#  workers at once and a change seen while it is being parsed queues it again.  Each file is
+#  parsed at most once every interval seconds, as the whole sidecar is written each time,
+#  changes seen sooner wait until it is due.  The first time a log is seen it is read from a
+#  thread in this process instead, so a log that has to be parsed from the start is split
+#  across the whole pool.  This is the only place logs are parsed in parallel: forking a
+#  pool from a threaded web server process can leave the children stuck on locks held by
+#  other threads at the time of the fork, so the pool is created before any thread starts.
+class LogIngester(object):
+	def __init__(self, pool, interval):
+		self.pool=pool
+		self.interval=interval
+		self.lock=threading.Lock()
+		## The log files being followed, mapped to their last (size, mtime, inode).
+		self.logs={}
+		self.running=set()
+		self.dirty=set()
+		## The log files that have been read at least once.
+		self.ingested=set()
+		## The time each log file may next be parsed.
+		self.due={}
+		## Log files that changed before they were due.
+		self.waiting=set()
+
+	## Reads the list of log files from the database.  Returns the directories they are in.
+	def findLogs(self):
+		paths=set()
+		for feature in CaseFeature.objects.filter(name__in=logFeatureNames()).select_related('case'):
+			try:
+				paths.update(feature.logFilePaths())
+			except Exception:
+				log.exception("ingestlogs: no log file for feature %s" % feature.id)
+		with self.lock:
+			for path in set(self.logs.keys())-paths:
+				del self.logs[path]
+			for path in paths-set(self.logs.keys()):
+				self.logs[path]=None
+		return set([os.path.dirname(path) for path in paths])
+
+	## Queues the log file at path to be parsed.
+	def schedule(self, path):
+		with self.lock:
+			if path not in self.logs:
+				return
+			if path in self.running:
+				self.dirty.add(path)
+				return
+			if time.time() < self.due.get(path, 0):
+				self.waiting.add(path)
+				return
+			self.running.add(path)
+			ingested=path in self.ingested
+		if ingested:
+			self.pool.apply_async(ingestLog, (path,), callback=lambda result: self.finished(path))
+		else:
+			thread=threading.Thread(target=self.ingestFirst, args=(path,), name="ingest %s" % path)
+			thread.daemon=True
+			thread.start()
+
+	## Reads a log file for the first time, parsing it in parallel across the pool if it has
+	#  to be read from the start.
+	def ingestFirst(self, path):
+		try:
+			ingestLog(path, self.pool)
+		finally:
+			with self.lock:
+				self.ingested.add(path)
+			self.finished(path)
+
+	def finished(self, path):
+		with self.lock:
+			self.running.discard(path)
+			self.due[path]=time.time()+self.interval
+			again=path in self.dirty
+			self.dirty.discard(path)
+		if again:
+			self.schedule(path)
+
+	## Queues the log files that changed before they were due, once they are.
+	def scheduleWaiting(self):
+		now=time.time()
+		with self.lock:
+			paths=[path for path in self.waiting if self.due.get(path, 0) <= now]
+			self.waiting.difference_update(paths)
+		for path in paths:
+			self.schedule(path)
+
+	## Stats every log file and queues those that have changed.
+	def poll(self):
+		with self.lock:
+			paths=self.logs.keys()
+		for path in paths:
+			try:
+				st=os.stat(path)
+			except OSError:
+				continue
+			stat=(st.st_size, st.st_mtime, st.st_ino)
+			with self.lock:
+				if path not in self.logs or self.logs[path] == stat:
+					continue
+				self.logs[path]=stat
+			self.schedule(path)
+
+	def close(self):
+		self.pool.close()
+		self.pool.join()
+
+if pyinotify is not None:
+	## Queues a log file whenever inotify reports it has been written to or replaced.
+	class InotifyHandler(pyinotify.ProcessEvent):
+		def my_init(self, ingester):
+			self.ingester=ingester
+
+		def process_default(self, event):
+			self.ingester.schedule(event.pathname)
+
+class Command(NoArgsCommand):
+	help="Parses the log file of every case with a log based plot feature as it changes into its sidecar file, so views only read data that is already parsed.  PERCYVAL_SIDECAR must be set.  Set PERCYVAL_INGEST_DAEMON to stop views parsing logs themselves."
+	option_list=NoArgsCommand.option_list+(
+			make_option('--workers', type='int', default=multiprocessing.cpu_count(),
+				help="Number of worker processes, defaults to the number of cores."),
+			make_option('--interval', type='float', default=2.0,
+				help="Seconds between checks of the log files when inotify is not available."),
+			make_option('--rescan', type='float', default=60.0,
+				help="Seconds between reading the list of cases from the database."),
+			make_option('--poll', action='store_true', default=False,
+				help="Stat the log files instead of using inotify."),
+			make_option('--save-interval', type='float', default=None,
+				help="Least seconds between writing the sidecar file of a log, defaults to PERCYVAL_SIDECAR_INTERVAL."),
+			)
+
+	def handle_noargs(self, **options):
+		if not getattr(settings, 'PERCYVAL_SIDECAR', None):
+			raise CommandError("PERCYVAL_SIDECAR must be set, the parsed logs are handed to the views in sidecar files.")
+		interval=options['save_interval']
+		if interval is None:
+			interval=getattr(settings, 'PERCYVAL_SIDECAR_INTERVAL', 60)
+		ingester=LogIngester(multiprocessing.Pool(options['workers']), interval)
+		notifier=None
+		watched=set()
+		if pyinotify is not None and not options['poll']:
+			manager=pyinotify.WatchManager()
+			notifier=pyinotify.ThreadedNotifier(manager, InotifyHandler(ingester=ingester))
+			notifier.daemon=True
+			notifier.start()
+			mask=pyinotify.IN_MODIFY|pyinotify.IN_CLOSE_WRITE|pyinotify.IN_CREATE|pyinotify.IN_MOVED_TO
+		else:
+			log.info("ingestlogs: pyinotify is not available, polling log files")
+		try:
+			nextScan=0
+			while True:
+				if time.time() >= nextScan:
+					dirs=ingester.findLogs()
+					if notifier is not None:
+						for dir in dirs-watched:
+							manager.add_watch(dir, mask)
+						watched|=dirs
+					# Catches anything changed before the watch was added.
+					ingester.poll()
+					nextScan=time.time()+options['rescan']
+				if notifier is None:
+					ingester.poll()
+				ingester.scheduleWaiting()
+				time.sleep(options['interval'])
+		except KeyboardInterrupt:
+			pass
+		finally:
+			if notifier is not None:
+				notifier.stop()
+			ingester.close()
@@ -0,0 +1,47 @@
+#  Copyright 2011 David Irvine
+#
+#  This file is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This file is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with This file.  If not, see <http://www.gnu.org/licenses/>.
+#
+import time
+import logging
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from percyval.models import *
+
+log = logging.getLogger(__name__)
+
+## Refreshes the stored last update time and summary of every case and its features.
+def refreshCases():
+	for case in attachFeatures(list(Case.objects.all())):
+		try:
+			case.refreshSummary(case.featureList)
+		except Exception:
+			log.exception("refreshcases: failed to refresh case %s" % case.id)
+
+class Command(NoArgsCommand):
+	help="Stores the last update time and summary of every case and its features, which the case list shows instead of reading the case directories.  Run it from cron, or leave it running with --interval."
+	option_list=NoArgsCommand.option_list+(
+			make_option('--interval', type='float', default=0.0,
+				help="Seconds between refreshes, by default the cases are refreshed once."),
+			)
+
+	def handle_noargs(self, **options):
+		try:
+			while True:
+				refreshCases()
+				if options['interval'] <= 0:
+					break
+				time.sleep(options['interval'])
+		except KeyboardInterrupt:
+			pass
@@ -0,0 +1,207 @@
+#  Copyright 2011 David Irvine
+#
+#  This file is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This file is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with This file.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  Counters and histograms for the hot paths, such as parsing logs, reading
+#  series and listing galleries, exposed in the Prometheus text format by the
+#  metrics view once PERCYVAL_METRICS is set.  Metrics are kept for each
+#  process, a server running several processes reports those of the process
+#  that answers the scrape.  Add percyval.metrics.MetricsMiddleware to
+#  MIDDLEWARE_CLASSES to time every view, and set PERCYVAL_SERVER_TIMING to
+#  add a Server-Timing header to each response, showing where the time of the
+#  request went.
+import time
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+
+## Buckets for histograms of durations, in seconds.
+SECONDS=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+## Buckets for histograms of amounts, such as bytes, lines or points.
+AMOUNTS=(1, 10, 100, 1000, 10000, 100000, 1000000, 10000000, 100000000, 1000000000)
+
+# Returns the text of the labels for a metric.
+def _labelText(labelNames, labelValues, extra=""):
+	parts=['%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+			for (name, value) in zip(labelNames, labelValues)]
+	if extra:
+		parts.append(extra)
+	if not parts:
+		return ""
+	return "{%s}" % ",".join(parts)
+
+## A value that only goes up, such as the number of bytes read, kept for each combination of
+#  values of its labels.
+class Counter(object):
+	type="counter"
+
+	def __init__(self, name, help, labels=()):
+		self.name=name
+		self.help=help
+		self.labels=tuple(labels)
+		self.lock=threading.Lock()
+		self.values={}
+
+	## Adds amount to the counter for the given label values.
+	def inc(self, amount=1, **labels):
+		key=tuple([labels[name] for name in self.labels])
+		with self.lock:
+			self.values[key]=self.values.get(key, 0)+amount
+
+	## Returns the value of the counter for the given label values.
+	def get(self, **labels):
+		return self.values.get(tuple([labels[name] for name in self.labels]), 0)
+
+	## Returns the lines of the counter in the Prometheus text format.
+	def render(self):
+		with self.lock:
+			values=sorted(self.values.items())
+		return ["%s%s %r" % (self.name, _labelText(self.labels, key), float(value)) for (key, value) in values]
+
+## The distribution of a value, such as the time taken to parse a log, counted into buckets,
+#  along with the sum and number of the values, for each combination of values of its labels.
+class Histogram(object):
+	type="histogram"
+
+	def __init__(self, name, help, labels=(), buckets=SECONDS):
+		self.name=name
+		self.help=help
+		self.labels=tuple(labels)
+		self.buckets=tuple(sorted(buckets))
+		self.lock=threading.Lock()
+		## The count in each bucket, values above the last go in an extra one, by label values.
+		self.counts={}
+		self.sums={}
+
+	## Records value for the given label values.
+	def observe(self, value, **labels):
+		key=tuple([labels[name] for name in self.labels])
+		index=len(self.buckets)
+		for (i, bound) in enumerate(self.buckets):
+			if value <= bound:
+				index=i
+				break
+		with self.lock:
+			try:
+				counts=self.counts[key]
+			except KeyError:
+				counts=[0]*(len(self.buckets)+1)
+				self.counts[key]=counts
+				self.sums[key]=0
+			counts[index]+=1
+			self.sums[key]+=value
+
+	## Returns the number of values recorded for the given label values.
+	def count(self, **labels):
+		return sum(self.counts.get(tuple([labels[name] for name in self.labels]), []))
+
+	## Returns the lines of the histogram in the Prometheus text format.
+	def render(self):
+		lines=[]
+		with self.lock:
+			values=sorted([(key, list(counts), self.sums[key]) for (key, counts) in self.counts.items()])
+		for (key, counts, total) in values:
+			cumulative=0
+			for (bound, count) in zip(self.buckets, counts):
+				cumulative+=count
+				lines.append("%s_bucket%s %d" % (self.name, _labelText(self.labels, key, 'le="%r"' % float(bound)), cumulative))
+			cumulative+=counts[-1]
+			lines.append("%s_bucket%s %d" % (self.name, _labelText(self.labels, key, 'le="+Inf"'), cumulative))
+			lines.append("%s_sum%s %r" % (self.name, _labelText(self.labels, key), float(total)))
+			lines.append("%s_count%s %d" % (self.name, _labelText(self.labels, key), cumulative))
+		return lines
+
+_metrics={}
+_metricsLock=threading.Lock()
+
+# Returns the metric called name, creating it with cls if needed.
+def _getMetric(cls, name, help, labels, **kwargs):
+	with _metricsLock:
+		try:
+			return _metrics[name]
+		except KeyError:
+			metric=cls(name, help, labels, **kwargs)
+			_metrics[name]=metric
+			return metric
+
+## Returns the counter called name, creating it if needed.
+def counter(name, help, labels=()):
+	return _getMetric(Counter, name, help, labels)
+
+## Returns the histogram called name, creating it if needed.
+def histogram(name, help, labels=(), buckets=SECONDS):
+	return _getMetric(Histogram, name, help, labels, buckets=buckets)
+
+## Returns every metric in the Prometheus text format.
+def render():
+	with _metricsLock:
+		metrics=sorted(_metrics.values(), key=lambda metric: metric.name)
+	lines=[]
+	for metric in metrics:
+		lines.append("# HELP %s %s" % (metric.name, metric.help))
+		lines.append("# TYPE %s %s" % (metric.name, metric.type))
+		lines.extend(metric.render())
+	return "\n".join(lines)+"\n"
+
+_request=threading.local()
+
+## Adds seconds to the time spent on name in the request being answered by this thread, sent
+#  in the Server-Timing header.
+def addTiming(name, seconds):
+	timings=getattr(_request, 'timings', None)
+	if timings is not None:
+		timings[name]=timings.get(name, 0)+seconds
+
+## Times the block it wraps, recording the seconds taken in histogram with the given label
+#  values, and if timing is given adding them to the Server-Timing header under that name.
+@contextmanager
+def timed(histogram, timing=None, **labels):
+	start=time.time()
+	try:
+		yield
+	finally:
+		elapsed=time.time()-start
+		histogram.observe(elapsed, **labels)
+		if timing is not None:
+			addTiming(timing, elapsed)
+
+VIEW_SECONDS=histogram('percyval_view_seconds', "Time taken to answer a request, by view.", ['view'])
+
+## Times each view of the application, and adds a Server-Timing header to each response if
+#  PERCYVAL_SERVER_TIMING is set.  The time of a streamed response is the time taken to start
+#  it.
+class MetricsMiddleware(object):
+	def process_request(self, request):
+		_request.timings={}
+		_request.start=time.time()
+		_request.view=None
+
+	def process_view(self, request, view, args, kwargs):
+		if getattr(view, '__module__', '').startswith("percyval."):
+			_request.view=getattr(view, '__name__', view.__class__.__name__)
+
+	def process_response(self, request, response):
+		start=getattr(_request, 'start', None)
+		if start is None:
+			return response
+		elapsed=time.time()-start
+		if _request.view is not None:
+			VIEW_SECONDS.observe(elapsed, view=_request.view)
+		if getattr(settings, 'PERCYVAL_SERVER_TIMING', False):
+			timings=["%s;dur=%.1f" % (name, seconds*1000) for (name, seconds) in sorted(_request.timings.items())]
+			timings.append("total;dur=%.1f" % (elapsed*1000))
+			response['Server-Timing']=", ".join(timings)
+		_request.timings=None
+		_request.start=None
+		return response
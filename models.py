@@ -23,15 +23,29 @@ import time
 import os
 import re
 import csv
+import glob
 import logging
-from django.core.cache import cache
-from django.db import models
+import threading
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
 from django.conf import settings
+from django.utils import timezone
+from percyval.logcache import getLogEntry, getLogChain, updateLog
+from percyval.fsindex import getIndex
+from percyval.options import getOptionMap, invalidate, loadOptionMaps
+from percyval import metrics
+from percyval.wireformat import toPoints
+from percyval.series import ColumnWindow
 
 log = logging.getLogger(__name__)
 
+PROCESS_LOG_SECONDS=metrics.histogram('percyval_process_log_seconds', "Time taken by processLog to find the parsed data of a log, parsing it if needed.")
+SERIES_SECONDS=metrics.histogram('percyval_series_seconds', "Time taken by getColumns to read and downsample the series of a plot.")
+SERIES_POINTS_IN=metrics.histogram('percyval_series_points_in', "Points in the requested range of the series of a plot, for each call of getColumns.", buckets=metrics.AMOUNTS)
+SERIES_POINTS_OUT=metrics.histogram('percyval_series_points_out', "Points returned by getColumns after downsampling, for each call.", buckets=metrics.AMOUNTS)
+
 ## This is the base feature class, all features inherit from this. Features
 #  Implement underlying functionality within the tool, cases have features,  such as
 #  Images and Movies, the Feature Implementation is responsible for getting the 
@@ -50,14 +64,23 @@ class Feature(object):
 	## Returns a string of the date and time the data was last updated.
 	def getLastUpdateTime(self):
 		raise NotImplementedError
+
+	## Returns the time the data was last modified, in seconds since the epoch.  Stored with
+	# the feature by refreshSummary, so the case list never has to read the case directory.
+	def getLastModified(self):
+		raise NotImplementedError
+
+	## Returns a short description of the data, such as the number of images, stored with the
+	# feature by refreshSummary.
+	def getSummary(self):
+		return ""
 	
 	## Returns a string of the description of the feature, stored either in the db or the 
 	# class.
 	def getDescription(self):
-		try:
-			return self.feature.options.get(name='description').value
-		except:
-			pass
+		description=self.feature.getOptions().get('description')
+		if description is not None:
+			return description
 		try:
 			return self.featureDescription
 		except:
@@ -73,174 +96,296 @@ class Plot(Feature):
 		return reverse('percyval.views.plotView', args=[str(self.feature.case.id),str(self.feature.id)])
 	## Returns the value of the first data point or timestep in the series
 	def getMinTime(self):
-		raise NotImplementedError
+		with self.seriesLock():
+			store=self.getSeriesStore()
+			return store[store.names()[0]].getMinTime()
 	
 	## Returns the value of the last datapoint or timestep in the series.
 	def getMaxTime(self):
-		raise NotImplementedError
+		with self.seriesLock():
+			store=self.getSeriesStore()
+			return store[store.names()[0]].getMaxTime()
 	## Returns the time the data was last updated.
 	def getLastUpdateTime(self):
 		raise NotImplementedError
-	## returns the data in flot format for the plot between the provided times.
-	def getSeries(self, startTime, endTime):
+	## Name of the downsampling method used when the request does not ask for one.
+	downsampleMethod='lttb'
+	## Total number of points returned across all series when the request does not
+	# ask for a number of points per series.
+	maxPoints=15000
+	## Returns the SeriesStore holding the data to plot.  The store may be shared with other
+	# requests, so it must only be read, while holding the lock returned by seriesLock.
+	def getSeriesStore(self):
 		raise NotImplementedError
+	## Returns the lock to hold while reading the store returned by getSeriesStore.  By
+	# default the store is not shared, so a new lock is returned.
+	def seriesLock(self):
+		return threading.RLock()
+	## Returns a list of (name, times, values) for each series in alphabetical order, holding
+	# the points between startTime and endTime inclusive.  The range is found with a binary
+	# search and the points are copied out, so the series themselves are never changed.  If
+	# after is set points at startTime are left out.
+	def getRange(self, startTime, endTime, after=False):
+		with self.seriesLock():
+			data=[]
+			for series in self.getSeriesStore().sortedSeries():
+				(start, end)=series.indexRange(float(startTime), float(endTime), after)
+				data.append((series.name, series.times[start:end], series.values[start:end]))
+			return data
+	## Returns a list of (name, times, values) for each series in alphabetical order, holding
+	# the points between the provided times downsampled to at most points values using the
+	# named method.  If after is set, points at startTime are left out.
+	def getColumns(self, startTime, endTime, points=None, method=None, after=False):
+		with self.seriesLock():
+			store=self.getSeriesStore()
+			if points is None:
+				points=self.maxPoints//max(len(store), 1)
+			if method is None:
+				method=self.downsampleMethod
+			with metrics.timed(SERIES_SECONDS, 'series'):
+				data=[]
+				pointsIn=0
+				pointsOut=0
+				for series in store.sortedSeries():
+					(start, end)=series.indexRange(float(startTime), float(endTime), after)
+					(times, values)=series.query(float(startTime), float(endTime), points, method, after)
+					pointsIn+=end-start
+					pointsOut+=len(times)
+					data.append((series.name, times, values))
+			SERIES_POINTS_IN.observe(pointsIn)
+			SERIES_POINTS_OUT.observe(pointsOut)
+			return data
+	## Returns an iterator over (name, times, values) for each series in alphabetical order,
+	# holding the same points as getColumns returns, so a response can be sent a series at a
+	# time.  The data is read now, but each series is only queried when it is reached.  Points
+	# that are downsampled are copied out, those that are not are returned as ColumnWindows, so
+	# however wide the range at most points values of a single series are held at once.
+	def iterColumns(self, startTime, endTime, points=None, method=None, after=False):
+		with self.seriesLock():
+			names=self.getSeriesStore().names()
+		if points is None:
+			points=self.maxPoints//max(len(names), 1)
+		if method is None:
+			method=self.downsampleMethod
+		return self._iterColumns(names, float(startTime), float(endTime), points, method, after)
+	# Yields the series called names for iterColumns.
+	def _iterColumns(self, names, startTime, endTime, points, method, after):
+		pointsIn=0
+		pointsOut=0
+		for name in names:
+			lock=self.seriesLock()
+			with lock:
+				series=self.getSeriesStore()[name]
+				(start, end)=series.indexRange(startTime, endTime, after)
+				if series.queriesRaw(start, end, points, method):
+					(times, values)=(ColumnWindow(series.times, start, end, lock), ColumnWindow(series.values, start, end, lock))
+				else:
+					(times, values)=series.query(startTime, endTime, points, method, after)
+			pointsIn+=end-start
+			pointsOut+=len(times)
+			yield (name, times, values)
+		SERIES_POINTS_IN.observe(pointsIn)
+		SERIES_POINTS_OUT.observe(pointsOut)
+	## returns the data in flot format for the plot between the provided times, each series
+	# is downsampled to at most points values using the named method.  If after is set,
+	# points at startTime are left out.
+	def getSeries(self, startTime, endTime, points=None, method=None, after=False):
+		return toPoints(self.getColumns(startTime, endTime, points, method, after))
+	## Returns a dictionary with the points after the time since and up to endTime in
+	# 'series', in the same format as getColumns, and in 'cursor' the time to pass as since
+	# on the next call.  Points after the cursor may be sent again on the next call, so
+	# the client should replace what it holds after the cursor with the new points.
+	def getColumnsSince(self, since, endTime, points=None, method=None):
+		raise NotImplementedError
+	## Returns the same as getColumnsSince, with the series in the same format as getSeries.
+	def getSeriesSince(self, since, endTime, points=None, method=None):
+		data=self.getColumnsSince(since, endTime, points, method)
+		data['series']=toPoints(data['series'])
+		return data
 
 ## Parser for FOAM log files
 class FOAMLog(object):
+	## Name of the set of series in the log that the feature plots.
+	logSection='residuals'
 	## Gets the name of the logfile from the database, if that fails tries to find a suitable default.
 	def logFile(self):
 		try:
-			return self.feature.options.get(name='logFile').value
-		except:
+			return self.logFiles()[0]
+		except IndexError:
 			return "log.pisoFoam"
-	## Return the fully qualified path to the log file.
+
+	## Gets the names of the log files from the database, there may be several logFile options.
+	def logFiles(self):
+		return self.feature.getOptions().getList('logFile')
+
+	## Return the fully qualified path to the log file.  When the log is split into segments
+	# this is the live segment, the one that was modified last.
 	def logFilePath(self):
-		path=os.path.join(settings.MEDIA_ROOT, self.feature.case.options.get(name='caseDir').value.lstrip("/"), self.logFile())
+		path=self.logFilePaths()[-1]
 		log.debug("FOAMLog: Log File Path: %s" % path)
 		return path
 
+	## Returns the fully qualified paths of the segments of the log, oldest first.  Each
+	# logFile option may be a glob pattern, such as log.pisoFoam* to pick up rotated and
+	# compressed segments, the segments matching a pattern are sorted by the time they were
+	# last modified, segments removed while they are listed are left out.  The options are taken
+	# in the order they were added.
+	def logFilePaths(self):
+		caseDir=os.path.join(settings.MEDIA_ROOT, self.feature.case.getOptions()['caseDir'].lstrip("/"))
+		paths=[]
+		for name in self.logFiles() or ["log.pisoFoam"]:
+			pattern=os.path.join(caseDir, name)
+			found=[]
+			for path in glob.glob(pattern):
+				try:
+					found.append((os.path.getmtime(path), path))
+				except OSError:
+					# A rotated segment removed since the glob.
+					pass
+			found=[path for (mtime, path) in sorted(found)]
+			if not found:
+				# Let reading the log report that it is missing.
+				found=[pattern]
+			for path in found:
+				if path not in paths:
+					paths.append(path)
+		return paths
+
 	## Does a stat on the log file to get the time it was last modified.
 	def getLastUpdateTime(self):
 		time=datetime.datetime.utcfromtimestamp(os.path.getmtime(self.logFilePath()))
 		log.debug("FOAMLog: Last Update Time: %s" %time)
 		return time
-	
-	## Gets the first timestep in the log file
-	def getMinTime(self):
-		residuals=self.processLog()['residuals']
-		field=residuals.keys()[0]
-		data=residuals[field]['data']
-		return data[0][0]
 
-	## Gets the last timestep in the log file
-	def getMaxTime(self):
-		residuals=self.processLog()['residuals']
-		field=residuals.keys()[0]
-		data=residuals[field]['data']
-		return data[-1][0]
+	## Returns the time the newest segment of the log was last modified.
+	def getLastModified(self):
+		return max([os.path.getmtime(path) for path in self.logFilePaths()])
 
-	## Processes the log file and retrieves the residuals and the forces.
+	## Returns the number of series and the last time step in the log.
+	def getSummary(self):
+		with self.seriesLock():
+			count=len(self.getSeriesStore())
+		return "%d series to time %g" % (count, self.getMaxTime())
+	
+	## Processes the log file and retrieves the residuals and the forces.  The parsed log
+	# is shared by every feature reading it in this process, and only the part of the log
+	# written since it was last read is parsed.  A log split into segments is read as one,
+	# segments that have not changed are not read again.  When PERCYVAL_INGEST_DAEMON is set the
+	# ingestlogs command keeps the sidecar files up to date, so the parser read from the sidecar
+	# is used as it is.
 	def processLog(self):
 		try:
 			return self._logData
-		except:
+		except AttributeError:
 			pass
-		cacheKey="FOAMLOG_"+self.logFilePath()
-		logData=cache.get(cacheKey)
-		if logData:
-			self._logData=logData
+		source=getattr(self, '_logSource', None)
+		if source is not None:
+			self._logData=source.processLog()
+			self._logLock=source.seriesLock()
 			return self._logData
-
-		residuals={}
-		forces={}
-
-		r=open(self.logFilePath(), 'rb')
-		time=0
-		searchCoeffs=False
-		for line in r.readlines():
-			if line.startswith("Time = "):
-				time=float(line[7:])
-				searchCoeffs=False
-			if line.startswith("DILUPBiCG"):
-			#if line.startswith("smoothSolver") or line.startswith("GAMG") or line.startswith("DILUPBiCG"):
-				words=line.split()
-				fname=words[3].rstrip(",")
-				fvalue=float(words[7].rstrip(","))
-				try:
-					series=residuals[fname]
-				except KeyError:
-					residuals[fname]={
-						'name':fname,
-						'data':[]
-					}
-					series=residuals[fname]
-				series['data'].append([time,fvalue])
-			if line.startswith("forceCoeffs output:"):
-				searchCoeffs=True
-				continue
-			if searchCoeffs:
-				if not line.startswith(" "):
-					searchCoeffs=False
-					continue
-				(name,equals,value)=line.partition("=")
-				value=float(value)
-				try:
-					series=forces[name]
-				except KeyError:
-					forces[name]={
-							'name':name,
-							'data':[],
-							}
-					series=forces[name]
-				series['data'].append([time,value])
-
-		for series in residuals.keys():
-			residuals[series]['data'].sort(key=lambda d: d[0])
-
-		logData={'residuals':residuals,
-				'forces':forces,}
-		self._logData=logData
-		cache.set(cacheKey, self._logData,120)
+		with metrics.timed(PROCESS_LOG_SECONDS, 'log'):
+			paths=self.logFilePaths()
+			parse=not getattr(settings, 'PERCYVAL_INGEST_DAEMON', False)
+			if len(paths) == 1:
+				entry=getLogEntry(paths[0], parse)
+			else:
+				entry=getLogChain(paths, parse)
+		self._logData=entry.parser.data()
+		self._logLock=entry.lock
 		return self._logData
 
-## Plotting implementation for FOAM residuals.
-class FOAMResiduals(Plot, FOAMLog):
-	friendlyName="Residuals" 
-	## Gets the dictionary of residual values from the FOAM log file, sorted by name.
-	# Filters out any time stamps that are not in range.
-	def getSeries(self,startTime, endTime):
-		log=sorted(self.processLog()['residuals'].values(),key=lambda s: s['name'])
-		data=[]
-		for series in log:
-			s={}
-			s['key']=series['name']
-			s['values']=[]
-			for entry in series['data']:
-				if (entry[0] >= float(startTime)) and ( entry[0]<=float(endTime) ):
-					s['values'].append({'x':entry[0],'y':entry[1]})
-			while(len(s['values'])*len(log) > 15000):
-				s['values']=s['values'][::2]
-			data.append(s)
-		return data
-
-	## Gets the last update time from the foam log file.
-	def getLastUpdateTime(self):
-		return FOAMLog.getLastUpdateTime(self)
+	## Returns the set of series in the log that the feature plots.
+	def getSeriesStore(self):
+		return self.processLog()[self.logSection]
+
+	## Returns the lock to hold while reading the data returned by processLog, the log may be
+	# parsed by another thread at the same time.
+	def seriesLock(self):
+		self.processLog()
+		return self._logLock
+
+	## Makes processLog return the data of source, another FOAMLog feature reading the same log
+	# files, until clearLogData is called, so a log plotted by several features is only looked
+	# up once.
+	def shareLogData(self, source):
+		self._logSource=source
+
+	## Forgets the data read by processLog, so the next read picks up anything written to
+	# the log since.
+	def clearLogData(self):
+		self._logSource=None
+		try:
+			del self._logData
+			del self._logLock
+		except AttributeError:
+			pass
 
-	## Gets the latest time step in the log file.
-	def getMaxTime(self):
-		return FOAMLog.getMaxTime(self)
+	## Gets the points in the series after the time since.  The cursor returned is the last
+	# time step that has been completely written to the log, so a time step that was still
+	# being written is sent again on the next call.
+	def getColumnsSince(self, since, endTime, points=None, method=None):
+		with self.seriesLock():
+			data=self.getColumns(since, endTime, points, method, True)
+			completeTime=self.processLog()['completeTime']
+		if completeTime is None:
+			cursor=float(since)
+		else:
+			cursor=min(completeTime, float(endTime))
+		return {
+				'cursor':cursor,
+				'series':data,
+				}
 
-	## Gets the first time step in the log file.
-	def getMinTime(self):
-		return FOAMLog.getMinTime(self)
+## Plotting implementation for FOAM residuals.
+class FOAMResiduals(FOAMLog, Plot):
+	friendlyName="Residuals"
+	logSection='residuals'
+	## Residuals are inspected for spikes, so keep the extremes of each bucket.
+	downsampleMethod='minmax'
 
 ## Plotting implementation for foam force coefficiants.
-class FOAMForces(Plot, FOAMLog):
-	friendlyName="Forces" 
-	def getSeries(self,startTime, endTime):
-		log=sorted(self.processLog()['forces'].values(),key=lambda s: s['name'])
-		for series in log:
-			try:
-				while(series['data'][0][0]<float(startTime)):
-					series['data'].pop(0)
-				while(series['data'][-1][0]>float(endTime)):
-					series['data'].pop(-1)
-			except IndexError:
-				pass
-		return log
-
-	def getLastUpdateTime(self):
-		return FOAMLog.getLastUpdateTime(self)
-	def getMaxTime(self):
-		return FOAMLog.getMaxTime(self)
-
-	def getMinTime(self):
-		return FOAMLog.getMinTime(self)
-
-
-
-
+class FOAMForces(FOAMLog, Plot):
+	friendlyName="Forces"
+	logSection='forces'
+
+## Plotting implementation for the mean and maximum Courant number.
+class FOAMCourant(FOAMLog, Plot):
+	friendlyName="Courant Number"
+	logSection='courant'
+	## The maximum is watched for spikes, so keep the extremes of each bucket.
+	downsampleMethod='minmax'
+
+## Plotting implementation for the time step continuity errors.
+class FOAMContinuity(FOAMLog, Plot):
+	friendlyName="Continuity Errors"
+	logSection='continuity'
+
+## Plotting implementation for the execution and clock time.
+class FOAMExecutionTime(FOAMLog, Plot):
+	friendlyName="Execution Time"
+	logSection='executionTime'
+
+## Plotting implementation for the number of PIMPLE outer iterations in each time step.
+class FOAMPimpleIterations(FOAMLog, Plot):
+	friendlyName="PIMPLE Iterations"
+	logSection='pimple'
+
+## Names of the features that are plots.
+PLOT_FEATURES=[c.__name__ for c in Plot.__subclasses__()]
+
+## Returns the path on disk of a file given relative to the directory of case, which must end
+# with one of extensions.  Raises ValueError if it does not, is not a file, or is outside the
+# case directory.
+def caseFilePath(case, name, extensions):
+	base=os.path.normpath(os.path.join(settings.MEDIA_ROOT, case.getOptions()['caseDir'].lstrip("/")))
+	path=os.path.normpath(os.path.join(base, name))
+	if not path.startswith(base+os.sep):
+		raise ValueError
+	if os.path.splitext(path)[1] not in extensions:
+		raise ValueError
+	if not os.path.isfile(path):
+		raise ValueError
+	return path
 
 ## Searches for movies in the case directory
 class MovieGallery(Feature):
@@ -249,43 +394,37 @@ class MovieGallery(Feature):
 		return reverse('percyval.views.movieList', args=[str(self.feature.case.id)])
 	def getLastUpdateTime(self):
 		return self.getMovies()[0]['mTimeString']
+	def getLastModified(self):
+		return max([movie['mTime'] for movie in self.getMovies()])
+	def getSummary(self):
+		return "%d movies" % len(self.getMovies())
 
+	## Gets the movies in the subdirectories of the case directory, read through the case's
+	# filesystem index.
 	def getMovies(self):
 		try:
 			return self._movies
 		except AttributeError:
 			pass
-		base=os.path.join(settings.MEDIA_ROOT, self.feature.case.options.get(name='caseDir').value)
+		caseDir=self.feature.case.getOptions()['caseDir']
+		index=getIndex(os.path.join(settings.MEDIA_ROOT, caseDir))
 		movies=[]
-		for entry in os.listdir(base):
-			dir=os.path.join(base,entry)
-			if os.path.isdir(dir):
-				try:
-					for file in os.listdir(dir):
-						path=os.path.join(dir,file)
-						if ( file.endswith(".webm")):
-							path=path[len(base):]
-							path=path.lstrip("/")
-							data={
-								'name':os.path.basename(file)[:-5],
-								'URL':os.path.join(self.feature.case.options.get(name='caseDir').value,path),
-								'mTime':os.path.getmtime(os.path.join(base,path)),
-								'mTimeString':time.strftime("%Y-%m-%d %I:%M:%S %p",time.localtime(os.path.getmtime(os.path.join(base,path)))),
-							}
-							movies.append(data)
-				except OSError:
-					pass
+		for dir in index.subDirs():
+			for file in index.listDir(dir.path):
+				if file.name.endswith(".webm"):
+					movies.append({
+						'name':file.name[:-5],
+						'URL':os.path.join(caseDir, dir.name, file.name),
+						'mTime':file.mtime,
+						'mTimeString':time.strftime("%Y-%m-%d %I:%M:%S %p",time.localtime(file.mtime)),
+					})
 		self._movies=movies
 		return movies
 
+	## Returns the path on disk of a movie, given relative to the case directory.  Raises
+	# ValueError if it is not a movie in the case directory.
 	def getMoviePath(self, movie):
-		caseDir=os.path.join(settings.MEDIA_URL, self.feature.case.options.get(name='caseDir').value)
-		movie=os.path.join(caseDir,movie)
-		if not ( movie.endswith(".webm")):
-			raise ValueError
-		if not os.path.isfile(movie):
-			raise ValueError
-		return movie
+		return caseFilePath(self.feature.case, movie, [".webm"])
 
 class WebGLScenes(Feature):
 	friendlyName="3D Scenes"
@@ -295,6 +434,10 @@ class WebGLScenes(Feature):
 		scenes=self.getScenes()
 		log.debug(scenes)
 		return scenes.values()[0].values()[0]['mTimeString']
+	def getLastModified(self):
+		return max([scene['mTime'] for scene in self.getSceneList()])
+	def getSummary(self):
+		return "%d scenes" % len(self.getScenes())
 	def getSceneList(self):
 		scenes=[]
 		for scene in self.getScenes().values():
@@ -308,59 +451,34 @@ class WebGLScenes(Feature):
 		return sorted(scenes, key=lambda k: k['mTime'], reverse=True)
 
 
+	## Gets the scenes in the WebGL directory of the case, read through the case's filesystem
+	# index.
 	def getScenes(self):
 		try:
 			return self._scenes
 		except AttributeError:
 			pass
-		cacheKey="WEBGLSCENSE_%s" % self.feature.id
-		#scenes=cache.get(cacheKey)
-		#if scenes:
-		#	self._scenes=scenes
-		#	return self._scenes
-
-		base=os.path.join(
-				settings.MEDIA_ROOT, 
-				self.feature.case.options.get(name='caseDir').value.lstrip("/"),
-				"WebGL")
-		log.debug("getScenes: Media Root: %s" % settings.MEDIA_ROOT)
+		caseDir=self.feature.case.getOptions()['caseDir'].lstrip("/")
+		index=getIndex(os.path.join(settings.MEDIA_ROOT, caseDir))
+		base=os.path.join(index.base, "WebGL")
 		log.debug("getScenes: Base: %s" %base)
 		scenes={}
-		if not os.path.exists(base):
-			return scenes
-		if not os.path.isdir(base):
-			return scenes
-		for entry in os.listdir(base):
-			dir=os.path.join(base,entry)
-			if os.path.isdir(dir):
-				try:
-					for file in os.listdir(dir):
-						path=os.path.join(dir,file)
-						if file.endswith(".html"):
-							path=path[len(base):]
-							path=path.lstrip("/")
-							data={
-									'scene':entry,
-									'localPath':os.path.join(base,path),
-									'name':os.path.basename(path),
-									'URL':os.path.join(self.feature.case.options.get(name='caseDir').value,"WebGL",path),
-									'mTime':os.path.getmtime(os.path.join(base,path)),
-									'mTimeString':time.strftime("%Y-%m-%d %I:%M:%S %p",time.localtime(os.path.getmtime(os.path.join(base,path)))),
-									}
-							try:
-								scenes[entry][path]=data
-							except:
-								scenes[entry]={path:data}
-				except OSError:
-					pass
+		for dir in index.subDirs(base):
+			for file in index.listDir(dir.path):
+				if file.name.endswith(".html"):
+					path=os.path.join(dir.name, file.name)
+					data={
+							'scene':dir.name,
+							'localPath':file.path,
+							'name':file.name,
+							'URL':os.path.join(caseDir,"WebGL",path),
+							'mTime':file.mtime,
+							'mTimeString':time.strftime("%Y-%m-%d %I:%M:%S %p",time.localtime(file.mtime)),
+							}
+					scenes.setdefault(dir.name, {})[path]=data
 		self._scenes=scenes
-		cache.set(cacheKey, self._scenes,120) 
 		return self._scenes
 
-
-
-
-
 ## Searches for images in the case directory
 class ImageGallery(Feature):
 	friendlyName="Images"
@@ -378,6 +496,7 @@ class ImageGallery(Feature):
 				'mTimeString': img['mTimeString'],
 				'mTime': img['mTime'],
 				'image': img['URL'],
+				'thumbnailURL': img['thumbnailURL'],
 			})
 		return sorted(galleries, key=lambda k: k['mTime'], reverse=True)
 
@@ -387,49 +506,67 @@ class ImageGallery(Feature):
 		except IndexError:
 			return None
 
+	def getLastModified(self):
+		return max([gallery['mTime'] for gallery in self.getGalleries()])
+
+	def getSummary(self):
+		images=self.getImages()
+		return "%d images in %d galleries" % (sum([len(gallery) for gallery in images.values()]), len(images))
+
+	## Gets the images in the subdirectories of the case directory, keyed by gallery, read
+	# through the case's filesystem index.
 	def getImages(self):
 		try:
 			return self._images
 		except AttributeError:
 			pass
-		base=os.path.join(settings.MEDIA_ROOT, self.feature.case.options.get(name='caseDir').value)
+		caseDir=self.feature.case.getOptions()['caseDir']
+		index=getIndex(os.path.join(settings.MEDIA_ROOT, caseDir))
 		images={}
-		for entry in os.listdir(base):
-			dir=os.path.join(base,entry)
-			if os.path.isdir(dir):
-				try:
-					for file in os.listdir(dir):
-						path=os.path.join(dir,file)
-						if ( file.endswith(".jpg") or file.endswith(".png") )and os.path.isfile(path):
-							path=path[len(base):]
-							path=path.lstrip("/")
-							data={
-								'gallery':entry,
-								'localPath':os.path.join(base,path),
-								'name':os.path.basename(path),
-								'URL':os.path.join(self.feature.case.options.get(name='caseDir').value,path),
-								'mTime':os.path.getmtime(os.path.join(base,path)),
-								'mTimeString':time.strftime("%Y-%m-%d %I:%M:%S %p",time.localtime(os.path.getmtime(os.path.join(base,path)))),
-							}
-							try:
-								images[entry][path]=data
-							except:
-								images[entry]={path:data}
-				except OSError:
-					pass
-		self.images=images
+		for dir in index.subDirs():
+			for file in index.listDir(dir.path):
+				if ( file.name.endswith(".jpg") or file.name.endswith(".png") ) and file.isFile:
+					path=os.path.join(dir.name, file.name)
+					data={
+						'gallery':dir.name,
+						'localPath':file.path,
+						'name':file.name,
+						'URL':os.path.join(caseDir,path),
+						'mTime':file.mtime,
+						'bytes':file.size,
+						'mTimeString':time.strftime("%Y-%m-%d %I:%M:%S %p",time.localtime(file.mtime)),
+						'thumbnailURL':self.getThumbnailURL(path, 'medium', file.mtime),
+						'previewURL':self.getThumbnailURL(path, 'large', file.mtime),
+					}
+					images.setdefault(dir.name, {})[path]=data
+		self._images=images
 		return images
 
-	def getImagePath(self, image):
-		caseDir=self.feature.case.options.get(name='caseDir').value
-		image=os.path.join(caseDir,image)
-		if not ( image.endswith(".jpg") or image.endswith(".png") ):
-			raise ValueError
-		if not os.path.isfile(image):
+	## Returns the URL of the named rendition of an image, which changes whenever the image does
+	# so the rendition can be cached by the browser.
+	def getThumbnailURL(self, image, size, mTime):
+		return "%s?v=%d" % (reverse('percyval.views.imageThumbnail', args=[self.feature.case.id, size, image]), mTime)
+
+	## Returns the path on disk of an image in one of the galleries.  Raises ValueError if
+	# there is no such image.
+	def getImageLocalPath(self, image):
+		try:
+			return self.getImages()[image.split("/")[0]][image]['localPath']
+		except KeyError:
 			raise ValueError
-		return image
-		
 
+	## Returns the path on disk of an image, given relative to the case directory.  Raises
+	# ValueError if it is not an image in the case directory.
+	def getImagePath(self, image):
+		return caseFilePath(self.feature.case, image, [".jpg", ".png"])
+
+
+# Returns the datetime for a time in seconds since the epoch, in the current time zone.
+def _localDatetime(timestamp):
+	value=datetime.datetime.fromtimestamp(timestamp)
+	if getattr(settings, 'USE_TZ', False):
+		value=timezone.make_aware(value, timezone.get_default_timezone())
+	return value
 
 ## Cases store information about active cases
 class Case(models.Model):
@@ -440,6 +577,13 @@ class Case(models.Model):
 			)
 	owner=models.ForeignKey(User, related_name="cases")
 	description=models.TextField(blank=True)
+	lastUpdated=models.DateTimeField(
+			help_text="The time the newest data of any feature was last modified, stored by the refreshcases command",
+			verbose_name="Last Updated",
+			null=True,
+			blank=True,
+			editable=False,
+			)
 
 	def __unicode__(self):
 		return u'%s' % self.name
@@ -448,6 +592,10 @@ class Case(models.Model):
 	def get_absolute_url(self):
 		return reverse('percyval.views.caseDefaultView', args=[str(self.id)])
 
+	## Returns the options of the case as an OptionMap, read in a single query.
+	def getOptions(self):
+		return getOptionMap(self)
+
 	def getLastUpdateTime(self):
 		for f in self.features.all():
 			try:
@@ -456,6 +604,22 @@ class Case(models.Model):
 				pass
 		return "Unknown"
 
+	## Refreshes the stored last update time and summary of each feature, and of the case
+	# from the newest of them.  features may be given if they have already been read.
+	def refreshSummary(self, features=None):
+		if features is None:
+			features=self.features.all()
+		times=[]
+		for feature in features:
+			feature.case=self
+			feature.refreshSummary()
+			if feature.lastUpdated is not None:
+				times.append(feature.lastUpdated)
+		lastUpdated=max(times) if times else None
+		if lastUpdated != self.lastUpdated:
+			self.lastUpdated=lastUpdated
+			Case.objects.filter(pk=self.pk).update(lastUpdated=lastUpdated)
+
 ## CaseOptions are options associated with cases, multiple options with the same name can exist, this allows users to specify
 #  options for the entire case, such as its location
 class CaseOption(models.Model):
@@ -483,10 +647,41 @@ class CaseFeature(models.Model):
 			verbose_name="Feature Name",
 			max_length=128,
 			)
+	lastUpdated=models.DateTimeField(
+			help_text="The time the data of the feature was last modified, stored by the refreshcases command",
+			verbose_name="Last Updated",
+			null=True,
+			blank=True,
+			editable=False,
+			)
+	summary=models.CharField(
+			help_text="A short description of the data of the feature, stored by the refreshcases command",
+			verbose_name="Summary",
+			max_length=255,
+			blank=True,
+			editable=False,
+			)
 	def __unicode__(self):
 		return u'%s' % self.name
 	def __str__(self):
 		return self.name
+	## Returns the options of the feature as an OptionMap, read in a single query.
+	def getOptions(self):
+		return getOptionMap(self)
+	## Reads the last update time and summary from the feature and stores them.  Only the
+	# two fields are written, and only if they have changed.  A feature with no data yet
+	# keeps the last values stored.
+	def refreshSummary(self):
+		try:
+			lastUpdated=_localDatetime(self.getLastModified())
+			summary=self.getSummary()[:255]
+		except Exception, e:
+			log.debug("CaseFeature: no summary for feature %s: %s" % (self.id, e))
+			return
+		if lastUpdated != self.lastUpdated or summary != self.summary:
+			self.lastUpdated=lastUpdated
+			self.summary=summary
+			CaseFeature.objects.filter(pk=self.pk).update(lastUpdated=lastUpdated, summary=summary)
 	def __getFeature(self):
 		try:
 			return self.__feature
@@ -502,6 +697,38 @@ class CaseFeature(models.Model):
 		except NameError:
 			raise AttributeError
 
+## Reads the features of cases in a single query and sets featureList on each case to its
+# features, ordered by id, with the case already set so reading it costs no query.
+def attachFeatures(cases):
+	byId=dict([(case.id, case) for case in cases])
+	for case in cases:
+		case.featureList=[]
+	if not byId:
+		return cases
+	for feature in CaseFeature.objects.filter(case__in=byId.keys()).order_by('id'):
+		case=byId[feature.case_id]
+		feature.case=case
+		case.featureList.append(feature)
+	return cases
+
+## Returns the plot features of case, ordered by id, with their options and the case already
+# read.  Features reading the same log files share the data of the first of them, so however
+# many features plot a log it is only processed once.
+def loadPlots(case):
+	plots=list(case.features.filter(name__in=PLOT_FEATURES).order_by('id'))
+	loadOptionMaps(plots)
+	sources={}
+	for plot in plots:
+		plot.case=case
+		if not hasattr(plot, 'logFilePaths'):
+			continue
+		key=tuple(plot.logFilePaths())
+		if key in sources:
+			plot.shareLogData(sources[key])
+		else:
+			sources[key]=plot
+	return plots
+
 ##FeatureOptions are options associated with features, multiple options with the same name can exist, this allows users to specify
 # array of values for a specific option, this is retrieved with the filter or get methods.  Feature options differ from case options
 # in that they are associated with the feature registered with the case, and not the case globally
@@ -521,3 +748,56 @@ class FeatureOption(models.Model):
 		return u'%s' % self.name
 	def __str__(self):
 		return self.name
+
+## Creates the cases described by specs, dictionaries in the format taken by the create view,
+# in a single transaction.  Each case is inserted on its own, as its id is needed, but the
+# options, features and feature options of every case are each inserted with a single bulk
+# insert.  Returns the cases in the order given.  Raises KeyError with the name of an owner
+# that does not exist, in which case nothing is created.
+@transaction.commit_on_success
+def createCases(specs):
+	usernames=set([spec['owner'] for spec in specs])
+	owners=dict([(user.username, user) for user in User.objects.filter(username__in=usernames)])
+	for username in usernames:
+		if username not in owners:
+			raise KeyError(username)
+	cases=[]
+	options=[]
+	features=[]
+	for spec in specs:
+		case=Case.objects.create(name=spec['name'], owner=owners[spec['owner']])
+		cases.append(case)
+		for option in spec.get('options', []):
+			options.append(CaseOption(case=case, name=option['name'], value=option['value']))
+		names=[]
+		for feature in spec['features']:
+			if feature['name'] not in names:
+				names.append(feature['name'])
+				features.append(CaseFeature(case=case, name=feature['name']))
+	CaseOption.objects.bulk_create(options)
+	CaseFeature.objects.bulk_create(features)
+	# Bulk inserts do not set the ids, so the features are read back to find them.
+	featureIds={}
+	caseIds=[case.id for case in cases]
+	for start in range(0, len(caseIds), 500):
+		for (id, caseId, name) in CaseFeature.objects.filter(case__in=caseIds[start:start+500]).values_list('id', 'case', 'name'):
+			featureIds[(caseId, name)]=id
+	featureOptions=[]
+	for (case, spec) in zip(cases, specs):
+		for feature in spec['features']:
+			for option in feature.get('options', []):
+				featureOptions.append(FeatureOption(feature_id=featureIds[(case.id, feature['name'])], name=option['name'], value=option['value']))
+	FeatureOption.objects.bulk_create(featureOptions)
+	# Bulk inserts do not send the signals that drop the options kept by getOptions.
+	invalidate()
+	return cases
+
+# Drops the options kept by getOptions whenever an option changes, or a case or feature is
+# deleted so a new one given its id does not find its options.
+def _optionsChanged(sender, **kwargs):
+	invalidate()
+
+for model in [CaseOption, FeatureOption]:
+	post_save.connect(_optionsChanged, sender=model, dispatch_uid="percyval.options.%s.save" % model.__name__)
+for model in [CaseOption, FeatureOption, Case, CaseFeature]:
+	post_delete.connect(_optionsChanged, sender=model, dispatch_uid="percyval.options.%s.delete" % model.__name__)
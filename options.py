@@ -0,0 +1,98 @@
+#  Copyright 2011 David Irvine
+#
+#  This file is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This file is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with This file.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The options of a case or feature, read in a single query and kept with the
+#  case or feature object, which lives for a single request.  Setting
+#  PERCYVAL_OPTION_CACHE keeps them for the life of the process as well.  Any
+#  option saved or deleted, or case or feature deleted, in this process drops
+#  what is kept, but a change made by another process is not seen, so the
+#  process wide cache should only be turned on where options are changed
+#  through this process, or rarely.
+import threading
+from django.conf import settings
+
+## The options of a case or feature, by name.  Several options may have the same name, they
+#  are kept in the order they were added.
+class OptionMap(object):
+	def __init__(self, options):
+		self.values={}
+		for (name, value) in options:
+			self.values.setdefault(name, []).append(value)
+
+	## Returns the value of the first option called name.  Raises KeyError if there is none.
+	def __getitem__(self, name):
+		return self.values[name][0]
+
+	def __contains__(self, name):
+		return name in self.values
+
+	## Returns the value of the first option called name, or default if there is none.
+	def get(self, name, default=None):
+		try:
+			return self[name]
+		except KeyError:
+			return default
+
+	## Returns the values of every option called name, in the order they were added.
+	def getList(self, name):
+		return list(self.values.get(name, []))
+
+_maps={}
+_generation=0
+_lock=threading.Lock()
+
+## Returns the options of instance, a case or feature, from its options relation.  They are read
+#  once for each instance, or once for each process if PERCYVAL_OPTION_CACHE is set.
+def getOptionMap(instance):
+	cached=getattr(instance, '_optionMap', None)
+	if cached is not None and cached[0] == _generation:
+		return cached[1]
+	key=(instance.__class__.__name__, instance.pk)
+	processWide=getattr(settings, 'PERCYVAL_OPTION_CACHE', False)
+	with _lock:
+		generation=_generation
+		optionMap=_maps.get(key) if processWide else None
+	if optionMap is None:
+		optionMap=OptionMap(instance.options.order_by('id').values_list('name', 'value'))
+		if processWide:
+			with _lock:
+				if generation == _generation:
+					_maps[key]=optionMap
+	instance._optionMap=(generation, optionMap)
+	return optionMap
+
+## Drops every option map kept, so they are read again.  Called whenever an option is saved
+#  or deleted, or a case or feature is deleted, see models.  Saving a case or feature does not
+#  change its options, so it is not hooked.
+def invalidate():
+	global _generation
+	with _lock:
+		_generation+=1
+		_maps.clear()
+
+## Reads the options of several instances, cases or features, in a single query and keeps
+#  them with each instance as getOptionMap would.  The instances must all be of one model.
+def loadOptionMaps(instances):
+	if not instances:
+		return
+	related=instances[0].__class__.options.related
+	owner=related.field.name
+	with _lock:
+		generation=_generation
+	options={}
+	for (pk, name, value) in related.model.objects.filter(**{owner+"__in":[instance.pk for instance in instances]}).order_by('id').values_list(owner, 'name', 'value'):
+		options.setdefault(pk, []).append((name, value))
+	for instance in instances:
+		instance._optionMap=(generation, OptionMap(options.get(instance.pk, [])))
@@ -0,0 +1,131 @@
+#  Copyright 2011 David Irvine
+#
+#  This file is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This file is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with This file.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  Series from the plots of several cases drawn on one chart, such as the drag
+#  of each variant in a sweep.  The logs are loaded at the same time by a pool
+#  of threads, so a sweep loads in about the time of its slowest case, and
+#  waiting on the disk or network releases the interpreter lock.  A case that
+#  is not loaded in time is left out of the response, and carries on loading in
+#  the pool, so it is likely to be there next time.
+#  A log is only loaded by one thread at a time, later requests wait on the load
+#  already running, so a log that hangs holds a single thread of the pool.
+import time
+import logging
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from django.conf import settings
+from percyval import metrics
+
+log = logging.getLogger(__name__)
+
+## Most series a single overlay may hold.
+MAX_SERIES=50
+
+LOAD_SECONDS=metrics.histogram('percyval_overlay_load_seconds', "Time taken to load the logs of every case in an overlay.")
+ERRORS=metrics.counter('percyval_overlay_errors_total', "Series left out of an overlay, by reason.", ['error'])
+
+_pool=None
+_lock=threading.Lock()
+# The loads running in the pool, by log, see _logKey.
+_loading={}
+
+# Returns the pool the series are loaded in, PERCYVAL_OVERLAY_WORKERS sets the number of
+# threads.
+def _getPool():
+	global _pool
+	with _lock:
+		if _pool is None:
+			_pool=ThreadPool(getattr(settings, 'PERCYVAL_OVERLAY_WORKERS', 4))
+		return _pool
+
+## Loads the data of the plot feature if needed.  Run in the pool, so the options of the
+#  feature and its case must already be loaded, the pool threads do not use the database.
+def loadLog(feature):
+	with feature.seriesLock():
+		feature.getSeriesStore()
+
+## Returns the first and last time of the series called field of the plot feature, once its
+#  data has been loaded by loadLog.
+def loadSeries(feature, field):
+	with feature.seriesLock():
+		series=feature.getSeriesStore()[field]
+		return (series.getMinTime(), series.getMaxTime())
+
+# Returns the key of the log read by feature, made from its case and options so finding it
+# does not touch the disk.  Features of a case reading the same log files share a key.
+def _logKey(feature):
+	try:
+		return (feature.case_id, tuple(feature.logFiles()))
+	except AttributeError:
+		return (feature.case_id, feature.pk)
+
+# Returns the load of the log read by feature in pool and whether it was already running,
+# starting it if not.
+def _startLoad(pool, feature):
+	key=_logKey(feature)
+	with _lock:
+		for done in [k for (k, result) in _loading.items() if result.ready()]:
+			del _loading[done]
+		if key in _loading:
+			return (_loading[key], True)
+		result=pool.apply_async(loadLog, (feature,))
+		_loading[key]=result
+		return (result, False)
+
+## Returns the series asked for by requests, a list of (key, feature, field), as a list of
+#  (key, times, values) downsampled to at most points values with the named method, or the
+#  method of each feature if it is None.  Every series covers the same range, from startTime
+#  to endTime, which default to the first and last time of any of the series.  Each series has
+#  timeout seconds from the start of the call to load, a log still loading for an earlier
+#  call is reported as such.  Returns the series, a list of {"key", "error"} for those that
+#  could not be loaded, and the range.
+def overlay(requests, startTime, endTime, points, method, timeout):
+	pool=_getPool()
+	deadline=time.time()+timeout
+	loads={}
+	pending=[]
+	for (key, feature, field) in requests:
+		logKey=_logKey(feature)
+		if logKey not in loads:
+			loads[logKey]=_startLoad(pool, feature)
+		pending.append((key, feature, field)+loads[logKey])
+	loaded=[]
+	errors=[]
+	with metrics.timed(LOAD_SECONDS, 'overlay'):
+		for (key, feature, field, result, running) in pending:
+			try:
+				result.get(max(deadline-time.time(), 0))
+				loaded.append((key, feature, field, loadSeries(feature, field)))
+			except multiprocessing.TimeoutError:
+				ERRORS.inc(error='loading' if running else 'timeout')
+				errors.append({'key':key, 'error':"Still loading the log." if running else "Timed out loading the log."})
+			except (KeyError, IndexError):
+				ERRORS.inc(error='missing')
+				errors.append({'key':key, 'error':"No data for %s." % field})
+			except Exception, e:
+				log.warning("overlay: could not load %s: %s" % (key, e))
+				ERRORS.inc(error='failed')
+				errors.append({'key':key, 'error':"Could not read the log."})
+	if startTime is None and loaded:
+		startTime=min([first for (key, feature, field, (first, last)) in loaded])
+	if endTime is None and loaded:
+		endTime=max([last for (key, feature, field, (first, last)) in loaded])
+	series=[]
+	for (key, feature, field, bounds) in loaded:
+		with feature.seriesLock():
+			(times, values)=feature.getSeriesStore()[field].query(startTime, endTime, points, method or feature.downsampleMethod)
+		series.append((key, times, values))
+	return (series, errors, startTime, endTime)
@@ -0,0 +1,531 @@
+#  Copyright 2011 David Irvine
+#
+#  This file is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This file is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with This file.  If not, see <http://www.gnu.org/licenses/>.
+#
+from array import array
+from bisect import bisect_left, bisect_right
+
+## Returns column as an array that can be written to, read only columns such as
+#  a MappedColumn are copied.
+def toArray(column):
+	if isinstance(column, array):
+		return column
+	return column.toArray()
+
+## One level of a Pyramid.  Each entry summarises a bucket of consecutive raw
+#  points, holding the time of the first point and the smallest, largest and
+#  mean value in the bucket.
+class Level(object):
+	def __init__(self):
+		self.times=array('d')
+		self.mins=array('d')
+		self.maxs=array('d')
+		self.means=array('d')
+		## Number of buckets at the start of the level that are full and
+		#  will not change as more points arrive.
+		self.complete=0
+
+	def __len__(self):
+		return len(self.times)
+
+	## Removes every bucket from index onwards.
+	def truncate(self, index):
+		self.times=toArray(self.times)
+		self.mins=toArray(self.mins)
+		self.maxs=toArray(self.maxs)
+		self.means=toArray(self.means)
+		del self.times[index:]
+		del self.mins[index:]
+		del self.maxs[index:]
+		del self.means[index:]
+
+	def nbytes(self):
+		return 4*len(self.times)*self.times.itemsize
+
+	def __getstate__(self):
+		return {
+				'times':self.times.tostring(),
+				'mins':self.mins.tostring(),
+				'maxs':self.maxs.tostring(),
+				'means':self.means.tostring(),
+				'complete':self.complete,
+				}
+
+	def __setstate__(self, state):
+		for name in ['times', 'mins', 'maxs', 'means']:
+			column=array('d')
+			column.fromstring(state[name])
+			setattr(self, name, column)
+		self.complete=state['complete']
+
+## Multi-resolution summary of a series.  Level k holds one bucket for every
+#  2**k raw points, built by merging pairs of buckets from the level below.
+#  Only the buckets that were incomplete, or are new, are recalculated when
+#  points are appended, so keeping the pyramid up to date as a log grows is
+#  cheap.
+class Pyramid(object):
+	## Levels are not built once they would hold fewer buckets than this.
+	MIN_LEVEL_SIZE=64
+
+	def __init__(self):
+		self.levels=[]
+
+	## Brings the pyramid up to date with the points in the series.
+	def update(self, series):
+		n=len(series.times)
+		src=(series.times, series.values, series.values, series.values)
+		srcLen=n
+		srcComplete=n
+		k=1
+		while srcLen > self.MIN_LEVEL_SIZE:
+			if len(self.levels) < k:
+				self.levels.append(Level())
+			level=self.levels[k-1]
+			(times, mins, maxs, means)=src
+			# Size in raw points of a full bucket in the source level.
+			size=1 << (k-1)
+			level.truncate(level.complete)
+			for j in range(level.complete, (srcLen+1)//2):
+				a=2*j
+				b=a+1
+				if b < srcLen:
+					countB=min(size, n-b*size)
+					level.times.append(times[a])
+					level.mins.append(min(mins[a], mins[b]))
+					level.maxs.append(max(maxs[a], maxs[b]))
+					level.means.append((means[a]*size+means[b]*countB)/(size+countB))
+				else:
+					level.times.append(times[a])
+					level.mins.append(mins[a])
+					level.maxs.append(maxs[a])
+					level.means.append(means[a])
+			level.complete=srcComplete//2
+			src=(level.times, level.mins, level.maxs, level.means)
+			srcLen=len(level)
+			srcComplete=level.complete
+			k+=1
+
+	## Returns the coarsest level that still has at least points buckets between the raw
+	#  indexes start and end, along with its number.  Returns (0, None) when the raw
+	#  points should be used.
+	def chooseLevel(self, start, end, points):
+		k=0
+		while k < len(self.levels) and ((end-start) >> (k+1)) >= points:
+			k+=1
+		if k == 0:
+			return (0, None)
+		return (k, self.levels[k-1])
+
+	def nbytes(self):
+		return sum([level.nbytes() for level in self.levels])
+
+## A single named series of (time, value) points, stored as two growable
+#  arrays of doubles.  Points are kept in time order so a range of times
+#  can be found with a binary search, and a Pyramid of coarser summaries
+#  is kept alongside so wide ranges can be read without visiting every point.
+class Series(object):
+	def __init__(self, name):
+		self.name=name
+		self.times=array('d')
+		self.values=array('d')
+		self.ordered=True
+		## Set when points have been added since the pyramid was updated.
+		self.dirty=False
+		self.pyramid=Pyramid()
+
+	def __len__(self):
+		return len(self.times)
+
+	## Adds a point to the end of the series.  Points that go back in time,
+	#  for example after a restart, mark the series for sorting.
+	def append(self, time, value):
+		if self.ordered and self.times and time < self.times[-1]:
+			self.ordered=False
+		try:
+			self.times.append(time)
+		except AttributeError:
+			# The points are mapped from a sidecar file, copy them before writing.
+			self.times=toArray(self.times)
+			self.values=toArray(self.values)
+			self.times.append(time)
+		self.values.append(value)
+		self.dirty=True
+
+	## Adds the points of another series to the end of this one, as if each had been
+	#  appended.
+	def extend(self, other):
+		if not len(other):
+			return
+		if self.ordered and (not other.ordered or (self.times and other.times[0] < self.times[-1])):
+			self.ordered=False
+		self.times=toArray(self.times)
+		self.values=toArray(self.values)
+		self.times.extend(other.times)
+		self.values.extend(other.values)
+		self.dirty=True
+
+	## Puts the points back in time order, points with the same time keep
+	#  the order they were added in.
+	def sort(self):
+		if self.ordered:
+			return
+		order=sorted(range(len(self.times)), key=self.times.__getitem__)
+		self.times=array('d', [self.times[i] for i in order])
+		self.values=array('d', [self.values[i] for i in order])
+		self.ordered=True
+		self.pyramid=Pyramid()
+
+	## Sorts the series if needed and brings the pyramid up to date, call this once a
+	#  batch of points has been appended.
+	def refresh(self):
+		if not self.dirty:
+			return
+		self.sort()
+		self.pyramid.update(self)
+		self.dirty=False
+
+	## Returns the first time in the series.
+	def getMinTime(self):
+		return self.times[0]
+
+	## Returns the last time in the series.
+	def getMaxTime(self):
+		return self.times[-1]
+
+	## Returns the indexes of the first point at or after startTime, and the
+	#  point after the last point at or before endTime.  If after is set the
+	#  range starts at the first point after startTime.
+	def indexRange(self, startTime, endTime, after=False):
+		if after:
+			return (bisect_right(self.times, startTime), bisect_right(self.times, endTime))
+		return (bisect_left(self.times, startTime), bisect_right(self.times, endTime))
+
+	## Returns copies of the times and values between startTime and endTime
+	#  inclusive.
+	def window(self, startTime, endTime):
+		(start, end)=self.indexRange(startTime, endTime)
+		return (self.times[start:end], self.values[start:end])
+
+	## Returns at most points values between startTime and endTime, downsampled with
+	#  the named method.  The coarsest pyramid level that still has enough buckets is
+	#  read in place of the raw points, the minmax method reads the bucket extremes and
+	#  the others read the bucket means.  If after is set points at startTime are left out.
+	def query(self, startTime, endTime, points, method, after=False):
+		(start, end)=self.indexRange(startTime, endTime, after)
+		if method == 'minmax':
+			(k, level)=self.pyramid.chooseLevel(start, end, (points+1)//2)
+		else:
+			(k, level)=self.pyramid.chooseLevel(start, end, points)
+		if level is None:
+			(times, values)=(self.times[start:end], self.values[start:end])
+		else:
+			first=start >> k
+			last=((end-1) >> k)+1
+			if method == 'minmax':
+				times=array('d')
+				values=array('d')
+				for i in range(first, last):
+					times.append(level.times[i])
+					times.append(level.times[i])
+					values.append(level.mins[i])
+					values.append(level.maxs[i])
+			else:
+				(times, values)=(level.times[first:last], level.means[first:last])
+		return downsample(times, values, points, method)
+
+	## Returns True if query returns the raw points between the indexes start and end as they
+	#  are, rather than reading the pyramid or downsampling them.
+	def queriesRaw(self, start, end, points, method):
+		if end-start > points:
+			return False
+		if method == 'minmax':
+			points=(points+1)//2
+		return self.pyramid.chooseLevel(start, end, points)[1] is None
+
+	## Returns the number of bytes used to hold the points and the pyramid.
+	def nbytes(self):
+		return (len(self.times)+len(self.values))*self.times.itemsize+self.pyramid.nbytes()
+
+	# Arrays pickle as a list of python floats, store the raw bytes instead.
+	def __getstate__(self):
+		return {
+				'name':self.name,
+				'times':self.times.tostring(),
+				'values':self.values.tostring(),
+				'ordered':self.ordered,
+				'dirty':self.dirty,
+				'pyramid':self.pyramid,
+				}
+
+	def __setstate__(self, state):
+		self.name=state['name']
+		self.times=array('d')
+		self.times.fromstring(state['times'])
+		self.values=array('d')
+		self.values.fromstring(state['values'])
+		self.ordered=state['ordered']
+		self.dirty=state.get('dirty', True)
+		self.pyramid=state.get('pyramid', Pyramid())
+
+# Refreshes series in a worker process for refreshStores.  Returns just the pyramid if the
+# points were already in order, so they are not sent back, or the whole series otherwise.
+def refreshSeries(series):
+	ordered=series.ordered
+	series.refresh()
+	if ordered:
+		return series.pyramid
+	return series
+
+## Refreshes every series in stores, building the pyramids of the series that need it in
+#  pool in parallel.  Used once a whole log has been parsed in parallel, when building the
+#  pyramids is as much work as parsing the log.
+def refreshStores(stores, pool):
+	dirty=[(store, series) for store in stores for series in store.series.values() if series.dirty]
+	results=pool.map(refreshSeries, [series for (store, series) in dirty])
+	for ((store, series), result) in zip(dirty, results):
+		if isinstance(result, Series):
+			store.add(result)
+		else:
+			series.pyramid=result
+			series.dirty=False
+
+## The points of a column of a series between two indexes, read a slice at a time while
+#  holding lock, so a wide range is never copied whole.  Points are only ever appended to a
+#  column, or the series given new columns, so the points in the window do not change while
+#  it is read.
+class ColumnWindow(object):
+	def __init__(self, column, start, end, lock):
+		self.column=column
+		self.start=start
+		self.end=end
+		self.lock=lock
+
+	def __len__(self):
+		return self.end-self.start
+
+	## Returns a copy of the points from index i to j of the window, only slices may be read.
+	def __getitem__(self, index):
+		(i, j, step)=index.indices(len(self))
+		with self.lock:
+			return self.column[self.start+i:self.start+max(i, j)]
+
+## A collection of series, keyed by name.
+class SeriesStore(object):
+	def __init__(self):
+		self.series={}
+
+	def __len__(self):
+		return len(self.series)
+
+	def __contains__(self, name):
+		return name in self.series
+
+	def __getitem__(self, name):
+		return self.series[name]
+
+	## Adds an existing series to the store, replacing any with the same name.
+	def add(self, series):
+		self.series[series.name]=series
+
+	## Adds a point to the named series, creating it if needed.
+	def append(self, name, time, value):
+		try:
+			series=self.series[name]
+		except KeyError:
+			series=Series(name)
+			self.series[name]=series
+		series.append(time, value)
+
+	## Adds the points of every series in another store to the end of the series with the
+	#  same name, creating it if needed.
+	def extend(self, other):
+		for series in other.series.values():
+			try:
+				self.series[series.name].extend(series)
+			except KeyError:
+				self.add(series)
+
+	## Returns the names of the series in alphabetical order.
+	def names(self):
+		return sorted(self.series.keys())
+
+	## Returns the series in alphabetical order of name.
+	def sortedSeries(self):
+		return [self.series[name] for name in self.names()]
+
+	## Refreshes every series, call this once a batch of points has been appended.
+	def refresh(self):
+		for series in self.series.values():
+			series.refresh()
+
+	## Returns the number of bytes used by all the series.
+	def nbytes(self):
+		return sum([s.nbytes() for s in self.series.values()])
+
+## Joins the series read from consecutive segments of a log into one store, as if a single
+#  log had been read.  A run restarted from an earlier time writes the times after the
+#  restart again, so points of a segment at or after the first time of the same series in a
+#  later segment are dropped.  Only the last segment is expected to grow, while it just has
+#  points appended they are added to the joined series, anything else rebuilds them.
+class SeriesChain(object):
+	def __init__(self):
+		self.store=SeriesStore()
+		## The stores of the segments the series were joined from.
+		self.sources=[]
+		## The number of points and last time taken from each series in the last segment.
+		self.taken={}
+
+	## Brings the joined series up to date with the stores of the segments, oldest first.
+	#  Returns the joined store.
+	def update(self, stores):
+		if not self.extend(stores):
+			self.rebuild(stores)
+		self.sources=list(stores)
+		last=self.sources[-1]
+		self.taken=dict([(s.name, (len(s), s.times[-1])) for s in last.sortedSeries() if len(s)])
+		self.store.refresh()
+		return self.store
+
+	# Appends the points added to the last segment since the previous update.  Returns False
+	# if the series have to be rebuilt.
+	def extend(self, stores):
+		if len(stores) != len(self.sources):
+			return False
+		for (store, source) in zip(stores, self.sources):
+			if store is not source:
+				return False
+		last=stores[-1]
+		for series in last.sortedSeries():
+			if not len(series):
+				continue
+			try:
+				(count, lastTime)=self.taken[series.name]
+			except KeyError:
+				return False
+			if len(series) < count or series.times[count-1] != lastTime:
+				return False
+		for series in last.sortedSeries():
+			if not len(series):
+				continue
+			joined=self.store[series.name]
+			(count, lastTime)=self.taken[series.name]
+			for i in range(count, len(series)):
+				joined.append(series.times[i], series.values[i])
+		return True
+
+	# Joins the series of every segment from scratch.
+	def rebuild(self, stores):
+		self.store=SeriesStore()
+		names=set()
+		for store in stores:
+			names.update(store.names())
+		for name in names:
+			parts=[]
+			cutoff=float('inf')
+			for store in reversed(stores):
+				if name not in store or not len(store[name]):
+					continue
+				series=store[name]
+				parts.append((series, bisect_left(series.times, cutoff)))
+				cutoff=min(cutoff, series.getMinTime())
+			joined=Series(name)
+			for (series, end) in reversed(parts):
+				joined.times.extend(series.times[:end])
+				joined.values.extend(series.values[:end])
+			joined.dirty=True
+			self.store.add(joined)
+
+## Keeps every nth point, where n is the smallest power of two that brings the
+#  series down to the requested number of points.
+def stride(times, values, points):
+	step=1
+	while (len(times)+step-1)//step > points:
+		step*=2
+	return (times[::step], values[::step])
+
+## Largest Triangle Three Buckets downsampling.  The first and last points
+#  are kept, the rest are split into buckets and the point from each bucket
+#  forming the largest triangle with the previously chosen point and the
+#  average of the next bucket is kept.  This keeps the visual shape of the
+#  series.
+def lttb(times, values, points):
+	n=len(times)
+	if points >= n:
+		return (times, values)
+	if points < 3:
+		return stride(times, values, points)
+	outTimes=array('d', [times[0]])
+	outValues=array('d', [values[0]])
+	every=float(n-2)/(points-2)
+	a=0
+	for i in range(points-2):
+		avgStart=int((i+1)*every)+1
+		avgEnd=min(int((i+2)*every)+1, n)
+		avgTime=sum(times[avgStart:avgEnd])/(avgEnd-avgStart)
+		avgValue=sum(values[avgStart:avgEnd])/(avgEnd-avgStart)
+		ax=times[a]
+		ay=values[a]
+		maxArea=-1.0
+		chosen=int(i*every)+1
+		for j in range(int(i*every)+1, int((i+1)*every)+1):
+			area=abs((ax-avgTime)*(values[j]-ay)-(ax-times[j])*(avgValue-ay))
+			if area > maxArea:
+				maxArea=area
+				chosen=j
+		outTimes.append(times[chosen])
+		outValues.append(values[chosen])
+		a=chosen
+	outTimes.append(times[-1])
+	outValues.append(values[-1])
+	return (outTimes, outValues)
+
+## Splits the series into points/2 buckets and keeps the smallest and largest
+#  value from each, in the order they occurred.  Unlike the other methods no
+#  spike is ever dropped.
+def minMax(times, values, points):
+	n=len(times)
+	if points >= n:
+		return (times, values)
+	buckets=max(points//2, 1)
+	every=float(n)/buckets
+	outTimes=array('d')
+	outValues=array('d')
+	for i in range(buckets):
+		start=int(i*every)
+		end=int((i+1)*every)
+		bucket=values[start:end]
+		low=start+bucket.index(min(bucket))
+		high=start+bucket.index(max(bucket))
+		for j in sorted(set([low, high])):
+			outTimes.append(times[j])
+			outValues.append(values[j])
+	return (outTimes, outValues)
+
+## Downsampling methods that can be requested by name.
+DOWNSAMPLERS={
+		'stride':stride,
+		'lttb':lttb,
+		'minmax':minMax,
+		}
+
+## Reduces the series to at most the requested number of points using the named
+#  method.  Raises ValueError for an unknown method.
+def downsample(times, values, points, method):
+	try:
+		downsampler=DOWNSAMPLERS[method]
+	except KeyError:
+		raise ValueError("Unknown downsampling method: %s" % method)
+	if len(times) <= points:
+		return (times, values)
+	return downsampler(times, values, points)
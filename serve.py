@@ -0,0 +1,146 @@
+#  Copyright 2011 David Irvine
+#
+#  This file is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This file is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with This file.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  Sends files from the case directories, with validators for conditional
+#  requests and support for a single byte range, so a browser can seek in a
+#  movie without downloading it again from the start.  The transfer itself can
+#  be handed to the front end web server by setting PERCYVAL_SENDFILE:
+#
+#    'X-Sendfile'        Apache mod_xsendfile or lighttpd, given the file path.
+#    'X-Accel-Redirect'  nginx, given PERCYVAL_SENDFILE_URL followed by the
+#                        path of the file below PERCYVAL_SENDFILE_ROOT, which
+#                        defaults to MEDIA_ROOT.  Files outside that root, such
+#                        as thumbnails kept elsewhere, are sent by django.
+import os
+import re
+import mimetypes
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_http_date_safe, parse_etags, quote_etag
+
+## Bytes read from the file at a time while it is sent.
+BLOCK_SIZE=64*1024
+
+RANGE_RE=re.compile(r"^bytes=(\d*)-(\d*)$")
+
+## Returns the ETag for a file, made from its inode, size and mtime.
+def fileETag(st):
+	return quote_etag("%x-%x-%x" % (st.st_ino, st.st_size, int(st.st_mtime*1000000)))
+
+## Returns True if a request with the given validators can be answered with 304 Not Modified.
+def notModified(request, etag, mtime):
+	ifNoneMatch=request.META.get('HTTP_IF_NONE_MATCH')
+	if ifNoneMatch is not None:
+		etags=parse_etags(ifNoneMatch)
+		return '*' in etags or etag.strip('"') in etags
+	since=parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+	return since is not None and int(mtime) <= since
+
+## Returns the (first, last) bytes of the file to send for the Range header of the request,
+#  None to send the whole file, or False if the range cannot be satisfied.  Only a single
+#  range is supported, requests for several ranges are sent the whole file.  If-Range is
+#  honoured, a range is only sent if the file still has the given validator.
+def requestedRange(request, size, etag, mtime):
+	match=RANGE_RE.match(request.META.get('HTTP_RANGE', '').strip())
+	if not match:
+		return None
+	ifRange=request.META.get('HTTP_IF_RANGE')
+	if ifRange is not None and ifRange != etag:
+		if parse_http_date_safe(ifRange) != int(mtime):
+			return None
+	(first, last)=match.groups()
+	if not first:
+		if not last:
+			return None
+		# The last n bytes.
+		first=max(size-int(last), 0)
+		last=size-1
+	else:
+		first=int(first)
+		if last:
+			last=min(int(last), size-1)
+		else:
+			last=size-1
+	if first > last or first >= size:
+		return False
+	return (first, last)
+
+## Returns the bytes of the file f from first to last inclusive, a block at a time.
+def readRange(f, first, last):
+	try:
+		f.seek(first)
+		remaining=last-first+1
+		while remaining > 0:
+			block=f.read(min(BLOCK_SIZE, remaining))
+			if not block:
+				break
+			remaining-=len(block)
+			yield block
+	finally:
+		f.close()
+
+# Returns the value of the header that hands the transfer of the file at path to the front
+# end web server, or None if it cannot be handed over because the file is not below the root
+# the front end serves.
+def _sendfileHeader(mode, path):
+	if mode != 'X-Accel-Redirect':
+		return path
+	root=os.path.realpath(getattr(settings, 'PERCYVAL_SENDFILE_ROOT', settings.MEDIA_ROOT))
+	relative=os.path.relpath(os.path.realpath(path), root)
+	if relative == os.pardir or relative.startswith(os.pardir+os.sep):
+		return None
+	return getattr(settings, 'PERCYVAL_SENDFILE_URL', '/protected/').rstrip("/")+"/"+relative
+
+## Returns a response that sends the file at path.  Conditional requests are answered from
+#  the ETag and Last-Modified of the file, and a single byte range is sent as 206 Partial
+#  Content.  cacheControl, if given, is sent as the Cache-Control header.
+def serveFile(request, path, contentType=None, cacheControl=None):
+	st=os.stat(path)
+	etag=fileETag(st)
+	if contentType is None:
+		contentType=mimetypes.guess_type(path)[0] or 'application/octet-stream'
+	if notModified(request, etag, st.st_mtime):
+		response=HttpResponseNotModified()
+	else:
+		mode=getattr(settings, 'PERCYVAL_SENDFILE', None)
+		header=None
+		if mode:
+			header=_sendfileHeader(mode, path)
+		if header is not None:
+			# The front end web server handles ranges itself.
+			response=HttpResponse(content_type=contentType)
+			response[mode]=header
+		else:
+			byteRange=requestedRange(request, st.st_size, etag, st.st_mtime)
+			if byteRange is False:
+				response=HttpResponse(status=416, content_type=contentType)
+				response['Content-Range']="bytes */%d" % st.st_size
+				return response
+			if byteRange is None:
+				byteRange=(0, st.st_size-1)
+				status=200
+			else:
+				status=206
+			(first, last)=byteRange
+			response=HttpResponse(readRange(open(path, 'rb'), first, last), status=status, content_type=contentType)
+			response['Content-Length']=max(last-first+1, 0)
+			if status == 206:
+				response['Content-Range']="bytes %d-%d/%d" % (first, last, st.st_size)
+		response['Accept-Ranges']='bytes'
+	response['ETag']=etag
+	response['Last-Modified']=http_date(st.st_mtime)
+	if cacheControl is not None:
+		response['Cache-Control']=cacheControl
+	return response
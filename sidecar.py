@@ -0,0 +1,246 @@
+#  Copyright 2011 David Irvine
+#
+#  This file is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This file is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with This file.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  Sidecar files hold everything a FOAMLogParser has read from a log, so the
+#  log does not have to be parsed again after the cache is cleared or the
+#  server restarts.  The file starts with a fixed header:
+#
+#    magic          8 bytes  "PERCYVAL"
+#    format         uint32   FORMAT_VERSION
+#    parser         uint32   FOAMLogParser.VERSION
+#    source size    uint64   bytes of the log that had been parsed
+#    source mtime   float64
+#    source inode   uint64
+#    meta length    uint64
+#
+#  followed by a JSON object with the parser state and a table of columns,
+#  padded to a multiple of 8 bytes, then the columns themselves as
+#  little-endian float64.  Readers memory map the file and use the columns in
+#  place without copying them.
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import base64
+import hashlib
+import logging
+from array import array
+from percyval.foamlog import FOAMLogParser
+from percyval.series import Series, Level
+
+log = logging.getLogger(__name__)
+
+MAGIC="PERCYVAL"
+FORMAT_VERSION=1
+HEADER=struct.Struct("<8sIIQdQQ")
+COLUMN=struct.Struct("<d")
+## Names of the columns held for each pyramid level.
+LEVEL_COLUMNS=['times', 'mins', 'maxs', 'means']
+## Parser state that is held as bytes, and so is base64 encoded in the JSON.
+BINARY_STATE=['head', 'partial']
+
+## A read only column of doubles in a memory mapped sidecar file.  Supports the
+#  parts of the array interface used to read a Series, slices are returned as
+#  arrays.
+class MappedColumn(object):
+	itemsize=8
+
+	def __init__(self, mm, offset, count):
+		self.mm=mm
+		self.offset=offset
+		self.count=count
+
+	def __len__(self):
+		return self.count
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			(start, stop, step)=index.indices(self.count)
+			if stop <= start:
+				return array('d')
+			column=array('d')
+			column.fromstring(self.mm[self.offset+start*8:self.offset+stop*8])
+			if sys.byteorder == 'big':
+				column.byteswap()
+			if step != 1:
+				column=column[::step]
+			return column
+		if index < 0:
+			index+=self.count
+		if index < 0 or index >= self.count:
+			raise IndexError("MappedColumn index out of range")
+		return COLUMN.unpack_from(self.mm, self.offset+index*8)[0]
+
+	def __iter__(self):
+		return iter(self[:])
+
+	## Returns a copy of the column as an array.
+	def toArray(self):
+		return self[:]
+
+	## Returns the column as little-endian bytes.
+	def tostring(self):
+		return self.mm[self.offset:self.offset+self.count*8]
+
+## Returns the path of the sidecar file for the log at logPath.  The file is kept
+#  next to the log unless a directory is given.
+def sidecarPath(logPath, directory=None):
+	if directory:
+		return os.path.join(directory, hashlib.sha1(logPath).hexdigest()+".pcv")
+	(head, tail)=os.path.split(logPath)
+	return os.path.join(head, "."+tail+".pcv")
+
+# Returns the bytes of a column in little-endian order.
+def _columnBytes(column):
+	if isinstance(column, MappedColumn) or sys.byteorder == 'little':
+		return column.tostring()
+	column=array('d', column)
+	column.byteswap()
+	return column.tostring()
+
+## Writes everything the parser has read to a sidecar file at path.  The file is
+#  written next to its final name and renamed into place, so readers never see a
+#  partly written file.
+def save(parser, path):
+	st=os.stat(parser.path)
+	state=parser.getState()
+	for name in BINARY_STATE:
+		state[name]=base64.b64encode(state[name])
+	columns=[]
+	position=[0]
+	# Adds a column to the file, returning its [offset, count] from the start of the data.
+	def add(column):
+		offset=position[0]
+		columns.append(column)
+		position[0]+=len(column)*8
+		return [offset, len(column)]
+	series=[]
+	for (storeName, store) in parser.stores().items():
+		for s in store.sortedSeries():
+			entry={
+					'store':storeName,
+					'name':s.name,
+					'ordered':s.ordered,
+					'dirty':s.dirty,
+					'times':add(s.times),
+					'values':add(s.values),
+					'levels':[],
+					}
+			for level in s.pyramid.levels:
+				levelEntry={'complete':level.complete}
+				for name in LEVEL_COLUMNS:
+					levelEntry[name]=add(getattr(level, name))
+				entry['levels'].append(levelEntry)
+			series.append(entry)
+	meta=json.dumps({'state':state, 'series':series})
+	header=HEADER.pack(MAGIC, FORMAT_VERSION, parser.VERSION, parser.offset, st.st_mtime, st.st_ino, len(meta))
+	padding=(-(len(header)+len(meta))) % 8
+	tmpPath="%s.%d.tmp" % (path, os.getpid())
+	f=open(tmpPath, 'wb')
+	try:
+		f.write(header)
+		f.write(meta)
+		f.write("\0"*padding)
+		for column in columns:
+			f.write(_columnBytes(column))
+	finally:
+		f.close()
+	os.rename(tmpPath, path)
+	parser.sidecarSaved=time.time()
+
+## Writes a sidecar file for the parser unless one was written less than interval seconds
+#  ago.  Failures are logged rather than raised, as the sidecar is only an optimisation.
+def saveIfDue(parser, path, interval):
+	if time.time()-getattr(parser, 'sidecarSaved', 0) < interval:
+		return False
+	try:
+		save(parser, path)
+	except (IOError, OSError), e:
+		log.warning("sidecar: could not write %s: %s" % (path, e))
+		return False
+	return True
+
+## Returns a parser restored from the sidecar file at path for the log at logPath, with its
+#  series mapped from the file.  Returns None if there is no usable sidecar, for example
+#  because it was written by another parser version or the log has been replaced.
+def load(logPath, path):
+	try:
+		f=open(path, 'rb')
+	except IOError:
+		return None
+	try:
+		try:
+			mm=mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		except (ValueError, EnvironmentError):
+			return None
+	finally:
+		f.close()
+	try:
+		(magic, format, version, size, mtime, inode, metaLength)=HEADER.unpack_from(mm, 0)
+	except struct.error:
+		return None
+	if magic != MAGIC or format != FORMAT_VERSION or version != FOAMLogParser.VERSION:
+		return None
+	try:
+		st=os.stat(logPath)
+	except OSError:
+		return None
+	if st.st_ino != inode or st.st_size < size:
+		return None
+	if st.st_size == size and st.st_mtime != mtime:
+		return None
+	try:
+		metaEnd=HEADER.size+metaLength
+		meta=json.loads(mm[HEADER.size:metaEnd])
+		dataStart=metaEnd+(-metaEnd) % 8
+		state=meta['state']
+		for name in BINARY_STATE:
+			state[name]=base64.b64decode(state[name])
+		parser=FOAMLogParser(logPath)
+		parser.setState(state)
+		stores=parser.stores()
+		for entry in meta['series']:
+			series=Series(entry['name'].encode('utf-8'))
+			series.ordered=entry['ordered']
+			series.dirty=entry['dirty']
+			series.times=MappedColumn(mm, dataStart+entry['times'][0], entry['times'][1])
+			series.values=MappedColumn(mm, dataStart+entry['values'][0], entry['values'][1])
+			for levelEntry in entry['levels']:
+				level=Level()
+				level.complete=levelEntry['complete']
+				for name in LEVEL_COLUMNS:
+					setattr(level, name, MappedColumn(mm, dataStart+levelEntry[name][0], levelEntry[name][1]))
+				series.pyramid.levels.append(level)
+			stores[entry['store']].add(series)
+	except (ValueError, KeyError, TypeError), e:
+		log.warning("sidecar: ignoring %s: %s" % (path, e))
+		return None
+	if dataStart+sum([c.count for c in _columns(stores)])*8 > len(mm):
+		log.warning("sidecar: ignoring truncated %s" % path)
+		return None
+	parser.sidecarSaved=time.time()
+	return parser
+
+# Returns every mapped column held by the stores.
+def _columns(stores):
+	for store in stores.values():
+		for series in store.sortedSeries():
+			yield series.times
+			yield series.values
+			for level in series.pyramid.levels:
+				for name in LEVEL_COLUMNS:
+					yield getattr(level, name)
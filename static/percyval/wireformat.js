@@ -0,0 +1,14 @@
+// Decoding of the series sent by the plot data views, see wireformat.py.
+
+// Turns series sent in the columns format, a list of {key, x, y}, into the points the
+// charts draw, a list of {key, values} with a {x, y} for each point.
+function fromColumns(series)
+{
+	return $.map(series, function(c) {
+		var values=new Array(c.x.length);
+		for (var i=0; i<c.x.length; i++){
+			values[i]={'x':c.x[i], 'y':c.y[i]};
+		}
+		return {'key':c.key, 'values':values};
+	});
+}
@@ -14,3 +14,1195 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+import os
+import pickle
+from array import array
+import shutil
+import tempfile
+import multiprocessing
+import gzip
+import datetime
+import json
+from django.db import connection
+from django.core.urlresolvers import reverse
+from percyval.foamlog import FOAMLogParser
+from percyval import sidecar
+from percyval import logcache
+from percyval.fsindex import CaseIndex
+from percyval import thumbnails
+from django.test.client import RequestFactory
+from percyval.serve import serveFile
+from percyval import metrics
+from percyval import wireformat
+from percyval import overlay
+from percyval import watch
+from percyval import options
+import time
+import struct
+from StringIO import StringIO
+from django.conf import settings
+import unittest
+import subprocess
+import sys
+from django.contrib.auth.models import User
+from django.test.utils import override_settings
+from percyval.models import Case, CaseFeature
+from percyval.series import Series, SeriesStore, SeriesChain, DOWNSAMPLERS, downsample, refreshStores
+
+LOG_STEP="""Time = %(time)s
+
+Courant Number mean: 0.01 max: 0.2
+DILUPBiCG:  Solving for Ux, Initial residual = %(res)s, Final residual = 1e-06, No Iterations 2
+DILUPBiCG:  Solving for Uy, Initial residual = %(res)s, Final residual = 1e-06, No Iterations 2
+GAMG:  Solving for p, Initial residual = %(res)s, Final residual = 1e-07, No Iterations 8
+time step continuity errors : sum local = 1e-08, global = 1e-19, cumulative = 1e-18
+ExecutionTime = %(time)s s  ClockTime = %(time)s s
+
+forceCoeffs output:
+    Cm    = 0.1
+    Cd    = %(res)s
+    Cl    = 0.3
+
+"""
+
+
+def logSteps(start, end):
+    return "".join([LOG_STEP % {'time': t, 'res': 1.0 / t} for t in range(start, end)])
+
+
+class FOAMLogParserTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "log.pisoFoam")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, data, mode='w'):
+        f = open(self.path, mode)
+        f.write(data)
+        f.close()
+
+    def test_incremental_update(self):
+        """
+        Appended data is parsed, including a line split across updates.
+        """
+        data = logSteps(1, 4)
+        self.write(data[:-40])
+        parser = FOAMLogParser(self.path)
+        self.assertTrue(parser.update())
+        self.write(data[-40:] + logSteps(4, 6), 'a')
+        self.assertTrue(parser.update())
+        self.assertFalse(parser.update())
+        self.assertEqual(list(parser.residuals['Ux'].times), [1, 2, 3, 4, 5])
+        self.assertEqual(list(parser.forces['Cd'].times), [1, 2, 3, 4, 5])
+        self.assertEqual(parser.completeTime, 4)
+
+    def test_metrics(self):
+        """
+        Every metric is read in the same pass, whichever solver wrote it.
+        """
+        self.write(logSteps(1, 3) + "PIMPLE: iteration 1\nPIMPLE: iteration 2\n" + logSteps(3, 4))
+        parser = FOAMLogParser(self.path)
+        parser.update()
+        self.assertEqual(parser.residuals.names(), ['Ux', 'Uy', 'p'])
+        self.assertEqual(list(parser.residuals['p'].values)[:2], [1.0, 0.5])
+        self.assertEqual(list(parser.courant['max'].values), [0.2, 0.2, 0.2])
+        self.assertEqual(parser.continuity.names(), ['cumulative', 'global', 'sum local'])
+        self.assertEqual(list(parser.executionTime['ClockTime'].values), [1, 2, 3])
+        self.assertEqual(list(parser.pimple['Outer iterations'].times), [2])
+        self.assertEqual(list(parser.pimple['Outer iterations'].values), [2])
+
+    def test_parallel(self):
+        """
+        A log parsed in chunks across processes gives the same result as one parsed in order.
+        """
+        self.write("".join(["PIMPLE: iteration 1\nPIMPLE: iteration 2\n" + logSteps(t, t + 1) for t in range(1, 300)]) + "Time = 3")
+        parser = FOAMLogParser(self.path)
+        parser.update()
+        parallel = FOAMLogParser(self.path)
+        parallel.PARALLEL_CHUNK_SIZE = 4096
+        parallel.PARALLEL_MIN_SIZE = 0
+        pool = multiprocessing.Pool(2)
+        try:
+            parallel.update(pool)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(parallel.getState(), parser.getState())
+        for name in FOAMLogParser.STORES:
+            expected = getattr(parser, name)
+            store = getattr(parallel, name)
+            self.assertEqual(store.names(), expected.names())
+            for series in store.sortedSeries():
+                self.assertEqual(series.times, expected[series.name].times)
+                self.assertEqual(series.values, expected[series.name].values)
+                self.assertEqual(series.pyramid.levels[-1].means, expected[series.name].pyramid.levels[-1].means)
+                self.assertFalse(series.dirty)
+
+    def test_replaced_file(self):
+        """
+        A log that shrinks is parsed again from the start.
+        """
+        self.write(logSteps(1, 10))
+        parser = FOAMLogParser(self.path)
+        parser.update()
+        self.write(logSteps(20, 22))
+        self.assertTrue(parser.update())
+        self.assertEqual(list(parser.residuals['Ux'].times), [20, 21])
+
+
+class SeriesTest(TestCase):
+    def test_window(self):
+        """
+        Windows are inclusive at both ends and do not change the series.
+        """
+        series = Series('p')
+        for t in [3, 1, 2, 5, 4]:
+            series.append(t, t * 10)
+        series.sort()
+        (times, values) = series.window(2, 4)
+        self.assertEqual(list(times), [2, 3, 4])
+        self.assertEqual(list(values), [20, 30, 40])
+        self.assertEqual(len(series), 5)
+        (times, values) = series.query(2, 4, 10, 'lttb', after=True)
+        self.assertEqual(list(times), [3, 4])
+
+    def test_pyramid(self):
+        """
+        Pyramid levels built while points arrive match levels built from scratch.
+        """
+        series = Series('p')
+        for i in range(1000):
+            series.append(i, (i * 7919) % 113)
+            if i % 97 == 0:
+                series.refresh()
+        series.refresh()
+        for (k, level) in enumerate(series.pyramid.levels):
+            size = 2 ** (k + 1)
+            for j in range(len(level)):
+                bucket = series.values[j * size:(j + 1) * size]
+                self.assertEqual(level.times[j], j * size)
+                self.assertEqual(level.mins[j], min(bucket))
+                self.assertEqual(level.maxs[j], max(bucket))
+                self.assertAlmostEqual(level.means[j], sum(bucket) / len(bucket))
+
+    def test_query_uses_pyramid(self):
+        series = Series('p')
+        for i in range(10000):
+            series.append(i, i % 10)
+        series.refresh()
+        (times, values) = series.query(0, 10000, 100, 'minmax')
+        self.assertTrue(len(times) <= 100)
+        self.assertEqual(min(values), 0)
+        self.assertEqual(max(values), 9)
+
+    def test_refresh_stores(self):
+        """
+        Series refreshed in a pool match series refreshed in place, sorted ones included.
+        """
+        stores = [SeriesStore(), SeriesStore()]
+        for i in range(200):
+            stores[0].append('a', i, i % 7)
+            stores[1].append('b', (i * 37) % 200, i)
+        pool = multiprocessing.Pool(2)
+        try:
+            refreshStores(stores, pool)
+        finally:
+            pool.close()
+            pool.join()
+        for (store, name) in zip(stores, ['a', 'b']):
+            series = store[name]
+            expected = pickle.loads(pickle.dumps(series, 2))
+            expected.ordered = False
+            expected.dirty = True
+            expected.refresh()
+            self.assertFalse(series.dirty)
+            self.assertEqual(series.times, expected.times)
+            self.assertEqual(series.pyramid.levels[0].means, expected.pyramid.levels[0].means)
+
+    def test_pickle(self):
+        series = Series('p')
+        series.append(1, 2)
+        copy = pickle.loads(pickle.dumps(series, 2))
+        self.assertEqual(list(copy.times), [1])
+        self.assertEqual(list(copy.values), [2])
+
+
+class DownsampleTest(TestCase):
+    def setUp(self):
+        self.times = array('d', range(1000))
+        self.values = array('d', [0.0] * 1000)
+        self.values[501] = 100.0
+
+    def test_point_count(self):
+        for method in DOWNSAMPLERS:
+            (times, values) = downsample(self.times, self.values, 100, method)
+            self.assertTrue(len(times) <= 100, method)
+            self.assertEqual(len(times), len(values))
+
+    def test_spikes_kept(self):
+        for method in ['lttb', 'minmax']:
+            (times, values) = downsample(self.times, self.values, 100, method)
+            self.assertTrue(501 in times, method)
+
+    def test_unknown_method(self):
+        self.assertRaises(ValueError, downsample, self.times, self.values, 10, 'nope')
+
+
+class SidecarTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "log.pisoFoam")
+        self.sidecarPath = sidecar.sidecarPath(self.path)
+        f = open(self.path, 'w')
+        f.write(logSteps(1, 300))
+        f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        """
+        A parser loaded from a sidecar reads the same data and carries on parsing.
+        """
+        parser = FOAMLogParser(self.path)
+        parser.update()
+        sidecar.save(parser, self.sidecarPath)
+        loaded = sidecar.load(self.path, self.sidecarPath)
+        self.assertEqual(loaded.offset, parser.offset)
+        self.assertEqual(list(loaded.residuals['Ux'].times), list(parser.residuals['Ux'].times))
+        self.assertEqual(loaded.residuals['Ux'].query(0, 300, 10, 'minmax'),
+                         parser.residuals['Ux'].query(0, 300, 10, 'minmax'))
+        f = open(self.path, 'a')
+        f.write(logSteps(300, 302))
+        f.close()
+        self.assertTrue(loaded.update())
+        self.assertEqual(loaded.residuals['Ux'].getMaxTime(), 301)
+        self.assertEqual(len(loaded.residuals['Ux']), 301)
+
+    def test_replaced_log(self):
+        parser = FOAMLogParser(self.path)
+        parser.update()
+        sidecar.save(parser, self.sidecarPath)
+        os.remove(self.path)
+        f = open(self.path, 'w')
+        f.write(logSteps(1, 3))
+        f.close()
+        self.assertEqual(sidecar.load(self.path, self.sidecarPath), None)
+
+
+class SeriesChainTest(TestCase):
+    def store(self, times):
+        store = SeriesStore()
+        for t in times:
+            store.append('p', t, t)
+        store.refresh()
+        return store
+
+    def test_restart(self):
+        """
+        Times written again after a restart replace those from the earlier segment.
+        """
+        first = self.store(range(0, 10))
+        live = self.store(range(6, 8))
+        chain = SeriesChain()
+        self.assertEqual(list(chain.update([first, live])['p'].times), range(0, 8))
+        live.append('p', 8, 8)
+        live.refresh()
+        self.assertEqual(list(chain.update([first, live])['p'].times), range(0, 9))
+        restarted = self.store([3, 4])
+        self.assertEqual(list(chain.update([first, live, restarted])['p'].times), range(0, 5))
+
+
+class LogCacheTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.oldCache = logcache.logCache
+        logcache.logCache = logcache.LogCache(1024 * 1024)
+
+    def tearDown(self):
+        logcache.logCache = self.oldCache
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data, mode='w'):
+        path = os.path.join(self.dir, name)
+        f = open(path, mode)
+        f.write(data)
+        f.close()
+        return path
+
+    def test_shared_parser(self):
+        """
+        Readers of an unchanged log share one parser, which is updated when the log grows.
+        """
+        path = self.write("log.a", logSteps(1, 10))
+        parser = logcache.updateLog(path)
+        self.assertTrue(logcache.updateLog(path) is parser)
+        self.write("log.a", logSteps(10, 12), 'a')
+        self.assertTrue(logcache.updateLog(path) is parser)
+        self.assertEqual(parser.residuals['Ux'].getMaxTime(), 11)
+
+    def test_publish_once(self):
+        """
+        A parser is stored in the django cache when it is created, not every time the log grows.
+        """
+        path = self.write("log.a", logSteps(1, 10))
+        stored = []
+        set = logcache.cache.set
+        logcache.cache.set = lambda key, value, timeout=None: stored.append(key)
+        try:
+            logcache.updateLog(path)
+            self.write("log.a", logSteps(10, 12), 'a')
+            logcache.updateLog(path)
+        finally:
+            logcache.cache.set = set
+        self.assertEqual(stored, [logcache.logCacheKey(path)])
+
+    def test_publish_interval(self):
+        """
+        A growing log is stored again once the interval has passed, unless sidecars are used.
+        """
+        path = self.write("log.a", logSteps(1, 10))
+        stored = []
+        set = logcache.cache.set
+        logcache.cache.set = lambda key, value, timeout=None: stored.append(key)
+        try:
+            parser = logcache.updateLog(path)
+            parser.cachePublished -= 3600
+            self.write("log.a", logSteps(10, 12), 'a')
+            logcache.updateLog(path)
+            self.assertEqual(len(stored), 2)
+            with override_settings(PERCYVAL_SIDECAR=self.dir):
+                logcache.logCache.clear()
+                logcache.updateLog(self.write("log.b", logSteps(1, 10)))
+        finally:
+            logcache.cache.set = set
+        self.assertEqual(len(stored), 2)
+
+    def test_segments(self):
+        """
+        Compressed segments are read once and joined to the live segment.
+        """
+        f = gzip.open(os.path.join(self.dir, "log.a.1.gz"), 'wb')
+        f.write(logSteps(1, 10))
+        f.close()
+        os.utime(os.path.join(self.dir, "log.a.1.gz"), (0, 0))
+        live = self.write("log.a", logSteps(5, 7))
+        paths = [os.path.join(self.dir, "log.a.1.gz"), live]
+        chain = logcache.getLogChain(paths).parser
+        self.assertEqual(list(chain.stores()['residuals']['Ux'].times), range(1, 7))
+        self.assertEqual(chain.completeTime, 5)
+        segment = logcache.getLogEntry(paths[0]).parser
+        self.write("log.a", logSteps(7, 8), 'a')
+        logcache.getLogChain(paths)
+        self.assertTrue(logcache.getLogEntry(paths[0]).parser is segment)
+        self.assertEqual(list(chain.stores()['residuals']['Ux'].times), range(1, 8))
+
+    def test_eviction(self):
+        """
+        The least recently used logs are dropped once the cache is over its limit.
+        """
+        a = self.write("log.a", logSteps(1, 100))
+        b = self.write("log.b", logSteps(1, 100))
+        logcache.updateLog(a)
+        size = logcache.logCache.nbytes
+        logcache.logCache.maxBytes = size + size // 2
+        logcache.updateLog(b)
+        self.assertEqual(logcache.logCache.entries.keys(), [b])
+        self.assertEqual(logcache.logCache.nbytes, size)
+
+
+class FakePool(object):
+    def __init__(self):
+        self.calls = []
+
+    def apply_async(self, func, args, callback=None):
+        self.calls.append((args, callback))
+
+
+class LogIngesterTest(TestCase):
+    def setUp(self):
+        from percyval.management.commands import ingestlogs
+        self.dir = tempfile.mkdtemp()
+        self.settings = override_settings(PERCYVAL_SIDECAR=self.dir)
+        self.settings.enable()
+        self.oldCache = logcache.logCache
+        logcache.logCache = logcache.LogCache(1024 * 1024)
+        self.path = os.path.join(self.dir, "log")
+        self.write(logSteps(1, 10), 'w')
+        self.pool = FakePool()
+        self.ingester = ingestlogs.LogIngester(self.pool, 0)
+        self.ingester.logs[self.path] = None
+        self.ingester.ingested.add(self.path)
+
+    def tearDown(self):
+        logcache.logCache = self.oldCache
+        self.settings.disable()
+        shutil.rmtree(self.dir)
+
+    def write(self, data, mode='a'):
+        f = open(self.path, mode)
+        f.write(data)
+        f.close()
+
+    def test_queue_changes(self):
+        """
+        A log that changes while it is parsed is queued again once it is done, never sent to two workers at once.
+        """
+        self.ingester.poll()
+        self.assertEqual(len(self.pool.calls), 1)
+        self.write(logSteps(10, 12))
+        self.ingester.poll()
+        self.ingester.schedule(self.path)
+        self.assertEqual(len(self.pool.calls), 1)
+        self.pool.calls[0][1](None)
+        self.assertEqual(len(self.pool.calls), 2)
+        self.pool.calls[1][1](None)
+        self.assertEqual(len(self.pool.calls), 2)
+
+    def test_interval(self):
+        """
+        A log is not parsed again until the interval has passed since it was last parsed.
+        """
+        self.ingester.interval = 3600
+        self.ingester.schedule(self.path)
+        self.pool.calls[0][1](None)
+        self.ingester.schedule(self.path)
+        self.ingester.scheduleWaiting()
+        self.assertEqual(len(self.pool.calls), 1)
+        self.ingester.due[self.path] = 0
+        self.ingester.scheduleWaiting()
+        self.assertEqual(len(self.pool.calls), 2)
+
+    def test_sidecar(self):
+        """
+        Views read the parsed log from the sidecar written by the ingester, and again once it is rewritten.
+        """
+        self.assertTrue(logcache.ingestLog(self.path))
+        self.assertFalse(logcache.ingestLog(self.path))
+        parser = logcache.updateLog(self.path, parse=False)
+        self.assertEqual(parser.residuals['Ux'].getMaxTime(), 9)
+        self.write(logSteps(10, 12))
+        self.assertTrue(logcache.updateLog(self.path, parse=False) is parser)
+        self.assertTrue(logcache.ingestLog(self.path))
+        self.assertEqual(logcache.updateLog(self.path, parse=False).residuals['Ux'].getMaxTime(), 11)
+
+
+class PlotRangeTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir, "case1"))
+        f = open(os.path.join(self.dir, "case1", "log.pisoFoam"), 'w')
+        f.write(logSteps(1, 200))
+        f.close()
+        case = Case.objects.create(name="case1", owner=User.objects.create(username="test"))
+        case.options.create(name="caseDir", value="case1")
+        self.feature = case.features.create(name="FOAMForces")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_range(self):
+        """
+        Ranges are read without changing the shared series, so a wider range can follow.
+        """
+        with override_settings(MEDIA_ROOT=self.dir):
+            names = [name for (name, times, values) in self.feature.getRange(10, 20)]
+            self.assertEqual(names, ['Cd', 'Cl', 'Cm'])
+            (name, times, values) = self.feature.getRange(10, 20, after=True)[0]
+            self.assertEqual(list(times), range(11, 21))
+            self.assertEqual(list(self.feature.getRange(0, 1000)[0][1]), range(1, 200))
+            self.assertEqual(self.feature.getMaxTime(), 199)
+            series = self.feature.getSeries(10, 20)
+            self.assertEqual([point['x'] for point in series[0]['values']], range(10, 21))
+
+    def test_vanished_segment(self):
+        """
+        A segment removed between listing the log files and reading their times is left out.
+        """
+        import glob
+        live = os.path.join(self.dir, "case1", "log.pisoFoam")
+        self.feature.options.create(name="logFile", value="log.pisoFoam*")
+        oldGlob = glob.glob
+        glob.glob = lambda pattern: [live + ".1.gz", live]
+        try:
+            with override_settings(MEDIA_ROOT=self.dir):
+                self.assertEqual(self.feature.logFilePaths(), [live])
+        finally:
+            glob.glob = oldGlob
+
+
+class CaseListTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.owner = User.objects.create(username="test")
+        os.mkdir(os.path.join(self.dir, "case1"))
+        f = open(os.path.join(self.dir, "case1", "log.pisoFoam"), 'w')
+        f.write(logSteps(1, 20))
+        f.close()
+        os.utime(os.path.join(self.dir, "case1", "log.pisoFoam"), (1000000000, 1000000000))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def addCase(self, name):
+        case = Case.objects.create(name=name, owner=self.owner)
+        case.options.create(name="caseDir", value="case1")
+        case.features.create(name="FOAMResiduals")
+        case.features.create(name="FOAMForces")
+        return case
+
+    def test_refresh(self):
+        """
+        The last update time and summary are stored with the case and its features.
+        """
+        with override_settings(MEDIA_ROOT=self.dir):
+            case = self.addCase("case1")
+            case.refreshSummary()
+        case = Case.objects.get(pk=case.pk)
+        self.assertEqual(case.lastUpdated, datetime.datetime.fromtimestamp(1000000000))
+        forces = case.features.get(name="FOAMForces")
+        self.assertEqual(forces.summary, "3 series to time 19")
+
+    def test_constant_queries(self):
+        """
+        The case list costs the same number of queries however many cases there are.
+        """
+        url = reverse('percyval.views.caseList')
+        self.addCase("case1")
+        response = self.client.get(url)
+        self.assertContains(response, "Unknown")
+        with override_settings(DEBUG=True):
+            connection.queries = []
+            self.client.get(url)
+            queries = len(connection.queries)
+            self.assertTrue(queries > 0)
+            for i in range(5):
+                self.addCase("case%d" % i)
+            connection.queries = []
+            response = self.client.get(url)
+            self.assertEqual(len(connection.queries), queries)
+        self.assertContains(response, "Forces", count=6)
+
+
+class OptionMapTest(TestCase):
+    def setUp(self):
+        self.case = Case.objects.create(name="case1", owner=User.objects.create(username="test"))
+        self.case.options.create(name="caseDir", value="case1")
+        self.feature = self.case.features.create(name="FOAMForces")
+        self.feature.options.create(name="logFile", value="log.simpleFoam")
+        self.feature.options.create(name="logFile", value="log.pisoFoam")
+
+    def test_single_query(self):
+        """
+        Options are read once for each case and feature, and again after any option changes.
+        """
+        feature = CaseFeature.objects.select_related('case').get(pk=self.feature.pk)
+        with override_settings(DEBUG=True):
+            connection.queries = []
+            for i in range(10):
+                self.assertEqual(feature.logFiles(), ["log.simpleFoam", "log.pisoFoam"])
+                self.assertEqual(feature.case.getOptions()['caseDir'], "case1")
+            self.assertEqual(len(connection.queries), 2)
+        self.assertRaises(KeyError, lambda: feature.case.getOptions()['missing'])
+        self.case.options.filter(name="caseDir").delete()
+        self.case.options.create(name="caseDir", value="case2")
+        self.assertEqual(feature.case.getOptions()['caseDir'], "case2")
+
+    def test_process_cache(self):
+        """
+        With PERCYVAL_OPTION_CACHE the options are shared between instances until one changes.
+        """
+        with override_settings(PERCYVAL_OPTION_CACHE=True, DEBUG=True):
+            self.assertEqual(Case.objects.get(pk=self.case.pk).getOptions()['caseDir'], "case1")
+            connection.queries = []
+            self.assertEqual(Case.objects.get(pk=self.case.pk).getOptions()['caseDir'], "case1")
+            self.assertEqual(len(connection.queries), 1)
+            option = self.case.options.get(name="caseDir")
+            option.value = "case2"
+            option.save()
+            self.assertEqual(Case.objects.get(pk=self.case.pk).getOptions()['caseDir'], "case2")
+            feature = self.case.features.create(name="FOAMResiduals")
+            generation = options._generation
+            feature.delete()
+            self.assertNotEqual(options._generation, generation)
+
+
+class CaseCreateBatchTest(TestCase):
+    def setUp(self):
+        User.objects.create(username="test")
+
+    def spec(self, i, owner="test"):
+        return {
+            'name': "case%d" % i,
+            'owner': owner,
+            'options': [{'name': 'caseDir', 'value': "case%d" % i}],
+            'features': [
+                {'name': 'ImageGallery'},
+                {'name': 'LSF', 'options': [{'name': 'jobId', 'value': str(i)}]},
+            ],
+        }
+
+    def post(self, specs):
+        return self.client.post(reverse('percyval.views.caseCreateBatch'), json.dumps(specs), content_type="application/json")
+
+    def test_batch(self):
+        """
+        Cases are created with their options and features, and returned in the order given.
+        """
+        response = self.post([self.spec(i) for i in range(20)])
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual([case['name'] for case in data], ["case%d" % i for i in range(20)])
+        case = Case.objects.get(pk=data[7]['id'])
+        self.assertEqual(case.getOptions()['caseDir'], "case7")
+        self.assertEqual(case.features.get(name="LSF").getOptions().getList('jobId'), ["7"])
+        self.assertEqual(case.features.count(), 2)
+
+    def test_invalid(self):
+        """
+        Nothing is created if any case is invalid.
+        """
+        response = self.post([self.spec(0), self.spec(1, owner="nobody")])
+        self.assertEqual(response.status_code, 400)
+        specs = [self.spec(0), self.spec(1)]
+        del specs[1]['features']
+        self.assertContains(self.post(specs), "Case 1", status_code=400)
+        self.assertEqual(Case.objects.count(), 0)
+
+    def test_single(self):
+        """
+        A single case is created with the options of its new features, and the features addMonitor sends.
+        """
+        spec = self.spec(3)
+        spec['features'].append({'name': 'MovieGallery'})
+        response = self.client.post(reverse('percyval.views.caseCreate'), json.dumps(spec), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        case = Case.objects.get(pk=json.loads(response.content)['id'])
+        self.assertEqual(sorted(case.features.values_list('name', flat=True)), ['ImageGallery', 'LSF', 'MovieGallery'])
+        self.assertEqual(case.features.get(name="LSF").getOptions().getList('jobId'), ["3"])
+        response = self.client.post(reverse('percyval.views.caseCreate'), json.dumps(self.spec(4, owner="nobody")), content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir, "case1"))
+        f = open(os.path.join(self.dir, "case1", "log.pisoFoam"), 'w')
+        f.write(logSteps(1, 50))
+        f.close()
+        case = Case.objects.create(name="case1", owner=User.objects.create(username="test"))
+        case.options.create(name="caseDir", value="case1")
+        self.feature = case.features.create(name="FOAMForces")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_histogram(self):
+        """
+        Histograms are rendered with cumulative buckets, along with their sum and count.
+        """
+        histogram = metrics.Histogram('test_seconds', "Test.", ['view'], buckets=(1, 10))
+        for value in [0.5, 5, 50]:
+            histogram.observe(value, view="a")
+        self.assertEqual(histogram.render(), [
+            'test_seconds_bucket{view="a",le="1.0"} 1',
+            'test_seconds_bucket{view="a",le="10.0"} 2',
+            'test_seconds_bucket{view="a",le="+Inf"} 3',
+            'test_seconds_sum{view="a"} 55.5',
+            'test_seconds_count{view="a"} 3',
+        ])
+
+    def test_server_timing(self):
+        """
+        Plot requests are counted, and timed in the Server-Timing header when it is turned on.
+        """
+        url = reverse('percyval.views.plotData', args=[self.feature.case.id, self.feature.id, 0, 100])
+        middleware = list(settings.MIDDLEWARE_CLASSES) + ['percyval.metrics.MetricsMiddleware']
+        count = metrics.VIEW_SECONDS.count(view='plotData')
+        with override_settings(MEDIA_ROOT=self.dir, MIDDLEWARE_CLASSES=middleware, PERCYVAL_SERVER_TIMING=True):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        timings = [timing.split(";")[0] for timing in response['Server-Timing'].split(", ")]
+        for name in ['log', 'series', 'encode', 'total']:
+            self.assertTrue(name in timings)
+        self.assertEqual(metrics.VIEW_SECONDS.count(view='plotData'), count+1)
+        with override_settings(PERCYVAL_METRICS=True):
+            response = self.client.get(reverse('percyval.views.metricsView'))
+        self.assertContains(response, 'percyval_view_seconds_count{view="plotData"}')
+        self.assertContains(response, "# TYPE percyval_log_cache_total counter")
+
+    def test_access(self):
+        """
+        Metrics are only served when turned on, and then to staff users or allowed addresses.
+        """
+        url = reverse('percyval.views.metricsView')
+        self.assertEqual(self.client.get(url).status_code, 404)
+        with override_settings(PERCYVAL_METRICS=True, PERCYVAL_METRICS_ALLOWED_IPS=[]):
+            self.assertEqual(self.client.get(url).status_code, 403)
+            staff = User.objects.create_user("staff", "staff@example.com", "secret")
+            staff.is_staff = True
+            staff.save()
+            self.client.login(username="staff", password="secret")
+            self.assertEqual(self.client.get(url).status_code, 200)
+        with override_settings(PERCYVAL_METRICS=True, PERCYVAL_METRICS_ALLOWED_IPS=['10.0.0.1']):
+            self.client.logout()
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+
+class WireFormatTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir, "case1"))
+        f = open(os.path.join(self.dir, "case1", "log.pisoFoam"), 'w')
+        f.write(logSteps(1, 200))
+        f.close()
+        case = Case.objects.create(name="case1", owner=User.objects.create(username="test"))
+        case.options.create(name="caseDir", value="case1")
+        feature = case.features.create(name="FOAMForces")
+        self.args = [case.id, feature.id]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def get(self, start=10, end=20, **kwargs):
+        with override_settings(MEDIA_ROOT=self.dir):
+            return self.client.get(reverse('percyval.views.plotData', args=self.args + [start, end]), **kwargs)
+
+    def test_formats(self):
+        """
+        The columns and binary formats hold the same points as the default format.
+        """
+        points = json.loads(self.get().content)
+        self.assertEqual([point['x'] for point in points[0]['values']], range(10, 21))
+        columns = json.loads(self.get(data={'format': 'columns'}).content)
+        self.assertEqual([c['key'] for c in columns], ['Cd', 'Cl', 'Cm'])
+        self.assertEqual(columns[0]['x'], [point['x'] for point in points[0]['values']])
+        self.assertEqual(columns[0]['y'], [point['y'] for point in points[0]['values']])
+        response = self.get(HTTP_ACCEPT=wireformat.FORMATS['float64'])
+        self.assertEqual(response['Content-Type'], wireformat.FORMATS['float64'])
+        body = response.content
+        (length,) = struct.unpack("<I", body[:4])
+        self.assertEqual((4 + length) % 8, 0)
+        header = json.loads(body[4:4 + length])
+        self.assertEqual(header['series'][0], {'key': 'Cd', 'length': 11})
+        times = array('d', body[4 + length:4 + length + 11 * 8])
+        self.assertEqual(list(times), columns[0]['x'])
+        self.assertEqual(self.get(data={'format': 'xml'}).status_code, 400)
+
+    def test_since_and_gzip(self):
+        """
+        Points after since are sent with the cursor, and large responses are compressed.
+        """
+        data = json.loads(self.get(data={'format': 'columns', 'since': 15}).content)
+        self.assertEqual(data['cursor'], 20)
+        self.assertEqual(data['series'][0]['x'], range(16, 21))
+        response = self.get(data={'format': 'float32', 'since': 15})
+        (length,) = struct.unpack("<I", response.content[:4])
+        self.assertEqual(json.loads(response.content[4:4 + length])['cursor'], 20)
+        response = self.get(0, 200, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response['Content-Encoding'], "gzip")
+        self.assertEqual(len(json.loads(gzip.GzipFile(fileobj=StringIO(response.content)).read())[0]['values']), 199)
+
+    def test_stream(self):
+        """
+        Streamed responses hold the same data as whole ones, sent a chunk of points at a time.
+        """
+        chunk = wireformat.STREAM_CHUNK
+        wireformat.STREAM_CHUNK = 7
+        try:
+            for format in ['points', 'columns']:
+                for points in [1000, 50]:
+                    data = {'format': format, 'points': points, 'method': 'minmax'}
+                    whole = json.loads(self.get(0, 200, data=data).content)
+                    data['stream'] = 1
+                    self.assertEqual(json.loads(self.get(0, 200, data=data).content), whole)
+            response = self.get(0, 200, data={'stream': 1}, HTTP_ACCEPT_ENCODING="gzip")
+        finally:
+            wireformat.STREAM_CHUNK = chunk
+        self.assertEqual(response['Content-Encoding'], "gzip")
+        self.assertEqual(json.loads(gzip.GzipFile(fileobj=StringIO(response.content)).read()), json.loads(self.get(0, 200).content))
+        self.assertEqual(self.get(data={'stream': 1, 'format': 'float32'}).status_code, 400)
+
+
+class OverlayTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        owner = User.objects.create(username="test")
+        self.features = []
+        for (i, steps) in enumerate([100, 200]):
+            os.mkdir(os.path.join(self.dir, "case%d" % i))
+            f = open(os.path.join(self.dir, "case%d" % i, "log.pisoFoam"), 'w')
+            f.write(logSteps(1, steps))
+            f.close()
+            case = Case.objects.create(name="case%d" % i, owner=owner)
+            case.options.create(name="caseDir", value="case%d" % i)
+            self.features.append(case.features.create(name="FOAMForces"))
+        self.residuals = case.features.create(name="FOAMResiduals")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def get(self, series, **params):
+        params['series'] = ["%d:%d:%s" % (feature.case.id, feature.id, field) for (feature, field) in series]
+        params['format'] = 'columns'
+        with override_settings(MEDIA_ROOT=self.dir):
+            return self.client.get(reverse('percyval.views.plotOverlayData'), params)
+
+    def test_overlay(self):
+        """
+        Series from several cases are returned over the range covering all of them.
+        """
+        response = self.get([(self.features[0], 'Cd'), (self.features[1], 'Cd'), (self.residuals, 'Ux'), (self.features[1], 'missing')], points=1000)
+        data = json.loads(response.content)
+        self.assertEqual([series['key'] for series in data['series']], ["case0: Forces Cd", "case1: Forces Cd", "case1: Residuals Ux"])
+        self.assertEqual((data['minTime'], data['maxTime']), (1, 199))
+        self.assertEqual(data['series'][0]['x'], range(1, 100))
+        self.assertEqual(data['series'][1]['x'], range(1, 200))
+        self.assertEqual(data['errors'], [{'key': "case1: Forces missing", 'error': "No data for missing."}])
+
+    def test_timeout(self):
+        """
+        A case that takes too long to load is left out.
+        """
+        import percyval.views
+        (timeout, loadLog) = (percyval.views.OVERLAY_TIMEOUT, overlay.loadLog)
+        percyval.views.OVERLAY_TIMEOUT = 0.2
+        loads = []
+
+        def slowLoadLog(feature):
+            if feature.case.name == "case0":
+                loads.append(feature)
+                time.sleep(1)
+            return loadLog(feature)
+        overlay.loadLog = slowLoadLog
+        try:
+            data = json.loads(self.get([(self.features[0], 'Cd'), (self.features[1], 'Cd')]).content)
+            again = json.loads(self.get([(self.features[0], 'Cd'), (self.features[0], 'Cm')]).content)
+        finally:
+            (percyval.views.OVERLAY_TIMEOUT, overlay.loadLog) = (timeout, loadLog)
+        self.assertEqual([series['key'] for series in data['series']], ["case1: Forces Cd"])
+        self.assertEqual(data['errors'], [{'key': "case0: Forces Cd", 'error': "Timed out loading the log."}])
+        # The load still running is waited on rather than started again.
+        self.assertEqual(len(loads), 1)
+        self.assertEqual([error['error'] for error in again['errors']], ["Still loading the log."] * 2)
+
+    def test_invalid(self):
+        """
+        Features must be plots of the case given.
+        """
+        wrong = "%d:%d:Cd" % (self.features[1].case.id, self.features[0].id)
+        response = self.client.get(reverse('percyval.views.plotOverlayData'), {'series': wrong})
+        self.assertEqual(response.status_code, 400)
+
+
+class DashboardTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir, "case1"))
+        f = open(os.path.join(self.dir, "case1", "log.pisoFoam"), 'w')
+        f.write(logSteps(1, 200))
+        f.close()
+        self.case = Case.objects.create(name="case1", owner=User.objects.create(username="test"))
+        self.case.options.create(name="caseDir", value="case1")
+        self.residuals = self.case.features.create(name="FOAMResiduals")
+        self.forces = self.case.features.create(name="FOAMForces")
+        self.missing = self.case.features.create(name="FOAMCourant")
+        self.missing.options.create(name="logFile", value="log.missing")
+        self.case.features.create(name="ImageGallery")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def get(self, **params):
+        params.setdefault('format', 'columns')
+        with override_settings(MEDIA_ROOT=self.dir):
+            return self.client.get(reverse('percyval.views.plotDashboardData', args=[self.case.id]), params)
+
+    def test_dashboard(self):
+        """
+        Every plot of the case is returned with its range and data, sharing one read of the log.
+        """
+        lookups = logcache.LOOKUPS.get(result='hit') + logcache.LOOKUPS.get(result='miss') + logcache.LOOKUPS.get(result='stale')
+        data = json.loads(self.get(points=1000).content)
+        self.assertEqual(logcache.LOOKUPS.get(result='hit') + logcache.LOOKUPS.get(result='miss') + logcache.LOOKUPS.get(result='stale'), lookups + 1)
+        self.assertEqual([plot['id'] for plot in data['plots']], [self.residuals.id, self.forces.id, self.missing.id])
+        (residuals, forces, missing) = data['plots']
+        self.assertEqual((forces['minTime'], forces['maxTime']), (1, 199))
+        self.assertEqual([series['key'] for series in forces['series']], ['Cd', 'Cl', 'Cm'])
+        self.assertEqual(forces['series'][0]['x'], range(1, 200))
+        self.assertEqual(residuals['series'][0]['key'], 'Ux')
+        self.assertEqual(missing, {'id': self.missing.id, 'name': "FOAMCourant", 'friendlyName': "Courant Number", 'error': "Could not read the log."})
+        self.assertEqual(data['lastUpdated'], forces['lastUpdated'])
+
+    def test_since(self):
+        """
+        Only points after since are returned, with a cursor for the next request.
+        """
+        data = json.loads(self.get(since=190, end=195).content)
+        self.assertEqual(data['plots'][1]['series'][0]['x'], range(191, 196))
+        self.assertEqual(data['cursor'], 195)
+        self.assertEqual(self.get(format='float32').status_code, 400)
+
+
+class WatchTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir, "case1"))
+        self.path = os.path.join(self.dir, "case1", "log.pisoFoam")
+        self.write(logSteps(1, 10))
+        case = Case.objects.create(name="case1", owner=User.objects.create(username="test"))
+        case.options.create(name="caseDir", value="case1")
+        self.feature = case.features.create(name="FOAMForces")
+        self.old = (watch.LogWatcher.INTERVAL, watch.LogWatcher.IDLE_TIMEOUT)
+        (watch.LogWatcher.INTERVAL, watch.LogWatcher.IDLE_TIMEOUT) = (0.05, 0.2)
+        # The stream reads the log after the view has returned.
+        self.settings = override_settings(MEDIA_ROOT=self.dir)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        (watch.LogWatcher.INTERVAL, watch.LogWatcher.IDLE_TIMEOUT) = self.old
+        shutil.rmtree(self.dir)
+
+    def write(self, data, mode='w'):
+        f = open(self.path, mode)
+        f.write(data)
+        f.close()
+
+    def test_watcher(self):
+        """
+        Clients are woken when the log grows, and the thread stops once nobody is watching.
+        """
+        watcher = watch.getWatcher(self.path)
+        self.assertTrue(watcher.check())
+        self.assertFalse(watcher.check())
+        version = watcher.version
+        watcher.subscribe()
+        try:
+            self.assertEqual(watcher.wait(version, 0.2), version)
+            self.write(logSteps(10, 12), 'a')
+            self.assertEqual(watcher.wait(version, 5), version + 1)
+        finally:
+            watcher.unsubscribe()
+        thread = watcher.thread
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(watch.getWatcher(self.path) is not watcher)
+
+    def events(self, **params):
+        import percyval.views
+        request = RequestFactory().get("/", params)
+        return iter(percyval.views.plotEvents(request, self.feature.case.id, self.feature.id))
+
+    def test_stream(self):
+        """
+        Updates are sent as events carrying the points after the cursor, with keepalives between.
+        """
+        import percyval.views
+        old = (percyval.views.PLOT_EVENTS_KEEPALIVE, percyval.views.PLOT_EVENTS_LIFETIME)
+        (percyval.views.PLOT_EVENTS_KEEPALIVE, percyval.views.PLOT_EVENTS_LIFETIME) = (0.1, 5)
+        try:
+            stream = self.events(since=5)
+            self.assertEqual(stream.next(), "retry: 5000\n\n")
+            event = stream.next()
+            self.assertEqual(stream.next(), ": keepalive\n\n")
+            stream.close()
+        finally:
+            (percyval.views.PLOT_EVENTS_KEEPALIVE, percyval.views.PLOT_EVENTS_LIFETIME) = old
+        (id, name, data) = event.rstrip("\n").split("\n")
+        self.assertEqual((id, name), ("id: 8.0", "event: update"))
+        data = json.loads(data[len("data: "):])
+        self.assertEqual((data['since'], data['cursor'], data['maxTime']), (5, 8, 9))
+        self.assertEqual([point['x'] for point in data['series'][0]['values']], [6, 7, 8, 9])
+        self.assertEqual(watch._streams, 0)
+
+    def test_busy(self):
+        """
+        Once the limit on open streams is reached a busy event is sent instead.
+        """
+        with override_settings(PERCYVAL_MAX_EVENT_STREAMS=0):
+            self.assertEqual(list(self.events()), ["event: busy\ndata: {}\n\n"])
+
+
+class CaseIndexTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir, "frames"))
+        open(os.path.join(self.dir, "frames", "a.png"), 'w').close()
+        for path in [self.dir, os.path.join(self.dir, "frames")]:
+            os.utime(path, (1000, 1000))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_revalidate(self):
+        """
+        Directories are only read again once their mtime changes.
+        """
+        index = CaseIndex(self.dir)
+        (frames,) = index.subDirs()
+        self.assertEqual(frames.name, "frames")
+        entries = index.listDir(frames.path)
+        self.assertEqual([entry.name for entry in entries], ["a.png"])
+        self.assertTrue(entries[0].isFile)
+        self.assertTrue(index.listDir(frames.path) is entries)
+        open(os.path.join(self.dir, "frames", "b.png"), 'w').close()
+        self.assertEqual([entry.name for entry in index.listDir(frames.path)], ["a.png", "b.png"])
+        self.assertEqual(index.listDir(os.path.join(self.dir, "missing")), [])
+
+
+class ThumbnailTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    @unittest.skipIf(thumbnails.Image is None, "PIL is not installed")
+    def test_thumbnail(self):
+        """
+        Renditions are scaled down, cached, and renamed when the image changes.
+        """
+        path = os.path.join(self.dir, "frame.png")
+        thumbnails.Image.new('RGBA', (2000, 1000)).save(path)
+        with override_settings(PERCYVAL_THUMBNAIL_DIR=os.path.join(self.dir, "cache")):
+            target = thumbnails.thumbnail(path, 'small', 10)
+            self.assertEqual(thumbnails.Image.open(target).size, (160, 80))
+            self.assertEqual(thumbnails.queue(path, 'small'), (target, None))
+            os.utime(path, (1000, 1000))
+            self.assertNotEqual(thumbnails.thumbnailPath(path, 'small'), target)
+
+    @unittest.skipIf(thumbnails.Image is None, "PIL is not installed")
+    def test_prepare(self):
+        """
+        Renditions are prepared in the pool from the mtime and size already known.
+        """
+        path = os.path.join(self.dir, "frame.png")
+        thumbnails.Image.new('RGB', (400, 200)).save(path)
+        st = os.stat(path)
+        stat = (st.st_mtime, st.st_size)
+        with override_settings(PERCYVAL_THUMBNAIL_DIR=os.path.join(self.dir, "cache")):
+            self.assertEqual(thumbnails.thumbnailPath(path, 'small', stat), thumbnails.thumbnailPath(path, 'small'))
+            thumbnails.prepare([(path, stat)], ['small']).get(10)
+            (target, result) = thumbnails.queue(path, 'small', stat)
+            if result is not None:
+                result.get(10)
+            self.assertEqual(thumbnails.Image.open(target).size, (160, 80))
+
+
+class ImageThumbnailTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.dir, "case1", "frames"))
+        open(os.path.join(self.dir, "case1", "frames", "a.png"), 'wb').close()
+        self.case = Case.objects.create(name="case1", owner=User.objects.create(username="test"))
+        self.case.options.create(name="caseDir", value="case1")
+        self.case.features.create(name="ImageGallery")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_not_cached(self):
+        """
+        A rendition that is not cached yet redirects to the full image rather than waiting.
+        """
+        url = reverse('percyval.views.imageThumbnail', args=[self.case.id, 'small', "frames/a.png"])
+        with override_settings(MEDIA_ROOT=self.dir, PERCYVAL_THUMBNAIL_DIR=os.path.join(self.dir, "cache")):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].endswith(reverse('percyval.views.imageView', args=[self.case.id, "frames/a.png"])))
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+
+class ServeFileTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "movie.webm")
+        f = open(self.path, 'wb')
+        f.write("0123456789")
+        f.close()
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def serve(self, **headers):
+        return serveFile(self.factory.get('/movie.webm', **headers), self.path)
+
+    def test_range(self):
+        """
+        A single byte range is sent as partial content.
+        """
+        response = self.serve(HTTP_RANGE='bytes=2-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-4/10')
+        self.assertEqual(response.content, '234')
+        self.assertEqual(self.serve(HTTP_RANGE='bytes=-3').content, '789')
+        self.assertEqual(self.serve(HTTP_RANGE='bytes=20-').status_code, 416)
+        response = self.serve(HTTP_RANGE='bytes=2-4', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, '0123456789')
+
+    def test_conditional(self):
+        """
+        Requests with a matching validator are answered with 304 Not Modified.
+        """
+        response = self.serve()
+        self.assertEqual(self.serve(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.serve(HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.assertEqual(self.serve(HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_sendfile_root(self):
+        """
+        Files below the sendfile root are handed to the front end, others are sent directly.
+        """
+        root = os.path.join(self.dir, "media")
+        os.mkdir(root)
+        inside = os.path.join(root, "movie.webm")
+        shutil.copy(self.path, inside)
+        with override_settings(PERCYVAL_SENDFILE='X-Accel-Redirect', PERCYVAL_SENDFILE_ROOT=root):
+            response = serveFile(self.factory.get('/movie.webm'), inside)
+            self.assertEqual(response['X-Accel-Redirect'], '/protected/movie.webm')
+            self.assertEqual(response.content, '')
+            response = self.serve()
+            self.assertFalse(response.has_header('X-Accel-Redirect'))
+            self.assertEqual(response.content, '0123456789')
+
+
+class BenchmarkGateTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.baselines = os.path.join(self.dir, "baselines.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def runBenchmarks(self, *args):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "run.py")
+        command = [sys.executable, script, '--only', 'plot-data', '--size', '1', '--queries', '5', '--galleries', '1', '--images', '2', '--repeat', '1', '--baselines', self.baselines]
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        process = subprocess.Popen(command + list(args), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+        output = process.communicate()[0]
+        return (process.returncode, output)
+
+    def test_regression(self):
+        """
+        A run slower than the saved baseline by more than the tolerance exits with status 1.
+        """
+        (status, output) = self.runBenchmarks('--save')
+        self.assertEqual(status, 0, output)
+        f = open(self.baselines)
+        baselines = json.load(f)
+        f.close()
+        baselines['results']['plot-data']['rate'] *= 1000
+        f = open(self.baselines, 'w')
+        json.dump(baselines, f)
+        f.close()
+        (status, output) = self.runBenchmarks('--tolerance', '0.2')
+        self.assertEqual(status, 1, output)
+        self.assertTrue("REGRESSION" in output)
@@ -0,0 +1,154 @@
+#  Copyright 2011 David Irvine
+#
+#  This file is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This file is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with This file.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  Downscaled renditions of gallery images.  Renditions are rendered by a pool
+#  of worker threads, PIL releases the interpreter lock while it decodes and
+#  resizes, and are kept in an on-disk cache named by the path, mtime and size
+#  of the image, so a changed image gets a new rendition and a rendition never
+#  has to be invalidated.  PIL is optional, without it no renditions are made.
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+from multiprocessing.pool import ThreadPool
+from django.conf import settings
+
+log = logging.getLogger(__name__)
+
+try:
+	from PIL import Image
+except ImportError:
+	try:
+		import Image
+	except ImportError:
+		Image=None
+
+## Renditions that can be requested, mapped to the longest side in pixels.
+SIZES={
+		'small':160,
+		'medium':480,
+		'large':1600,
+		}
+## JPEG quality of the renditions.
+QUALITY=85
+
+_pool=None
+_pending={}
+_lock=threading.Lock()
+
+## Returns the directory renditions are cached in, set by PERCYVAL_THUMBNAIL_DIR.
+def cacheDir():
+	return getattr(settings, 'PERCYVAL_THUMBNAIL_DIR', os.path.join(tempfile.gettempdir(), "percyval-thumbnails"))
+
+## Returns the path the named rendition of the image at path is cached at.  stat is the
+#  (mtime, size in bytes) of the image if it is already known, otherwise the image is stat'ed.
+def thumbnailPath(path, size, stat=None):
+	if stat is None:
+		st=os.stat(path)
+		stat=(st.st_mtime, st.st_size)
+	key=hashlib.sha1("%s\0%r\0%d\0%s" % (path, stat[0], stat[1], size)).hexdigest()
+	return os.path.join(cacheDir(), key[:2], key+".jpg")
+
+## Writes a JPEG of the image at path to target, no more than pixels wide or high.  Run in
+#  the worker pool.
+def render(path, target, pixels):
+	image=Image.open(path)
+	# Lets JPEG images be decoded at a reduced scale.
+	image.draft('RGB', (pixels, pixels))
+	if image.mode in ['RGBA', 'LA', 'P']:
+		image=image.convert('RGBA')
+		background=Image.new('RGB', image.size, (255, 255, 255))
+		background.paste(image, mask=image.split()[-1])
+		image=background
+	elif image.mode != 'RGB':
+		image=image.convert('RGB')
+	image.thumbnail((pixels, pixels), Image.ANTIALIAS)
+	try:
+		os.makedirs(os.path.dirname(target))
+	except OSError:
+		pass
+	tmpPath="%s.%d.%d.tmp" % (target, os.getpid(), threading.current_thread().ident)
+	image.save(tmpPath, "JPEG", quality=QUALITY, optimize=True)
+	os.rename(tmpPath, target)
+	return target
+
+# Returns the worker pool, PERCYVAL_THUMBNAIL_WORKERS sets the number of threads.
+def _getPool():
+	global _pool
+	if _pool is None:
+		_pool=ThreadPool(getattr(settings, 'PERCYVAL_THUMBNAIL_WORKERS', 2))
+	return _pool
+
+## Queues the named rendition of the image at path to be rendered, unless it is cached or
+#  already queued.  stat is taken as by thumbnailPath.  Returns the path of the rendition and
+#  the AsyncResult for it, which is None if the rendition is already cached.
+def queue(path, size, stat=None):
+	target=thumbnailPath(path, size, stat)
+	if os.path.exists(target):
+		return (target, None)
+	with _lock:
+		result=_pending.get(target)
+		if result is None or (result.ready() and not os.path.exists(target)):
+			result=_getPool().apply_async(render, (path, target, SIZES[size]),
+					callback=lambda target: _pending.pop(target, None))
+			_pending[target]=result
+	return (target, result)
+
+## Returns the path of the named rendition of the image at path, waiting up to timeout
+#  seconds for it to be rendered.  Returns None if PIL is not available, or the rendition
+#  could not be made in time.
+def thumbnail(path, size, timeout):
+	if Image is None:
+		return None
+	(target, result)=queue(path, size)
+	if result is None:
+		return target
+	try:
+		return result.get(timeout)
+	except Exception, e:
+		if result.ready():
+			with _lock:
+				_pending.pop(target, None)
+			log.warning("thumbnails: could not render %s: %s" % (path, e))
+		return None
+
+# Queues the renditions asked for by prepare, run in the worker pool.
+def _prepare(images, sizes):
+	for size in sizes:
+		for (path, stat) in images:
+			try:
+				queue(path, size, stat)
+			except OSError:
+				pass
+
+## Returns the path of the named rendition of the image at path if it is cached.  Otherwise
+#  it is queued to be rendered and None is returned at once, as it is if PIL is not available.
+def cachedThumbnail(path, size):
+	if Image is None:
+		return None
+	(target, result)=queue(path, size)
+	if result is None:
+		return target
+	return None
+
+## Queues the named renditions of images, a list of (path, (mtime, size in bytes)), so they
+#  are ready by the time the browser asks for them.  The images are not touched by the
+#  caller, looking for cached renditions is left to the worker pool.  Returns the AsyncResult
+#  for that, or None if PIL is not available.
+def prepare(images, sizes):
+	if Image is None:
+		return None
+	return _getPool().apply_async(_prepare, (images, sizes))
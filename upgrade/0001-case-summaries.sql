@@ -0,0 +1,13 @@
+-- Adds the stored last update time and summary of cases and features, read by
+-- the case list and written by the refreshcases command.  syncdb does not
+-- change tables that already exist, so run this once on a database created
+-- before these columns were added, for example:
+--
+--   python manage.py dbshell < percyval/upgrade/0001-case-summaries.sql
+--
+-- The column types are those of SQLite and MySQL, on PostgreSQL use
+-- "timestamp with time zone" in place of datetime.  On MySQL run
+-- SET sql_mode='ANSI_QUOTES'; first so the quoted names are read as columns.
+ALTER TABLE "percyval_case" ADD COLUMN "lastUpdated" datetime NULL;
+ALTER TABLE "percyval_casefeature" ADD COLUMN "lastUpdated" datetime NULL;
+ALTER TABLE "percyval_casefeature" ADD COLUMN "summary" varchar(255) NOT NULL DEFAULT '';
@@ -17,15 +17,15 @@
 #  $Author: irvined $:
 #  $Date: 2013-01-05 01:27:49 +0100 (Sat, 05 Jan 2013) $:
 from django.conf.urls.defaults import patterns, include, url
-from django.views.generic import ListView
 from percyval.models import *
 
 urlpatterns = patterns('',
+	url(r'^create/batch$','percyval.views.caseCreateBatch'),
 	url(r'^create','percyval.views.caseCreate'),
 	url(r'^(\d+)/feature/(\w+)/option/add', 'percyval.views.caseFeatureAdd'),
 	url(r'^(\d+)/delete$', 'percyval.views.caseDelete'),
 	url(r'^(\d+)/delete/ask$', 'percyval.views.confirmCaseDelete'),
-	url(r'^$', ListView.as_view(model=Case)),
+	url(r'^$', 'percyval.views.caseList'),
 	url(r'^(\d+)/$','percyval.views.caseDefaultView'),
 	url(r'^(\d+)/webgl/$','percyval.views.sceneList'),
 	url(r'^(\d+)/movies/$','percyval.views.movieList'),
@@ -34,10 +34,18 @@ urlpatterns = patterns('',
 	url(r'^(\d+)/images/gallery/(.+)/$','percyval.views.imageGalleryView'),
 	url(r'^(\d+)/images/download/(.+\.jpg)$','percyval.views.imageView'),
 	url(r'^(\d+)/images/download/(.+\.png)$','percyval.views.imageView'),
+	url(r'^(\d+)/images/thumbnail/(\w+)/(.+\.(?:jpg|png))$','percyval.views.imageThumbnail'),
 
 	url(r'^(\d+)/plot/(\d+)/$','percyval.views.plotView'),
 	url(r'^(\d+)/plot/(\d+)/plotData/([-+]?[0-9]*\.?[0-9]+)/([-+]?[0-9]*\.?[0-9]+)','percyval.views.plotData'),
 	url(r'^(\d+)/plot/(\d+)/updateTime$','percyval.views.plotUpdateTime'),
 	url(r'^(\d+)/plot/(\d+)/timeRange$','percyval.views.plotTimeRange'),
+	url(r'^(\d+)/plot/(\d+)/events$','percyval.views.plotEvents'),
+	url(r'^(\d+)/plot/$','percyval.views.plotDashboardView'),
+	url(r'^(\d+)/plot/data$','percyval.views.plotDashboardData'),
+	url(r'^plot/overlay/$','percyval.views.plotOverlayView'),
+	url(r'^plot/overlay/data$','percyval.views.plotOverlayData'),
+
+	url(r'^metrics$','percyval.views.metricsView'),
 
 )
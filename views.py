@@ -17,93 +17,88 @@
 #  $Author: ubuntu $:
 #  $Date: 2013-01-13 11:49:04 +0100 (Sun, 13 Jan 2013) $:
 import json
-import mimetypes
+import time
+import datetime
 from django.core.urlresolvers import reverse
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.cache import never_cache
-from django.core.servers.basehttp import FileWrapper
 from django.shortcuts import redirect
 from django.shortcuts import render_to_response
 from django.shortcuts import get_object_or_404
 from django.http import HttpResponseBadRequest
+from django.http import HttpResponseForbidden
+from django.http import HttpResponseNotFound
 from django.http import HttpResponse
 from django.http import Http404
 from django.contrib.auth.models import User
 from django.views.decorators.csrf import csrf_exempt
 from django.template import RequestContext
 from percyval.models import *
-
-
-@csrf_exempt
-def caseCreate(request):
-	## Creates a new case in the database using the JSON data
-	#  supplied by the end user.
-	# Only create the case using json data, if there is no
-	# json data, raise 400
-	if request.method != 'POST':
-		return HttpResponseBadRequest("No POST data received.")
-	try:
-		m=json.load(request)
-	except:
-		return HttpResponseBadRequest("Could not parse json data.")
-	ALLOWED_FEATURES=['StarCCMResidualMonitor','ImageGallery','lsf']
+from percyval.watch import getWatcher, openStream, closeStream
+from percyval.series import DOWNSAMPLERS
+from percyval import thumbnails
+from percyval.serve import serveFile
+from percyval import metrics
+from percyval import wireformat
+from percyval import overlay
+from percyval.options import loadOptionMaps
+
+
+## Names of the features cases created through the API may have.
+ALLOWED_FEATURES=['StarCCMResidualMonitor','ImageGallery','MovieGallery','LSF','lsf']
+
+# Returns a message saying what is wrong with the case spec m, decoded from the JSON data sent
+# to caseCreate, or None if it is valid.
+def _caseSpecError(m):
 	NEEDED_FIELDS=['features','owner','name']
-
+	if not isinstance(m, dict):
+		return "Case is not a JSON object."
 	# Check for required fields
 	for field in NEEDED_FIELDS:
 		if field not in m:
-			return HttpResponseBadRequest("Required field: %s not specified in JSON data." % field)
+			return "Required field: %s not specified in JSON data." % field
 	# check options are valid for case
 	if 'options' in m:
 		for option in m['options']:
 			if 'name' not in option:
-				return HttpResponseBadRequest("option name not specified in JSON data." )
+				return "option name not specified in JSON data."
 			if 'value' not in option:
-				return HttpResponseBadRequest("option value not specified in JSON data." )
+				return "option value not specified in JSON data."
 	# check features are valid
 	for feature in m['features']:
 		if 'name' not in feature:
-			return HttpResponseBadRequest("Feature name not specified in JSON data.")
+			return "Feature name not specified in JSON data."
 		if feature['name'] not in ALLOWED_FEATURES:
-			return HttpResponseBadRequest("Invalid Feature Name: %s" % feature)
+			return "Invalid Feature Name: %s" % feature
 		# check options for features are valid
 		if 'options' in feature:
 			for option in feature['options']:
 				if 'name' not in option:
-					return HttpResponseBadRequest("option name not specified in JSON data." )
+					return "option name not specified in JSON data."
 				if 'value' not in option:
-					return HttpResponseBadRequest("option value not  specified in JSON data.")
+					return "option value not  specified in JSON data."
+	return None
+
+@csrf_exempt
+def caseCreate(request):
+	## Creates a new case in the database using the JSON data
+	#  supplied by the end user.
+	# Only create the case using json data, if there is no
+	# json data, raise 400
+	if request.method != 'POST':
+		return HttpResponseBadRequest("No POST data received.")
 	try:
-		user = User.objects.get(username=m['owner'])
-	except ObjectDoesNotExist:
-		return HttpResponseBadRequest("Invalid owner name: %s" % m['owner'])
-		
+		m=json.load(request)
+	except:
+		return HttpResponseBadRequest("Could not parse json data.")
+	error=_caseSpecError(m)
+	if error is not None:
+		return HttpResponseBadRequest(error)
 	# Create the case.
-	c=Case.objects.create(name=m['name'], owner=user)
 	try:
-		# add the options
-		for option in m['options']:
-			c.options.create(
-				name=option['name'],
-				value=option['value'],
-				)
-	except KeyError:
-		# don't worry if no options specified
-		pass
-
-	for feature in m['features']:
-		(f, created)=c.features.get_or_create(name=feature['name'])
-		if not created:
-			try:
-				# add options for feature
-				for option in feature['options']:
-					f.options.create(
-						name=option['name'],
-						value=option['value'],
-						)
-			except KeyError:
-				# don't worry if not specified
-				pass
+		(c,)=createCases([m])
+	except KeyError, e:
+		return HttpResponseBadRequest("Invalid owner name: %s" % e.args[0])
 
 	# Create a json object to return the id and name to the user
 	data={
@@ -113,12 +108,37 @@ def caseCreate(request):
 	# spit it out.
 	return HttpResponse(json.dumps(data),content_type="application/json")
 
+## Creates several cases from a JSON array of cases, each in the format taken by caseCreate.
+#  Every case is checked before any is created, and they are created in a single transaction,
+#  so either all of them are created or none are.  Returns a JSON array with the name and id of
+#  each case, in the order they were given.
+@csrf_exempt
+def caseCreateBatch(request):
+	if request.method != 'POST':
+		return HttpResponseBadRequest("No POST data received.")
+	try:
+		specs=json.load(request)
+	except:
+		return HttpResponseBadRequest("Could not parse json data.")
+	if not isinstance(specs, list):
+		return HttpResponseBadRequest("Cases must be sent as a JSON array.")
+	for (i, m) in enumerate(specs):
+		error=_caseSpecError(m)
+		if error is not None:
+			return HttpResponseBadRequest("Case %d: %s" % (i, error))
+	try:
+		cases=createCases(specs)
+	except KeyError, e:
+		return HttpResponseBadRequest("Invalid owner name: %s" % e.args[0])
+	data=[{'name':c.name, 'id':c.id} for c in cases]
+	return HttpResponse(json.dumps(data),content_type="application/json")
+
 ## Deletes a case.
 @login_required
 def caseDelete(request, caseId):
 	case=get_object_or_404(Case,pk=caseId)
 	case.delete()
-	return redirect(reverse("ListView.as_view(model=Case)"))
+	return redirect(reverse("percyval.views.caseList"))
 
 ## Presents a confirmation screen, used only via the web gui.
 @login_required
@@ -176,6 +196,13 @@ def caseFeatureOptionSet(request, caseId, feature):
 def caseFeatureOptionDelete(request, caseId, feature):
 	pass
 
+## Lists the cases with their features and the stored last update times and summaries.  The
+# features of every case are read in a single query, so the page costs the same number of
+# queries however many cases there are, and never reads the case directories.
+def caseList(request):
+	cases=attachFeatures(list(Case.objects.select_related('owner').order_by('id')))
+	return render_to_response('percyval/case_list.html',{'object_list':cases,},context_instance=RequestContext(request))
+
 def caseDefaultView(request, caseId):
 	case=get_object_or_404(Case,pk=caseId)
 	return render_to_response('percyval/case_detail.html',{'object':case,},context_instance=RequestContext(request))
@@ -191,11 +218,11 @@ def movieList(request,id):
 ## Downloads a movie to the client for the MovieGallery feature.
 def movieView(request,id,movie):
 	feature=get_object_or_404(CaseFeature, case__pk=id, name='MovieGallery')
-	path=feature.getMoviePath(movie)
-	print mimetypes.guess_type(path)[0]
-	response=HttpResponse(FileWrapper(open(path)), content_type=mimetypes.guess_type(path)[0])
-	response['Content-Length']=os.path.getsize(path)
-	return response
+	try:
+		path=feature.getMoviePath(movie)
+	except ValueError:
+		raise Http404
+	return serveFile(request, path)
 
 ############## Web GL Scene Feature Views #################
 def sceneList(request,id):
@@ -218,35 +245,158 @@ def imageGalleryView(request,id,gallery):
 		raise Http404
 	images=allImages[gallery].values()
 	images=sorted(images, key=lambda k: k['mTime'], reverse=True) 
+	thumbnails.prepare([(image['localPath'], (image['mTime'], image['bytes'])) for image in images], ['medium', 'large'])
 	return render_to_response('percyval/features/images/imageGalleryView.html',{'feature':feature,'name':gallery,'images':images},context_instance=RequestContext(request))
 
 ## Downloads an image from an image gallery for the ImageGallery feature.
 def imageView(request,id, image):
 	feature=get_object_or_404(CaseFeature, case__pk=id, name='ImageGallery')
-	path=feature.getImagePath(image)
-	response=HttpResponse(FileWrapper(open(path)), content_type=mimetypes.guess_type(path)[0])
-	response['Content-Length']=os.path.getsize(path)
-	return response
-
+	try:
+		path=feature.getImagePath(image)
+	except ValueError:
+		raise Http404
+	return serveFile(request, path)
+
+## Sends a downscaled rendition of an image from an image gallery for the ImageGallery feature.
+# The URL of a rendition changes whenever the image does, so it is cached by the browser for a
+# year.  A rendition that is not cached yet is queued to be rendered and the request is
+# redirected to the full image straight away, without being cached, so the rendition is sent
+# next time.
+def imageThumbnail(request, id, size, image):
+	feature=get_object_or_404(CaseFeature, case__pk=id, name='ImageGallery')
+	if size not in thumbnails.SIZES:
+		raise Http404
+	try:
+		path=feature.getImageLocalPath(image)
+		target=thumbnails.cachedThumbnail(path, size)
+	except (ValueError, OSError):
+		raise Http404
+	if target is None:
+		response=redirect('percyval.views.imageView', id, image)
+		response['Cache-Control']='no-cache'
+		return response
+	return serveFile(request, target, "image/jpeg", 'public, max-age=31536000')
 
 ############## Plotting Feature Views ################
 
-# Returns a JSON object containing the data between the requested timesteps that FLOT can use
-# to render the graph.
+ENCODE_SECONDS=metrics.histogram('percyval_plot_encode_seconds', "Time taken to encode the data sent by plotData, by format.", ['format'])
+
+# Returns the data between the requested timesteps that FLOT can use to render the graph.
+# The optional points query parameter sets the number of points returned per series, usually
+# the width of the chart in pixels, and method chooses how the series are downsampled to that
+# many points.  If since is given only the points after that time are returned, along with a
+# cursor to pass as since on the next request.  The data is sent in the format chosen by the
+# format query parameter or the Accept header, see wireformat, a JSON list of points by
+# default, and compressed with gzip if the browser accepts it.  If the stream query parameter
+# is set the data is sent a series and a chunk of points at a time as it is read, so wide ranges
+# are sent without holding them all in memory.  Only the JSON formats may be streamed, and not
+# along with since.
 @never_cache
 def plotData(request,caseId,featureId, startTime, endTime):
-	allowedClasses=[]
-	for c in Plot.__subclasses__():
-		allowedClasses.append(c.__name__)
-	feature=get_object_or_404(CaseFeature, case__pk=caseId, pk=featureId, name__in=allowedClasses)
-	return HttpResponse(json.dumps(feature.getSeries(startTime, endTime)), content_type="application/json")
+	feature=get_object_or_404(CaseFeature, case__pk=caseId, pk=featureId, name__in=PLOT_FEATURES)
+	points=None
+	if 'points' in request.GET:
+		try:
+			points=int(request.GET['points'])
+		except ValueError:
+			return HttpResponseBadRequest("points must be an integer.")
+		if points < 1:
+			return HttpResponseBadRequest("points must be positive.")
+	try:
+		format=wireformat.negotiate(request)
+		if request.GET.get('stream'):
+			if format not in ['points', 'columns'] or 'since' in request.GET:
+				raise ValueError("Only the points and columns formats may be streamed, without since.")
+			method=request.GET.get('method')
+			if method is not None and method not in DOWNSAMPLERS:
+				raise ValueError("Unknown downsampling method: %s" % method)
+			series=feature.iterColumns(startTime, endTime, points, method)
+			return wireformat.streamResponse(request, wireformat.iterEncode(series, format), format)
+		if 'since' in request.GET:
+			extra=feature.getColumnsSince(float(request.GET['since']), endTime, points, request.GET.get('method'))
+			series=extra.pop('series')
+		else:
+			extra=None
+			series=feature.getColumns(startTime, endTime, points, request.GET.get('method'))
+	except ValueError, e:
+		return HttpResponseBadRequest(str(e))
+	with metrics.timed(ENCODE_SECONDS, 'encode', format=format):
+		(content, contentType)=wireformat.encode(series, format, extra)
+	return wireformat.gzipResponse(request, HttpResponse(content, content_type=contentType))
+
+## Seconds a plot event stream stays open before the browser has to reconnect.
+PLOT_EVENTS_LIFETIME=300
+## Seconds between comments sent to keep an idle plot event stream open.
+PLOT_EVENTS_KEEPALIVE=20
+
+## Streams updates to a plot as Server-Sent Events.  One LogWatcher per log file is shared by
+# every client in the process, and an event is only sent when it has parsed new data.  Each
+# event carries the last update time, the time range and the points after the client's cursor
+# in the same form as plotData with since.  The stream ends after a few minutes and the browser
+# reconnects, sending the last cursor back as Last-Event-ID.  Middleware that reads the whole
+# response, such as GZipMiddleware, must not be used on this view.  Under a threaded WSGI
+# server each open stream holds a thread, so at most PERCYVAL_MAX_EVENT_STREAMS are open at
+# once in a process, default 8, which must be fewer than its threads.  Past that a single busy
+# event is sent and the page polls instead.  Servers with green threads, such as gunicorn with
+# gevent workers, can raise the limit to follow far more viewers.
+@never_cache
+def plotEvents(request, caseId, featureId):
+	feature=get_object_or_404(CaseFeature, case__pk=caseId, pk=featureId, name__in=PLOT_FEATURES)
+	if not hasattr(feature, 'logFilePath'):
+		raise Http404
+	try:
+		since=float(request.META.get('HTTP_LAST_EVENT_ID', request.GET.get('since', '-inf')))
+		points=int(request.GET.get('points', feature.maxPoints))
+	except ValueError:
+		return HttpResponseBadRequest("Invalid since or points.")
+	method=request.GET.get('method')
+	if points < 1 or (method is not None and method not in DOWNSAMPLERS):
+		return HttpResponseBadRequest("Invalid points or method.")
+	watcher=getWatcher(feature.logFilePath())
+
+	def events():
+		cursor=since
+		version=0
+		deadline=time.time()+PLOT_EVENTS_LIFETIME
+		if not openStream():
+			yield "event: busy\ndata: {}\n\n"
+			return
+		watcher.subscribe()
+		try:
+			yield "retry: 5000\n\n"
+			while time.time() < deadline:
+				newVersion=watcher.wait(version, PLOT_EVENTS_KEEPALIVE)
+				if newVersion == version:
+					yield ": keepalive\n\n"
+					continue
+				version=newVersion
+				feature.clearLogData()
+				with feature.seriesLock():
+					try:
+						data=feature.getSeriesSince(cursor, float('inf'), points, method)
+						data['minTime']=feature.getMinTime()
+						data['maxTime']=feature.getMaxTime()
+					except (IndexError, ValueError):
+						# Nothing has been parsed from the log yet.
+						continue
+				if cursor == float('-inf'):
+					data['since']=None
+				else:
+					data['since']=cursor
+				data['lastUpdated']=str(datetime.datetime.utcfromtimestamp(watcher.mtime))
+				cursor=data['cursor']
+				yield "id: %r\nevent: update\ndata: %s\n\n" % (cursor, json.dumps(data))
+		finally:
+			watcher.unsubscribe()
+			closeStream()
+
+	response=HttpResponse(events(), content_type="text/event-stream")
+	response['X-Accel-Buffering']='no'
+	return response
 
 ## Gets the time the data used in the plot was last updated in string format encoded in a JSON object.
 def plotUpdateTime(request,caseId, featureId):
-	allowedClasses=[]
-	for c in Plot.__subclasses__():
-		allowedClasses.append(c.__name__)
-	feature=get_object_or_404(CaseFeature, case__pk=caseId, pk=featureId, name__in=allowedClasses)
+	feature=get_object_or_404(CaseFeature, case__pk=caseId, pk=featureId, name__in=PLOT_FEATURES)
 	data={
 		'lastUpdated':str(feature.getLastUpdateTime())
 		}
@@ -255,10 +405,7 @@ def plotUpdateTime(request,caseId, featureId):
 ## Gets the bounds of the plot, usually the timestep, but could be any numeric identifier. This is used
 # to populate the values for the slider bar in the GUI. 
 def plotTimeRange(request, caseId, featureId):
-	allowedClasses=[]
-	for c in Plot.__subclasses__():
-		allowedClasses.append(c.__name__)
-	feature=get_object_or_404(CaseFeature, case__pk=caseId, pk=featureId, name__in=allowedClasses)
+	feature=get_object_or_404(CaseFeature, case__pk=caseId, pk=featureId, name__in=PLOT_FEATURES)
 	data={
 			'minTime':feature.getMinTime(),
 			'maxTime':feature.getMaxTime(),
@@ -267,10 +414,159 @@ def plotTimeRange(request, caseId, featureId):
 
 ## Renders the plot template with the specified feature.
 def plotView(request, caseId, featureId):
-	allowedClasses=[]
-	for c in Plot.__subclasses__():
-		allowedClasses.append(c.__name__)
-	feature=get_object_or_404(CaseFeature, case__pk=caseId, pk=featureId, name__in=allowedClasses)
+	feature=get_object_or_404(CaseFeature, case__pk=caseId, pk=featureId, name__in=PLOT_FEATURES)
 	return render_to_response('percyval/features/plot/plotView.html',{
 		'feature':feature,
 	},context_instance=RequestContext(request))
+
+## Returns in one response what the plot page of each plot feature of a case polls for: the
+# time its log was last updated, its time range and its data between start and end, which
+# default to the range of each plot.  points, method and since are taken as by plotData, and
+# format as well, though only the JSON formats may be used.  Features plotting the same log
+# share a single read of it, see loadPlots.  A plot that cannot be read yet has an 'error' in
+# place of its data.  When since is given each plot has its own 'cursor', and the earliest of
+# them is returned as 'cursor' to pass as since on the next request.
+@never_cache
+def plotDashboardData(request, caseId):
+	case=get_object_or_404(Case, pk=caseId)
+	try:
+		format=wireformat.negotiate(request)
+		if format not in ['points', 'columns']:
+			raise ValueError("The dashboard is only sent in the points or columns format.")
+		startTime=float(request.GET['start']) if 'start' in request.GET else None
+		endTime=float(request.GET['end']) if 'end' in request.GET else None
+		since=float(request.GET['since']) if 'since' in request.GET else None
+		points=int(request.GET['points']) if 'points' in request.GET else None
+	except ValueError, e:
+		return HttpResponseBadRequest(str(e))
+	method=request.GET.get('method')
+	if (points is not None and points < 1) or (method is not None and method not in DOWNSAMPLERS):
+		return HttpResponseBadRequest("Invalid points or method.")
+	if format == 'columns':
+		convert=wireformat.toColumns
+	else:
+		convert=wireformat.toPoints
+	plots=[]
+	lastUpdated=[]
+	for feature in loadPlots(case):
+		plot={'id':feature.id, 'name':feature.name, 'friendlyName':feature.friendlyName}
+		try:
+			updated=feature.getLastUpdateTime()
+			with feature.seriesLock():
+				minTime=feature.getMinTime()
+				maxTime=feature.getMaxTime()
+				if since is None:
+					data={'series':feature.getColumns(minTime if startTime is None else startTime, maxTime if endTime is None else endTime, points, method)}
+				else:
+					data=feature.getColumnsSince(since, maxTime if endTime is None else endTime, points, method)
+		except (IndexError, ValueError):
+			plot['error']="No data yet."
+		except EnvironmentError:
+			plot['error']="Could not read the log."
+		else:
+			lastUpdated.append(updated)
+			plot.update(data, lastUpdated=str(updated), minTime=minTime, maxTime=maxTime)
+		plots.append(plot)
+	result={'case':case.id, 'lastUpdated':None, 'plots':plots}
+	if lastUpdated:
+		result['lastUpdated']=str(max(lastUpdated))
+	cursors=[plot['cursor'] for plot in plots if 'cursor' in plot]
+	if cursors:
+		result['cursor']=min(cursors)
+	with metrics.timed(ENCODE_SECONDS, 'encode', format=format):
+		for plot in plots:
+			if 'series' in plot:
+				plot['series']=convert(plot['series'])
+		content=json.dumps(result)
+	return wireformat.gzipResponse(request, HttpResponse(content, content_type=wireformat.FORMATS[format]))
+
+## Renders every plot of a case on one page, kept up to date with a single request to
+# plotDashboardData however many plots there are.
+def plotDashboardView(request, caseId):
+	case=get_object_or_404(Case, pk=caseId)
+	return render_to_response('percyval/features/plot/dashboardView.html',{
+		'case':case,
+		'plots':case.features.filter(name__in=PLOT_FEATURES).order_by('id'),
+	},context_instance=RequestContext(request))
+
+## Seconds each case of an overlay has to load before it is left out.
+OVERLAY_TIMEOUT=10
+
+# Returns the series asked for by the series query parameters of an overlay request, each
+# <case id>:<feature id>:<series name>, as a list of (key, feature, field).  The features and
+# their options are read in a few queries, however many there are.  Raises ValueError if a
+# parameter is malformed or names a feature that is not a plot of the case.
+def _overlayRequests(request):
+	specs=request.GET.getlist('series')
+	if not specs:
+		raise ValueError("No series given.")
+	if len(specs) > overlay.MAX_SERIES:
+		raise ValueError("At most %d series may be overlaid." % overlay.MAX_SERIES)
+	parsed=[]
+	for spec in specs:
+		try:
+			(caseId, featureId, field)=spec.split(":", 2)
+			parsed.append((int(caseId), int(featureId), field))
+		except ValueError:
+			raise ValueError("Series must be given as <case>:<feature>:<name>, not %s." % spec)
+	features=dict([(f.pk, f) for f in CaseFeature.objects.filter(pk__in=[p[1] for p in parsed], name__in=PLOT_FEATURES).select_related('case')])
+	for (caseId, featureId, field) in parsed:
+		if featureId not in features or features[featureId].case_id != caseId:
+			raise ValueError("Case %d has no plot %d." % (caseId, featureId))
+	loadOptionMaps(features.values())
+	loadOptionMaps([f.case for f in features.values()])
+	requests=[]
+	for (caseId, featureId, field) in parsed:
+		feature=features[featureId]
+		requests.append(("%s: %s %s" % (feature.case.name, feature.friendlyName, field), feature, field))
+	return requests
+
+## Returns the series of several plots, from any number of cases, over the same time range
+# for drawing on one chart.  Each series parameter names one series, see _overlayRequests,
+# start and end optionally set the range, and points, method and format are taken as by
+# plotData.  The logs are loaded at the same time, and a case that takes longer than
+# OVERLAY_TIMEOUT seconds is left out and listed in 'errors' with the reason.
+@never_cache
+def plotOverlayData(request):
+	try:
+		requests=_overlayRequests(request)
+		format=wireformat.negotiate(request)
+		startTime=float(request.GET['start']) if 'start' in request.GET else None
+		endTime=float(request.GET['end']) if 'end' in request.GET else None
+		points=int(request.GET.get('points', Plot.maxPoints//len(requests)))
+		method=request.GET.get('method')
+	except ValueError, e:
+		return HttpResponseBadRequest(str(e))
+	if points < 1 or (method is not None and method not in DOWNSAMPLERS):
+		return HttpResponseBadRequest("Invalid points or method.")
+	(series, errors, startTime, endTime)=overlay.overlay(requests, startTime, endTime, points, method, OVERLAY_TIMEOUT)
+	extra={'errors':errors, 'minTime':startTime, 'maxTime':endTime}
+	with metrics.timed(ENCODE_SECONDS, 'encode', format=format):
+		(content, contentType)=wireformat.encode(series, format, extra)
+	return wireformat.gzipResponse(request, HttpResponse(content, content_type=contentType))
+
+## Renders a chart of several plots, from any number of cases, taking the same query
+# parameters as plotOverlayData.
+def plotOverlayView(request):
+	try:
+		requests=_overlayRequests(request)
+	except ValueError, e:
+		return HttpResponseBadRequest(str(e))
+	return render_to_response('percyval/features/plot/overlayView.html',{
+		'keys':[key for (key, feature, field) in requests],
+		'query':request.GET.urlencode(),
+	},context_instance=RequestContext(request))
+
+############## Metrics ################
+
+## Returns the metrics of this process in the Prometheus text format.  The metrics are only
+# served when PERCYVAL_METRICS is set, and then only to staff users or to the addresses in
+# PERCYVAL_METRICS_ALLOWED_IPS, which defaults to the local host.
+@never_cache
+def metricsView(request):
+	if not getattr(settings, 'PERCYVAL_METRICS', False):
+		return HttpResponseNotFound("Metrics are not turned on.")
+	allowed=getattr(settings, 'PERCYVAL_METRICS_ALLOWED_IPS', ['127.0.0.1', '::1'])
+	if not request.user.is_staff and request.META.get('REMOTE_ADDR') not in allowed:
+		return HttpResponseForbidden("Metrics are only served to staff users and allowed addresses.")
+	return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,143 @@
+#  Copyright 2011 David Irvine
+#
+#  This file is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This file is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with This file.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import time
+import logging
+import threading
+from django.conf import settings
+from percyval.logcache import getLogEntry
+
+log = logging.getLogger(__name__)
+
+## Watches a single log file on behalf of every client following it in this
+#  process.  A background thread stats the file every few seconds and, when it
+#  has grown, parses the new data once into the shared LogCache and wakes every
+#  waiting client.  The thread exits once nobody has been watching for a while.
+class LogWatcher(object):
+	## Seconds between checks of the log file.
+	INTERVAL=2
+	## Seconds the watcher keeps running after the last client leaves.
+	IDLE_TIMEOUT=60
+
+	def __init__(self, path):
+		self.path=path
+		self.lock=threading.RLock()
+		self.changed=threading.Condition(self.lock)
+		## Incremented every time new data is parsed.
+		self.version=0
+		self.stat=None
+		self.mtime=None
+		## The parser and offset it had reached when clients were last woken.
+		self.parsed=None
+		self.clients=0
+		self.idleSince=time.time()
+		self.thread=None
+
+	## Registers a client, starting the thread if needed.
+	def subscribe(self):
+		with self.lock:
+			self.clients+=1
+			if self.thread is None:
+				with _watchersLock:
+					_watchers.setdefault(self.path, self)
+				self.thread=threading.Thread(target=self.run, name="LogWatcher %s" % self.path)
+				self.thread.daemon=True
+				self.thread.start()
+
+	## Removes a client registered with subscribe.
+	def unsubscribe(self):
+		with self.lock:
+			self.clients-=1
+			if self.clients == 0:
+				self.idleSince=time.time()
+
+	## Blocks until data newer than version has been parsed, or timeout seconds have
+	#  passed.  Returns the current version.
+	def wait(self, version, timeout):
+		with self.lock:
+			if self.version == version:
+				self.changed.wait(timeout)
+			return self.version
+
+	## Stats the log file and parses any new data, returns True if there was some.
+	def check(self):
+		try:
+			st=os.stat(self.path)
+		except OSError:
+			return False
+		stat=(st.st_size, st.st_mtime, st.st_ino)
+		if stat == self.stat:
+			return False
+		self.stat=stat
+		self.mtime=st.st_mtime
+		entry=getLogEntry(self.path, not getattr(settings, 'PERCYVAL_INGEST_DAEMON', False))
+		with entry.lock:
+			parsed=(id(entry.parser), entry.parser.offset)
+		with self.lock:
+			if parsed == self.parsed:
+				return False
+			self.parsed=parsed
+			self.version+=1
+			self.changed.notify_all()
+		return True
+
+	def run(self):
+		while True:
+			try:
+				self.check()
+			except Exception:
+				log.exception("LogWatcher: failed to parse %s" % self.path)
+			time.sleep(self.INTERVAL)
+			with self.lock:
+				if self.clients == 0 and time.time()-self.idleSince > self.IDLE_TIMEOUT:
+					self.thread=None
+					with _watchersLock:
+						if _watchers.get(self.path) is self:
+							del _watchers[self.path]
+					return
+
+_watchers={}
+_watchersLock=threading.Lock()
+
+## Returns the watcher for the log file at path, creating it if needed.
+def getWatcher(path):
+	with _watchersLock:
+		try:
+			return _watchers[path]
+		except KeyError:
+			watcher=LogWatcher(path)
+			_watchers[path]=watcher
+			return watcher
+
+_streams=0
+_streamsLock=threading.Lock()
+
+## Claims one of the event streams this process may have open at once, set by
+#  PERCYVAL_MAX_EVENT_STREAMS.  Returns False if they are all in use.  Each open stream holds a
+#  server thread, so the limit must leave threads free for other requests.
+def openStream():
+	global _streams
+	with _streamsLock:
+		if _streams >= getattr(settings, 'PERCYVAL_MAX_EVENT_STREAMS', 8):
+			return False
+		_streams+=1
+		return True
+
+## Gives back a stream claimed with openStream.
+def closeStream():
+	global _streams
+	with _streamsLock:
+		_streams-=1
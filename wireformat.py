@@ -0,0 +1,187 @@
+#  Copyright 2011 David Irvine
+#
+#  This file is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This file is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with This file.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  Formats the series of a plot can be sent in.  The format is chosen by the
+#  format query parameter, or failing that the Accept header:
+#
+#    points   application/json, a list of {"key", "values":[{"x", "y"}]}, the default.
+#    columns  application/vnd.percyval.columns+json, a list of {"key", "x":[], "y":[]}.
+#    float32  application/vnd.percyval.float32, binary, see encodeBinary.
+#    float64  application/vnd.percyval.float64, binary, see encodeBinary.
+#
+#  float32 halves the size of float64 but keeps only about seven significant
+#  digits, so times late in a long run with a small time step are rounded.
+#
+#  The JSON formats may also be streamed with iterEncode, which sends the same
+#  data a series and a chunk of points at a time.
+import sys
+import json
+import zlib
+import struct
+from array import array
+from django.http import HttpResponse
+from django.utils.text import compress_string
+
+## Media types of the formats, by name.
+FORMATS={
+		'points':'application/json',
+		'columns':'application/vnd.percyval.columns+json',
+		'float32':'application/vnd.percyval.float32',
+		'float64':'application/vnd.percyval.float64',
+		}
+## Array type codes of the binary formats, by name.
+TYPECODES={
+		'float32':'f',
+		'float64':'d',
+		}
+## Responses smaller than this are not compressed.
+GZIP_MIN_SIZE=1024
+## Points of a series encoded at a time by iterEncode.
+STREAM_CHUNK=10000
+## Bytes of text iterGzip compresses before flushing what it has compressed to the client.
+STREAM_FLUSH_SIZE=65536
+
+## Returns the name of the format to send to request.  Raises ValueError if the format query
+#  parameter names an unknown format.
+def negotiate(request):
+	if 'format' in request.GET:
+		name=request.GET['format']
+		if name not in FORMATS:
+			raise ValueError("format must be one of %s." % ", ".join(sorted(FORMATS.keys())))
+		return name
+	accept=[part.split(";")[0].strip() for part in request.META.get('HTTP_ACCEPT', '').split(",")]
+	for name in ['float32', 'float64', 'columns']:
+		if FORMATS[name] in accept:
+			return name
+	return 'points'
+
+## Returns the series, a list of (name, times, values), in the points format.
+def toPoints(series):
+	return [{'key':name, 'values':[{'x':x,'y':y} for (x, y) in zip(times, values)]} for (name, times, values) in series]
+
+## Returns the series, a list of (name, times, values), in the columns format.
+def toColumns(series):
+	return [{'key':name, 'x':list(times), 'y':list(values)} for (name, times, values) in series]
+
+## Returns the series, a list of (name, times, values), in a binary format.  The body starts
+#  with the length of a JSON header as a little-endian unsigned 32 bit integer, followed by the
+#  header, padded with spaces so the arrays start on an 8 byte boundary.  The header holds
+#  the name of the format in 'type', a list of {"key", "length"} for each series in 'series'
+#  and any items of extra.  Then for each series in turn come its times and its values, as
+#  little-endian arrays of length floats, so a page can read each straight into a typed array.
+def encodeBinary(series, name, extra=None):
+	typecode=TYPECODES[name]
+	header={'type':name, 'series':[{'key':key, 'length':len(times)} for (key, times, values) in series]}
+	if extra:
+		header.update(extra)
+	header=json.dumps(header)
+	header+=" "*(-(4+len(header)) % 8)
+	parts=[struct.pack("<I", len(header)), header]
+	for (key, times, values) in series:
+		for column in [times, values]:
+			column=array(typecode, column)
+			if sys.byteorder != 'little':
+				column.byteswap()
+			parts.append(column.tostring())
+	return "".join(parts)
+
+## Returns the body and media type of the series, a list of (name, times, values), in the
+#  named format.  If extra is given the series are sent in its 'series' item, for the JSON
+#  formats, or its items are added to the header, for the binary formats.
+def encode(series, name, extra=None):
+	if name in TYPECODES:
+		return (encodeBinary(series, name, extra), FORMATS[name])
+	if name == 'columns':
+		data=toColumns(series)
+	else:
+		data=toPoints(series)
+	if extra is not None:
+		data=dict(extra, series=data)
+	return (json.dumps(data), FORMATS[name])
+
+# Yields the values of column as JSON, without the brackets, STREAM_CHUNK values at a time.
+def _iterValues(column):
+	for start in range(0, len(column), STREAM_CHUNK):
+		text=json.dumps(list(column[start:start+STREAM_CHUNK]))[1:-1]
+		if start:
+			text=", "+text
+		yield text
+
+## Yields the text of the series, an iterable of (name, times, values), in the named JSON format
+#  a piece at a time, holding the same data encode returns without extra.  Each series is only read
+#  when it is reached, and only STREAM_CHUNK of its points are encoded at a time, so the
+#  memory used does not grow with the number of points.  times and values need only support
+#  len and slicing.
+def iterEncode(series, name):
+	yield "["
+	for (i, (key, times, values)) in enumerate(series):
+		if i:
+			yield ", "
+		if name == 'columns':
+			yield '{"key": %s, "x": [' % json.dumps(key)
+			for text in _iterValues(times):
+				yield text
+			yield '], "y": ['
+			for text in _iterValues(values):
+				yield text
+			yield ']}'
+		else:
+			yield '{"key": %s, "values": [' % json.dumps(key)
+			for start in range(0, len(times), STREAM_CHUNK):
+				points=[{'x':x,'y':y} for (x, y) in zip(times[start:start+STREAM_CHUNK], values[start:start+STREAM_CHUNK])]
+				text=json.dumps(points)[1:-1]
+				if start:
+					text=", "+text
+				yield text
+			yield ']}'
+	yield "]"
+
+## Yields the pieces of text compressed with gzip.  What has been compressed is flushed every
+#  STREAM_FLUSH_SIZE bytes of text, so the client can read it while the rest is made.
+def iterGzip(pieces):
+	compressor=zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS|16)
+	pending=0
+	for piece in pieces:
+		data=compressor.compress(piece)
+		pending+=len(piece)
+		if pending >= STREAM_FLUSH_SIZE:
+			data+=compressor.flush(zlib.Z_SYNC_FLUSH)
+			pending=0
+		if data:
+			yield data
+	yield compressor.flush()
+
+## Returns a response sending the pieces of text as they are made, with the media type of the
+#  named format, compressed with gzip if request accepts it.
+def streamResponse(request, pieces, name):
+	if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+		response=HttpResponse(iterGzip(pieces), content_type=FORMATS[name])
+		response['Content-Encoding']='gzip'
+	else:
+		response=HttpResponse(pieces, content_type=FORMATS[name])
+	response['Vary']='Accept, Accept-Encoding'
+	response['X-Accel-Buffering']='no'
+	return response
+
+## Compresses the content of response with gzip if request accepts it and it is big enough to
+#  be worth it.  Returns the response.
+def gzipResponse(request, response):
+	response['Vary']='Accept, Accept-Encoding'
+	if 'gzip' not in request.META.get('HTTP_ACCEPT_ENCODING', '') or len(response.content) < GZIP_MIN_SIZE:
+		return response
+	response.content=compress_string(response.content)
+	response['Content-Encoding']='gzip'
+	response['Content-Length']=str(len(response.content))
+	return response